@@ -16,3 +16,24 @@ def run_agent(
     """
     result = run_and_save_prediction(symbol, horizon, model_id)
     return {"symbol": symbol, "horizon": horizon, "result": result}
+
+
+@router.get("/cache/stats")
+def cache_stats():
+    """
+    Thống kê price cache, indicator cache và result cache của process
+    (hit/miss/eviction, số byte đang dùng)
+    để chọn PRICE_CACHE_MAX_MB / INDICATOR_CACHE_MAX_MB phù hợp.
+    Lưu ý: với BACKTEST_JOB_EXECUTOR=process mỗi worker có cache riêng, số liệu ở đây
+    chỉ là của process FastAPI (dùng BACKTEST_JOB_EXECUTOR=thread để xem cache của job).
+    """
+    from app.services.backtest_engine import indicator_cache, price_cache
+    from app.services.rabbitmq import async_db_stats, batcher_stats, result_cache
+
+    return {
+        "price_cache": price_cache.stats() if price_cache is not None else {"enabled": False},
+        "indicator_cache": indicator_cache.stats() if indicator_cache is not None else {"enabled": False},
+        "result_cache": result_cache.stats() if result_cache is not None else {"enabled": False},
+        "job_batcher": batcher_stats(),
+        "async_db": async_db_stats(),
+    }
@@ -9,6 +9,8 @@ import math
 import random
 import time
 
+from app.services.streaming_indicators import VWAP, RollingVolatility, WilderRSI
+
 router = APIRouter()
 
 # ============================
@@ -92,6 +94,22 @@ class MarketDepthLevel:
     createdTime: Optional[float] = None
 
 
+@dataclass
+class TickIndicators:
+    """Chỉ báo tính dần theo từng tick (O(1) mỗi update, không giữ lịch sử giá)."""
+    rsi: WilderRSI
+    vwap: VWAP
+    volatility: RollingVolatility
+
+    @classmethod
+    def create(cls) -> "TickIndicators":
+        return cls(
+            rsi=WilderRSI(PARAMS["RSI_PERIOD"]),
+            vwap=VWAP(),
+            volatility=RollingVolatility(PARAMS["VOLATILITY_WINDOW"]),
+        )
+
+
 @dataclass
 class SimulatedMarketData:
     symbol: str
@@ -127,6 +145,11 @@ PARAMS = {
     "TRANSACTIONS_PER_MINUTE": 5,  # 5 giao dịch / phút
     "CANDLE_INTERVAL_MS": 60 * 1000,  # 1 nến = 1 phút
     "INITIAL_HISTORY_CANDLES": 10,  # Tạo sẵn 10 nến
+
+    # Chỉ báo live (streaming, state cố định theo mỗi mã)
+    "RSI_PERIOD": 14,
+    "VOLATILITY_WINDOW": 20,
+    "VOLUME_PROFILE_MAX_LEVELS": 50,
 }
 
 # Tính khoảng cách giữa các giao dịch (ms)
@@ -163,8 +186,8 @@ def randn() -> float:
 class MarketSimulationEngine:
     def __init__(self) -> None:
         self.market_data: Dict[str, SimulatedMarketData] = {}
-        # Lịch sử giá tick (để tính RSI/Volatility) vẫn giữ riêng
-        self.price_history_ticks: Dict[str, List[float]] = {}
+        # State chỉ báo theo tick (RSI/VWAP/Volatility), kích thước cố định cho mỗi mã
+        self.indicators: Dict[str, TickIndicators] = {}
 
         self._init_markets()
 
@@ -232,7 +255,11 @@ class MarketSimulationEngine:
             )
 
             self.market_data[symbol] = md
-            self.price_history_ticks[symbol] = [simulated_price]
+
+            # Warm-up chỉ báo bằng giá đóng cửa + volume của các nến lịch sử
+            self.indicators[symbol] = TickIndicators.create()
+            for candle in md.history:
+                self._update_indicators(md, candle.close, candle.volume)
 
             # Init order book giả
             self._update_order_book(md)
@@ -279,7 +306,7 @@ class MarketSimulationEngine:
         md.price = new_price
         md.volume += volume_tick  # Volume tổng tích lũy (hoặc tick volume tuỳ FE)
 
-        self.price_history_ticks[symbol].append(new_price)
+        self._update_indicators(md, new_price, volume_tick)
 
         # 3. Cập nhật nến (Candle Logic)
         if md.current_candle:
@@ -317,9 +344,8 @@ class MarketSimulationEngine:
             # Fallback nếu chưa có nến (hiếm khi xảy ra do init rồi)
             md.current_candle = Candle(now, new_price, new_price, new_price, new_price, volume_tick)
 
-        # 4. Update các thứ râu ria (Orderbook, RSI, etc)
+        # 4. Update các thứ râu ria (Orderbook; RSI/VWAP đã cập nhật ở trên)
         self._update_order_book(md)
-        # (Có thể thêm logic RSI, VWAP ở đây nếu cần chính xác)
 
         return md
 
@@ -335,6 +361,25 @@ class MarketSimulationEngine:
 
     # ... (Giữ nguyên các hàm internal helper như _best_bid, nhưng sửa update_order_book một chút) ...
 
+    def _update_indicators(self, md: SimulatedMarketData, price: float, volume: float) -> None:
+        """
+        Cập nhật RSI, VWAP, volatility và volume profile cho 1 tick mới.
+        """
+        ind = self.indicators[md.symbol]
+        md.rsi = ind.rsi.update(price)
+        md.vwap = ind.vwap.update(price, volume)
+
+        volatility = ind.volatility.update(price)
+        if volatility is not None:
+            md.volatility = volatility
+
+        # Volume profile: giới hạn số mức giá, bỏ mức xa giá hiện tại nhất
+        profile = md.volumeProfile
+        profile[price] = profile.get(price, 0.0) + volume
+        if len(profile) > PARAMS["VOLUME_PROFILE_MAX_LEVELS"]:
+            farthest = max(profile, key=lambda level: abs(level - price))
+            del profile[farthest]
+
     def _update_order_book(self, md: SimulatedMarketData) -> None:
         """
         Tạo lại order book dựa trên giá md.price hiện tại
@@ -32,11 +32,13 @@ print("--------------------------------------------------")
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
 # Các file này sẽ import backtest_engine, lúc này Env đã có dữ liệu -> OK
 from app.api import mq_test, backtest_api
 from app.api import market_simulation
 from app.services import rabbitmq
+from app.services.metrics import render_prometheus
 
 # ============================================================
 # 3) Lifespan: start / stop RabbitMQ consumer
@@ -86,6 +88,12 @@ app.include_router(market_simulation.router, prefix="/market", tags=["Market"])
 def root():
   return {"status": "ok", "message": "FastAPI backtest service running"}
 
+# Prometheus scrape: thời gian từng giai đoạn, jobs/s, queue lag, rows loaded, cache hit/miss
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    rabbitmq.refresh_consumer_metrics()
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
 # ============================================================
 # 6) Run trực tiếp
 # ============================================================
@@ -1,6 +1,6 @@
 # app/models/backtest_models.py
 from datetime import date
-from typing import Dict, List, Literal, Optional
+from typing import Any, Dict, List, Literal, Optional
 
 from pydantic import BaseModel
 
@@ -16,6 +16,8 @@ class BacktestJobMessage(BaseModel):
     initial_capital: float
     commission_rate: float
     job_config: Dict
+    # strategy JSON (name, rules[]) - tuỳ chọn, không có thì dùng chiến lược mặc định
+    strategy: Optional[Dict[str, Any]] = None
 
 
 class EquityPoint(BaseModel):
@@ -23,6 +25,19 @@ class EquityPoint(BaseModel):
     value: float
 
 
+class CompactSeries(BaseModel):
+    """
+    Chuỗi (time, value) dạng cột, gọn hơn List[EquityPoint]:
+      times[0] = timestamp tuyệt đối, times[i] = t[i] - t[i-1] (delta-encoded)
+      values[i] = giá trị tại t[i]
+    sourcePoints: số điểm gốc trước khi downsample (LTTB).
+    """
+    timeEncoding: Literal["delta"] = "delta"
+    times: List[int]
+    values: List[float]
+    sourcePoints: int
+
+
 class BacktestTrade(BaseModel):
     entryTime: int     # unix timestamp
     exitTime: int
@@ -33,6 +48,36 @@ class BacktestTrade(BaseModel):
     side: Literal["buy", "sell"]
 
 
+class MonteCarloDistribution(BaseModel):
+    """Phân phối 1 chỉ số qua mọi đường mô phỏng (netProfit theo tiền, maxDrawdown theo % dương)."""
+    mean: float
+    std: float
+    min: float
+    max: float
+    # "p5" -> phân vị thứ 5, ...
+    percentiles: Dict[str, float]
+    # Khoảng tin cậy 2 phía theo MonteCarloReport.confidence
+    ciLow: float
+    ciHigh: float
+
+
+class MonteCarloMethodResult(BaseModel):
+    # "trade_shuffle" | "trade_bootstrap" | "daily_block_bootstrap"
+    method: str
+    simulations: int
+    sampleSize: int                 # số lệnh / số ngày được lấy mẫu mỗi đường
+    blockSize: Optional[int] = None
+    netProfit: MonteCarloDistribution
+    maxDrawdown: MonteCarloDistribution
+    probabilityOfLoss: float        # tỉ lệ đường có netProfit < 0
+
+
+class MonteCarloReport(BaseModel):
+    confidence: float
+    seed: Optional[int] = None
+    methods: List[MonteCarloMethodResult]
+
+
 class BacktestResultMessage(BaseModel):
     job_id: int
     status: Literal["COMPLETED", "FAILED"]
@@ -46,3 +91,149 @@ class BacktestResultMessage(BaseModel):
     equityCurve: List[EquityPoint]
     underwater: List[EquityPoint]
     trades: List[BacktestTrade]
+
+    # job_config.result_format = "compact" -> 2 field dưới thay cho equityCurve/underwater (rỗng)
+    resultFormat: Literal["points", "compact"] = "points"
+    equityCurveCompact: Optional[CompactSeries] = None
+    underwaterCompact: Optional[CompactSeries] = None
+
+    # job_config.monte_carlo -> phân phối netProfit / maxDrawdown khi lấy mẫu lại lệnh & lợi nhuận ngày
+    monteCarlo: Optional[MonteCarloReport] = None
+
+    # Lý do FAILED (lỗi, job bị huỷ, quá timeout)
+    error: Optional[str] = None
+
+
+# ============================================================
+# Parameter sweep (grid optimization)
+# ============================================================
+
+class SweepJobMessage(BacktestJobMessage):
+    # key: tham số job_config (stop_loss, take_profit, sma_fast, sma_slow, rsi_period,
+    #      rsi_threshold) hoặc đường dẫn vào strategy, vd "rules.0.condition.params.period"
+    param_grid: Dict[str, List[Any]]
+    rank_by: str = "netProfit"
+    top_n: Optional[int] = None
+    max_workers: Optional[int] = None
+
+
+class SweepResultRow(BaseModel):
+    params: Dict[str, Any]
+    netProfit: float
+    winRate: float
+    maxDrawdown: float
+    profitFactor: float
+    totalTrades: int
+
+
+class SweepResultMessage(BaseModel):
+    job_id: int
+    status: Literal["COMPLETED", "FAILED"]
+    rankBy: str
+    totalCombinations: int
+    results: List[SweepResultRow]
+    error: Optional[str] = None
+
+
+# ============================================================
+# Walk-forward optimization
+# ============================================================
+
+class WalkForwardJobMessage(SweepJobMessage):
+    # Kích thước cửa sổ tính theo số bar (phiên giao dịch)
+    in_sample_bars: int = 252
+    out_of_sample_bars: int = 63
+    # Bước trượt giữa 2 fold, mặc định = out_of_sample_bars (OOS nối liền nhau)
+    step_bars: Optional[int] = None
+    # True: in-sample luôn bắt đầu từ đầu dữ liệu (anchored / expanding window)
+    anchored: bool = False
+
+
+class WalkForwardFold(BaseModel):
+    fold: int
+    inSampleFrom: int      # unix timestamp
+    inSampleTo: int
+    outOfSampleFrom: int
+    outOfSampleTo: int
+    bestParams: Dict[str, Any]
+    inSampleScore: float   # giá trị metric rank_by trên in-sample
+    outOfSampleNetProfit: float
+
+
+class WalkForwardResultMessage(BacktestResultMessage):
+    # Các field của BacktestResultMessage là equity curve OOS đã nối lại
+    folds: List[WalkForwardFold] = []
+
+
+# ============================================================
+# Multi-symbol portfolio backtest
+# ============================================================
+
+class PortfolioJobMessage(BacktestJobMessage):
+    symbols: List[str]
+    # Không dùng cho portfolio (xem symbols), giữ để tương thích BacktestJobMessage
+    symbol: Optional[str] = None
+    # Số vị thế mở tối đa cùng lúc (mặc định = số mã)
+    max_positions: Optional[int] = None
+    # Tỷ lệ equity phân bổ cho mỗi vị thế mới (mặc định = 1 / max_positions)
+    position_size_pct: Optional[float] = None
+
+
+class PortfolioTrade(BacktestTrade):
+    symbol: str
+
+
+class PortfolioSymbolSummary(BaseModel):
+    symbol: str
+    totalTrades: int
+    netProfit: float
+    winRate: float
+
+
+class PortfolioResultMessage(BacktestResultMessage):
+    trades: List[PortfolioTrade]
+    symbols: List[str] = []
+    perSymbol: List[PortfolioSymbolSummary] = []
+
+
+# ============================================================
+# Universe screener (1 strategy x nhiều mã, chỉ metric)
+# ============================================================
+
+class ScreenerJobMessage(BacktestJobMessage):
+    # Không dùng cho screener (xem symbols), giữ để tương thích BacktestJobMessage
+    symbol: Optional[str] = None
+    # None -> mọi mã trong bảng "Stock", lọc theo exchanges / sectors / active_only
+    symbols: Optional[List[str]] = None
+    exchanges: Optional[List[str]] = None
+    sectors: Optional[List[str]] = None
+    active_only: bool = True
+    rank_by: str = "netProfit"
+    top_n: Optional[int] = None
+    # Mã có ít lệnh hơn ngưỡng này không được xếp hạng (metric của vài lệnh không có ý nghĩa)
+    min_trades: int = 0
+    max_workers: Optional[int] = None
+
+
+class ScreenerResultRow(BaseModel):
+    rank: int
+    symbol: str
+    netProfit: float
+    winRate: float
+    maxDrawdown: float
+    profitFactor: float
+    totalTrades: int
+    bars: int               # số bar trong [data_from, data_to] của mã
+
+
+class ScreenerResultMessage(BaseModel):
+    job_id: int
+    status: Literal["COMPLETED", "FAILED"]
+    rankBy: str
+    totalSymbols: int       # số mã của universe
+    screenedSymbols: int    # số mã có dữ liệu và chạy xong
+    results: List[ScreenerResultRow]
+    # Mã không có giá trong khoảng yêu cầu / mã lỗi (symbol -> lý do)
+    noData: List[str] = []
+    failedSymbols: Dict[str, str] = {}
+    error: Optional[str] = None
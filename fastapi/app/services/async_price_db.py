@@ -0,0 +1,226 @@
+# app/services/async_price_db.py
+"""
+Đọc giá bất đồng bộ (asyncpg) cho consumer: I/O của nhiều job chồng lên nhau trên 1 event loop,
+phần CPU (chỉ báo + mô phỏng) vẫn chạy trên executor với dữ liệu đã load sẵn.
+
+Mỗi query đi qua statement cache của asyncpg -> được prepare 1 lần mỗi connection rồi dùng lại.
+Bật bằng BACKTEST_ASYNC_DB=1 (cần asyncpg); cấu hình:
+  BACKTEST_ASYNC_DB_MIN_SIZE / BACKTEST_ASYNC_DB_MAX_SIZE : kích thước pool
+  BACKTEST_ASYNC_DB_STATEMENT_CACHE                       : số prepared statement / connection
+  BACKTEST_ASYNC_DB_TIMEOUT                               : timeout mỗi query (giây)
+"""
+
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+try:
+    import asyncpg
+except ImportError:  # pragma: no cover - asyncpg là optional
+    asyncpg = None
+
+from app.services.backtest_engine import (
+    DB_URL,
+    _COPY_PRICE_COLUMNS,
+    _COPY_PRICE_FIELDS,
+    _price_arrays_to_frame,
+    _rows_to_price_arrays,
+)
+
+ASYNC_DB_ENABLED = os.getenv("BACKTEST_ASYNC_DB", "0").lower() in ("1", "true", "yes")
+ASYNC_DB_MIN_SIZE = int(os.getenv("BACKTEST_ASYNC_DB_MIN_SIZE", "2"))
+ASYNC_DB_MAX_SIZE = int(os.getenv("BACKTEST_ASYNC_DB_MAX_SIZE", "10"))
+ASYNC_DB_STATEMENT_CACHE = int(os.getenv("BACKTEST_ASYNC_DB_STATEMENT_CACHE", "100"))
+ASYNC_DB_TIMEOUT = float(os.getenv("BACKTEST_ASYNC_DB_TIMEOUT", "30"))
+
+# Cùng cột / ép kiểu với đường COPY của backtest_engine, tham số kiểu asyncpg ($n)
+_PRICE_QUERY = f"""
+    SELECT {_COPY_PRICE_COLUMNS}
+    FROM "StockPrice"
+    WHERE stock_symbol = $1
+      AND trade_date >= $2
+      AND trade_date <= $3
+    ORDER BY trade_date ASC
+"""
+_PRICE_QUERY_AFTER = _PRICE_QUERY.replace("trade_date >= $2", "trade_date > $2")
+_PRICE_BULK_QUERY = f"""
+    SELECT
+        array_position($1::text[], stock_symbol::text)::int4 AS symbol_idx,
+        {_COPY_PRICE_COLUMNS}
+    FROM "StockPrice"
+    WHERE stock_symbol = ANY($1::text[])
+      AND trade_date >= $2
+      AND trade_date <= $3
+    ORDER BY symbol_idx ASC, trade_date ASC
+"""
+# `bars` bar ngay trước $2 + [$2, $3] trong 1 round trip (cùng dạng với _warmup_union_query)
+_PRICE_WARMUP_QUERY = f"""
+    SELECT * FROM (
+        SELECT {_COPY_PRICE_COLUMNS}
+        FROM "StockPrice"
+        WHERE stock_symbol = $1
+          AND trade_date < $2
+        ORDER BY trade_date DESC
+        LIMIT $4
+    ) AS warmup
+    UNION ALL
+    SELECT {_COPY_PRICE_COLUMNS}
+    FROM "StockPrice"
+    WHERE stock_symbol = $1
+      AND trade_date >= $2
+      AND trade_date <= $3
+    ORDER BY ts ASC
+"""
+_VERSION_QUERY = """
+    SELECT COUNT(*) AS n_rows, MAX(trade_date) AS last_date
+    FROM "StockPrice"
+    WHERE stock_symbol = $1
+"""
+
+
+def asyncpg_dsn(url: Optional[str]) -> Optional[str]:
+    """URL kiểu SQLAlchemy (postgresql+psycopg2://...) -> DSN của asyncpg (postgresql://...)."""
+    if not url:
+        return None
+    scheme, sep, rest = url.partition("://")
+    return f"{scheme.split('+', 1)[0]}{sep}{rest}"
+
+
+class AsyncPriceDB:
+    """Pool asyncpg + các query giá (1 mã, nhiều mã trong 1 round trip, data version)."""
+
+    def __init__(
+        self,
+        dsn: str,
+        min_size: int = ASYNC_DB_MIN_SIZE,
+        max_size: int = ASYNC_DB_MAX_SIZE,
+        statement_cache_size: int = ASYNC_DB_STATEMENT_CACHE,
+        timeout: float = ASYNC_DB_TIMEOUT,
+    ) -> None:
+        if asyncpg is None:
+            raise RuntimeError("Async price loading requires asyncpg (pip install asyncpg)")
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max(min_size, max_size)
+        self.statement_cache_size = statement_cache_size
+        self.timeout = timeout
+        self._pool = None
+
+        self.queries = 0
+        self.rows = 0
+        self.seconds = 0.0
+
+    async def start(self) -> None:
+        if self._pool is None:
+            self._pool = await asyncpg.create_pool(
+                self.dsn,
+                min_size=self.min_size,
+                max_size=self.max_size,
+                statement_cache_size=self.statement_cache_size,
+                command_timeout=self.timeout,
+            )
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def _fetch(self, query: str, *args: Any) -> List[Any]:
+        if self._pool is None:
+            raise RuntimeError("AsyncPriceDB not started")
+        started = time.perf_counter()
+        async with self._pool.acquire() as conn:
+            records = await conn.fetch(query, *args, timeout=self.timeout)
+        self.queries += 1
+        self.rows += len(records)
+        self.seconds += time.perf_counter() - started
+        return records
+
+    async def fetch_price_arrays(
+        self,
+        symbol: str,
+        start: datetime,
+        end: datetime,
+        start_exclusive: bool = False,
+    ) -> Dict[str, np.ndarray]:
+        query = _PRICE_QUERY_AFTER if start_exclusive else _PRICE_QUERY
+        records = await self._fetch(query, symbol, start, end)
+        return _rows_to_price_arrays(records, [name for name, _ in _COPY_PRICE_FIELDS])
+
+    async def fetch_price_frame(
+        self,
+        symbol: str,
+        start: datetime,
+        end: datetime,
+        start_exclusive: bool = False,
+    ) -> pd.DataFrame:
+        """Cùng cột/kiểu với fetch_price_frame của engine (ts, trade_date, OHLCV)."""
+        return _price_arrays_to_frame(await self.fetch_price_arrays(symbol, start, end, start_exclusive))
+
+    async def fetch_price_frame_warmup(
+        self,
+        symbol: str,
+        start: datetime,
+        end: datetime,
+        bars: int,
+    ) -> pd.DataFrame:
+        """`bars` bar giao dịch trước start + [start, end] (warm-up chỉ báo theo số bar)."""
+        records = await self._fetch(_PRICE_WARMUP_QUERY, symbol, start, end, max(0, int(bars)))
+        return _price_arrays_to_frame(_rows_to_price_arrays(records, [name for name, _ in _COPY_PRICE_FIELDS]))
+
+    async def fetch_price_arrays_bulk(
+        self,
+        symbols: List[str],
+        start: datetime,
+        end: datetime,
+    ) -> Dict[str, Dict[str, np.ndarray]]:
+        """Nhiều mã trong 1 query: {symbol: {ts, open, ...}} (mã không có dữ liệu bị bỏ qua)."""
+        symbols = list(dict.fromkeys(symbols))
+        records = await self._fetch(_PRICE_BULK_QUERY, symbols, start, end)
+        arrays = _rows_to_price_arrays(records, ["symbol_idx", *(name for name, _ in _COPY_PRICE_FIELDS)])
+        idx = arrays.pop("symbol_idx")
+        bounds = np.searchsorted(idx, np.arange(1, len(symbols) + 2))
+        out: Dict[str, Dict[str, np.ndarray]] = {}
+        for i, symbol in enumerate(symbols):
+            lo, hi = bounds[i], bounds[i + 1]
+            if hi > lo:
+                out[symbol] = {col: values[lo:hi] for col, values in arrays.items()}
+        return out
+
+    async def data_version(self, symbol: str) -> str:
+        """Cùng định dạng với _pg_fetch_symbol_data_version (key của result cache)."""
+        row = (await self._fetch(_VERSION_QUERY, symbol))[0]
+        last = row["last_date"]
+        return f"{int(row['n_rows'])}:{pd.Timestamp(last) if last is not None else None}"
+
+    def stats(self) -> Dict[str, Any]:
+        pool = self._pool
+        return {
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "size": pool.get_size() if pool is not None else 0,
+            "idle": pool.get_idle_size() if pool is not None else 0,
+            "statement_cache_size": self.statement_cache_size,
+            "timeout": self.timeout,
+            "queries": self.queries,
+            "rows": self.rows,
+            "seconds": self.seconds,
+        }
+
+
+def make_async_price_db() -> Optional[AsyncPriceDB]:
+    """AsyncPriceDB theo env (None nếu chưa bật / thiếu asyncpg / chưa có DATABASE_URL)."""
+    if not ASYNC_DB_ENABLED:
+        return None
+    if asyncpg is None:
+        print("[FastAPI] ⚠ BACKTEST_ASYNC_DB=1 but asyncpg is not installed, using sync loader")
+        return None
+    dsn = asyncpg_dsn(DB_URL)
+    if dsn is None:
+        print("[FastAPI] ⚠ BACKTEST_ASYNC_DB=1 but DATABASE_URL is not set, using sync loader")
+        return None
+    return AsyncPriceDB(dsn)
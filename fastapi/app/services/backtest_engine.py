@@ -1,8 +1,10 @@
 # app/services/backtest_engine.py
 
 import os
-from datetime import datetime, date, timedelta
-from typing import List, Dict, Any, Optional
+import time
+from dataclasses import dataclass
+from datetime import datetime, date
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Type, Union
 
 import pandas as pd
 import numpy as np
@@ -14,6 +16,26 @@ from app.models.backtest_models import (
     BacktestTrade,
     EquityPoint,
 )
+from app.services.indicator_cache import IndicatorCache, SeriesSpan, series_span
+from app.services.job_control import CHECKPOINT_BARS, JobCancelled, JobControl
+from app.services.metrics import count_metric, stage_timer
+from app.services.monte_carlo import daily_closes, monte_carlo_options, run_monte_carlo, trade_returns
+from app.services.indicator_registry import (
+    Node,
+    column_name,
+    compute_indicator_columns,
+    depends_on_origin,
+    max_lookback,
+    params_tuple,
+    required_nodes,
+    rsi_kernel,
+    rule_node,
+    sma_kernel,
+)
+from app.services.pg_copy import FLOAT8, INT4, INT8, copy_query_arrays
+from app.services.price_cache import PriceSeriesCache
+from app.services.price_store import PRICE_STORE_DIR, LocalPriceStore
+from app.services.result_encoding import encode_curves
 
 # ============================================================
 # 1) CONFIG & DATABASE CONNECTION
@@ -33,8 +55,23 @@ if DB_URL:
 else:
     db_engine = None
 
-# Số ngày load thêm về quá khứ (Warm-up period) để tính chỉ báo
-LOOKBACK_BUFFER_DAYS = 90
+# Cách đọc giá từ Postgres: "copy" (COPY binary -> mảng NumPy, cần psycopg2) hoặc "read_sql"
+PG_FETCH_MODE = os.getenv("BACKTEST_PG_FETCH", "copy").lower()
+
+# Nguồn giá: "postgres" (mặc định) hoặc "local" (kho Arrow memory-map, xem price_store)
+PRICE_SOURCE_NAME = os.getenv("BACKTEST_PRICE_SOURCE", "postgres").lower()
+
+# Cache chuỗi giá trong process (xem mục 4)
+PRICE_CACHE_ENABLED = os.getenv("PRICE_CACHE_ENABLED", "1").lower() not in ("0", "false", "no")
+PRICE_CACHE_MAX_MB = float(os.getenv("PRICE_CACHE_MAX_MB", "256"))
+PRICE_CACHE_REFRESH_SECONDS = float(os.getenv("PRICE_CACHE_REFRESH_SECONDS", "60"))
+
+# Cache cột chỉ báo dùng chung giữa các job (xem mục 3)
+INDICATOR_CACHE_ENABLED = os.getenv("INDICATOR_CACHE_ENABLED", "1").lower() not in ("0", "false", "no")
+INDICATOR_CACHE_MAX_MB = float(os.getenv("INDICATOR_CACHE_MAX_MB", "128"))
+
+# Backtest streaming theo chunk cho mọi job (job_config.streaming override), xem streaming_engine
+STREAMING_DEFAULT = os.getenv("BACKTEST_STREAMING", "0").lower() in ("1", "true", "yes")
 
 
 # ============================================================
@@ -76,6 +113,7 @@ def _extract_required_indicators(strategy: Optional[Dict[str, Any]]) -> Dict[str
     Ví dụ:
       - SMA period 10, 50
       - RSI period 14
+      - MACD_SIGNAL (12, 26, 9), BB_UPPER (20, 2.0)  (nhiều tham số -> param key dạng tuple)
     """
     required: Dict[str, set] = {}
     if not strategy:
@@ -92,6 +130,13 @@ def _extract_required_indicators(strategy: Optional[Dict[str, Any]]) -> Dict[str
                 continue
             indicator = str(indicator).upper()
             params = side.get("params") or {}
+
+            # Indicator có trong registry (SMA, RSI, EMA, MACD, BOLLINGER...) -> node cần tính
+            node = rule_node(indicator, params)
+            if node is not None and node[1] is not None:
+                required.setdefault(node[0], set()).add(node[1])
+                continue
+
             period = params.get("period")
             if period is not None:
                 try:
@@ -105,42 +150,168 @@ def _extract_required_indicators(strategy: Optional[Dict[str, Any]]) -> Dict[str
     return required
 
 
-def _compute_rsi_series(close: pd.Series, period: int) -> pd.Series:
+# Tham số của chiến lược mặc định SMA/RSI, có thể override qua job_config
+# (dùng cho parameter sweep / tối ưu hoá).
+DEFAULT_STRATEGY_PARAMS: Dict[str, float] = {
+    "sma_fast": 10,
+    "sma_slow": 50,
+    "rsi_period": 14,
+    "rsi_threshold": 50.0,
+}
+
+# Cột chỉ báo mặc định luôn được tính (calculate_indicators): SMA10, SMA50, RSI14
+DEFAULT_INDICATOR_NODES: List[Node] = [
+    ("SMA", int(DEFAULT_STRATEGY_PARAMS["sma_fast"])),
+    ("SMA", int(DEFAULT_STRATEGY_PARAMS["sma_slow"])),
+    ("RSI", int(DEFAULT_STRATEGY_PARAMS["rsi_period"])),
+]
+# Số bar warm-up của riêng các cột mặc định (SMA50 -> 49)
+DEFAULT_WARMUP_BARS = max_lookback(DEFAULT_INDICATOR_NODES)
+
+
+def default_strategy_params(cfg: Optional[Dict[str, Any]]) -> Dict[str, float]:
+    """Đọc tham số chiến lược mặc định từ job_config (thiếu key -> giá trị mặc định)."""
+    cfg = cfg or {}
+    return {
+        "sma_fast": int(cfg.get("sma_fast", DEFAULT_STRATEGY_PARAMS["sma_fast"])),
+        "sma_slow": int(cfg.get("sma_slow", DEFAULT_STRATEGY_PARAMS["sma_slow"])),
+        "rsi_period": int(cfg.get("rsi_period", DEFAULT_STRATEGY_PARAMS["rsi_period"])),
+        "rsi_threshold": float(cfg.get("rsi_threshold", DEFAULT_STRATEGY_PARAMS["rsi_threshold"])),
+    }
+
+
+def default_strategy_columns(params: Dict[str, float]) -> Dict[str, str]:
+    """
+    Tên cột chỉ báo mà chiến lược mặc định sẽ đọc.
+    Chu kỳ trùng mặc định -> dùng cột sma_fast/sma_slow/rsi sẵn có,
+    khác mặc định -> cột sma_N / rsi_N (tính thêm khi load).
+    """
+    fast, slow, rsi_p = params["sma_fast"], params["sma_slow"], params["rsi_period"]
+    return {
+        "sma_fast": "sma_fast" if fast == DEFAULT_STRATEGY_PARAMS["sma_fast"] else f"sma_{fast}",
+        "sma_slow": "sma_slow" if slow == DEFAULT_STRATEGY_PARAMS["sma_slow"] else f"sma_{slow}",
+        "rsi": "rsi" if rsi_p == DEFAULT_STRATEGY_PARAMS["rsi_period"] else f"rsi_{rsi_p}",
+    }
+
+
+def required_indicators_for_job(job: BacktestJobMessage) -> Dict[str, set]:
+    """
+    Gom indicator/period cần tính cho 1 job:
+    - Có strategy.rules -> đọc từ rules.
+    - Không có -> các chu kỳ khác mặc định của chiến lược SMA/RSI (nếu job_config override).
+    """
+    strategy = _get_strategy_dict(job)
+    if strategy and strategy.get("rules"):
+        return _extract_required_indicators(strategy)
+
+    required: Dict[str, set] = {}
+    params = default_strategy_params(job.job_config)
+    columns = default_strategy_columns(params)
+    if columns["sma_fast"] != "sma_fast":
+        required.setdefault("SMA", set()).add(params["sma_fast"])
+    if columns["sma_slow"] != "sma_slow":
+        required.setdefault("SMA", set()).add(params["sma_slow"])
+    if columns["rsi"] != "rsi":
+        required.setdefault("RSI", set()).add(params["rsi_period"])
+    return required
+
+
+def indicator_warmup_bars(required: Optional[Dict[str, set]]) -> int:
     """
-    Tính RSI cho một chu kỳ bất kỳ.
+    Số bar giao dịch cần load trước data_from để mọi chỉ báo có giá trị ngay từ bar đầu tiên
+    (theo lookback của DAG chỉ báo). Chỉ báo thêm được tính sau dropna của calculate_indicators,
+    tức là bắt đầu từ bar mà cột mặc định đã đủ dữ liệu -> 2 phần warm-up cộng dồn.
     """
-    delta = close.diff()
-    gain = delta.where(delta > 0, 0.0)
-    loss = -delta.where(delta < 0, 0.0)
+    return DEFAULT_WARMUP_BARS + max_lookback(required_nodes(required or {}))
+
+
+def job_warmup_bars(job: BacktestJobMessage, required: Optional[Dict[str, set]] = None) -> int:
+    """Warm-up (số bar) của 1 job; required None -> suy ra từ strategy/job_config."""
+    if required is None:
+        required = required_indicators_for_job(job)
+    return indicator_warmup_bars(required)
 
-    avg_gain = gain.rolling(window=period, min_periods=period).mean()
-    avg_loss = loss.rolling(window=period, min_periods=period).mean()
 
-    rs = avg_gain / avg_loss
-    rsi = 100.0 - (100.0 / (1.0 + rs))
-    return rsi
+def merge_required_indicators(*items: Dict[str, set]) -> Dict[str, set]:
+    """Hợp (union) nhiều dict indicator -> set(period)."""
+    merged: Dict[str, set] = {}
+    for item in items:
+        for indicator, periods in item.items():
+            merged.setdefault(indicator, set()).update(periods)
+    return merged
 
 
 # ============================================================
 # 3) PANDAS INDICATOR CALCULATION
 # ============================================================
 
-def calculate_indicators(df: pd.DataFrame) -> pd.DataFrame:
+indicator_cache: Optional[IndicatorCache] = (
+    IndicatorCache(max_bytes=int(INDICATOR_CACHE_MAX_MB * 1024 * 1024))
+    if INDICATOR_CACHE_ENABLED
+    else None
+)
+
+# (symbol, lineage trong price_cache) của chuỗi giá đang tính; None -> không dùng cache
+SeriesKey = Tuple[str, int]
+
+
+def _frame_span(df: pd.DataFrame, series_key: Optional[SeriesKey]) -> Optional[SeriesSpan]:
+    if indicator_cache is None or series_key is None or "ts" not in df.columns:
+        return None
+    return series_span(series_key[0], series_key[1], df["ts"].to_numpy())
+
+
+def _cached_compute(
+    span: Optional[SeriesSpan],
+    origin_ts: Optional[int] = None,
+) -> Callable[[Node, Callable[[], np.ndarray]], np.ndarray]:
+    """
+    Bọc việc tính 1 node qua indicator_cache (span None -> tính thẳng).
+    origin_ts: ts của bar origin -> thuộc key của node phụ thuộc origin (EMA, MACD...).
+    """
+    def compute(node: Node, fn: Callable[[], np.ndarray]) -> np.ndarray:
+        if span is None:
+            return fn()
+        params = params_tuple(node[1])
+        if origin_ts is not None and depends_on_origin(node):
+            params = params + (("origin", origin_ts),)
+        return indicator_cache.get_or_compute(span, node[0], params, fn)
+
+    return compute
+
+
+def _sma_column(df: pd.DataFrame, period: int, span: Optional[SeriesSpan]) -> np.ndarray:
+    close = df["close"].to_numpy(dtype=float)
+    return _cached_compute(span)(("SMA", period), lambda: sma_kernel(close, period))
+
+
+def _rsi_column(df: pd.DataFrame, period: int, span: Optional[SeriesSpan]) -> np.ndarray:
+    close = df["close"].to_numpy(dtype=float)
+    return _cached_compute(span)(("RSI", period), lambda: rsi_kernel(close, period))
+
+
+def calculate_indicators(
+    df: pd.DataFrame,
+    series_key: Optional[SeriesKey] = None,
+) -> pd.DataFrame:
     """
     Tính toán các chỉ báo kỹ thuật mặc định bằng Pandas.
     Hiện tại: SMA10, SMA50, RSI14 (có thể mở rộng thêm sau).
+    series_key: (symbol, lineage) -> dùng lại cột đã tính trong indicator_cache.
     """
     # Đảm bảo các cột giá là float
     for col in ["close", "open", "high", "low"]:
         if col in df.columns:
             df[col] = df[col].astype(float)
 
+    span = _frame_span(df, series_key)
+
     # 1. SMA (Simple Moving Average) mặc định
-    df["sma_fast"] = df["close"].rolling(window=10, min_periods=10).mean()
-    df["sma_slow"] = df["close"].rolling(window=50, min_periods=50).mean()
+    df["sma_fast"] = _sma_column(df, 10, span)
+    df["sma_slow"] = _sma_column(df, 50, span)
 
     # 2. RSI mặc định (14)
-    df["rsi"] = _compute_rsi_series(df["close"], 14)
+    df["rsi"] = _rsi_column(df, 14, span)
 
     # Chỉ giữ lại những hàng đã có đủ chỉ báo mặc định
     df = df.dropna().reset_index(drop=True)
@@ -150,44 +321,45 @@ def calculate_indicators(df: pd.DataFrame) -> pd.DataFrame:
 def _compute_extra_indicators_for_strategy(
     df: pd.DataFrame,
     required: Dict[str, set],
+    series_key: Optional[SeriesKey] = None,
+    origin: Optional[int] = None,
 ) -> pd.DataFrame:
     """
     Dựa trên danh sách indicator/period cần từ strategy,
-    tính thêm các cột SMA_xx, RSI_xx... mà không đụng tới các cột mặc định.
+    tính thêm các cột sma_xx, rsi_xx, ema_xx, macd_*, bb_*... (theo indicator_registry)
+    mà không đụng tới các cột mặc định.
+    origin: chỉ số dòng đầu tiên >= data_from -> EMA được seed tại bar cố định trước data_from
+            (không phụ thuộc warm-up đã load, vd union warm-up của batch).
     """
     if not required:
         return df
 
-    # SMA
-    for period in required.get("SMA", set()):
-        col_name = f"sma_{period}"
-        if col_name not in df.columns:
-            df[col_name] = df["close"].rolling(window=period, min_periods=period).mean()
-
-    # RSI
-    for period in required.get("RSI", set()):
-        col_name = f"rsi_{period}"
-        if col_name not in df.columns:
-            df[col_name] = _compute_rsi_series(df["close"], period)
+    # Span tính sau dropna của calculate_indicators -> khác span của cột mặc định
+    span = _frame_span(df, series_key)
+    origin_ts = None
+    if span is not None and origin is not None and origin < len(df):
+        origin_ts = int(df["ts"].iat[origin])
 
-    # Các indicator khác (EMA, MACD, BOLLINGER...) có thể bổ sung sau.
-    # Hiện tại nếu user dùng, rule đó đơn giản là không kích hoạt
-    # vì chúng ta không có giá trị -> điều kiện luôn False.
+    # Registry giải DAG: node trung gian (EMA của MACD, SMA/STDDEV của Bollinger...)
+    # chỉ tính 1 lần; cột đã có trong df được dùng lại, không tính đè.
+    def get_column(name: str) -> Optional[np.ndarray]:
+        return df[name].to_numpy(dtype=float) if name in df.columns else None
 
-    return df
+    columns = compute_indicator_columns(
+        required_nodes(required), get_column, _cached_compute(span, origin_ts), origin
+    )
+    if not columns:
+        return df
+    # Gắn mọi cột 1 lần (insert từng cột làm DataFrame phân mảnh khi strategy có nhiều rule)
+    return pd.concat([df, pd.DataFrame(columns, index=df.index)], axis=1)
 
 
 # ============================================================
 # 4) DATA LOADING (With Warm-up & Type Casting)
 # ============================================================
 
-def load_data_as_dataframe(job: BacktestJobMessage) -> pd.DataFrame:
-    print(f"[FastAPI] Loading data for {job.symbol}...")
-
-    if not db_engine:
-        raise RuntimeError("DB Engine not initialized. Check DATABASE_URL in .env")
-
-    # Xử lý ngày tháng input
+def job_datetime_range(job: BacktestJobMessage) -> Tuple[datetime, datetime]:
+    """Khoảng thời gian user yêu cầu: [đầu ngày data_from, cuối ngày data_to]."""
     if isinstance(job.data_from, date):
         dt_from_req = datetime.combine(job.data_from, datetime.min.time())
     else:
@@ -198,53 +370,614 @@ def load_data_as_dataframe(job: BacktestJobMessage) -> pd.DataFrame:
     else:
         dt_to_req = job.data_to
 
-    # Warm-up: lấy thêm dữ liệu trước đó để tính chỉ báo
-    dt_fetch_from = dt_from_req - timedelta(days=LOOKBACK_BUFFER_DAYS)
+    return dt_from_req, dt_to_req
+
+
+def slice_with_warmup(df: pd.DataFrame, start: datetime, end: datetime, bars: int) -> pd.DataFrame:
+    """Cắt giá đã load sẵn (sort theo trade_date): `bars` dòng ngay trước start + các dòng trong [start, end]."""
+    # cache=False: heuristic cache của to_datetime duyệt từng phần tử (~ms / vài nghìn dòng),
+    # vô ích khi cột đã là datetime - đáng kể khi screener chạy hàng nghìn mã
+    dates = pd.to_datetime(df["trade_date"], cache=False).to_numpy(dtype="datetime64[ns]")
+    lo = int(np.searchsorted(dates, np.datetime64(start, "ns"), side="left"))
+    hi = int(np.searchsorted(dates, np.datetime64(end, "ns"), side="right"))
+    return df.iloc[max(0, lo - bars):hi].reset_index(drop=True)
+
+
+@dataclass
+class PriceSource:
+    """
+    Nguồn giá của engine (mặc định: bảng "StockPrice" trên Postgres).
+      fetch(symbol, start, end, start_exclusive=False) -> ts, trade_date, open, high, low, close, volume
+      fetch_bulk(symbols, start, end)                   -> như trên + cột stock_symbol
+      data_version(symbol)                              -> chuỗi đổi khi dữ liệu của mã đổi
+      warmup_start(symbols, start, bars)                -> trade_date sớm nhất trong `bars` bar trước start
+      fetch_warmup(symbol, start, end, bars)            -> `bars` bar trước start + [start, end] (1 lần đọc)
+      stream(symbol, start, end, bars, chunk_rows)      -> như fetch_warmup nhưng trả về từng chunk
+                                                           <= chunk_rows dòng (streaming_engine)
+      list_symbols(exchanges, sectors, active_only)     -> danh sách mã của universe (screener)
+    Các hàm warm-up / stream là tuỳ chọn: thiếu -> suy ra từ fetch (đọc cả lịch sử trước start).
+    Benchmark / công cụ offline thay nguồn qua set_price_source().
+    """
+    name: str
+    fetch: Callable[..., pd.DataFrame]
+    fetch_bulk: Callable[[List[str], datetime, datetime], pd.DataFrame]
+    data_version: Callable[[str], str]
+    requires_db: bool = False
+    warmup_start: Optional[Callable[[List[str], datetime, int], datetime]] = None
+    fetch_warmup: Optional[Callable[[str, datetime, datetime, int], pd.DataFrame]] = None
+    stream: Optional[Callable[[str, datetime, datetime, int, int], Iterator[pd.DataFrame]]] = None
+    list_symbols: Optional[Callable[..., List[str]]] = None
+
+
+# Cột của đường COPY binary: chỉ ts (trade_date suy ra từ ts) + OHLCV, đã ép kiểu trên server
+_COPY_PRICE_FIELDS = [
+    ("ts", INT8),
+    ("open", FLOAT8),
+    ("high", FLOAT8),
+    ("low", FLOAT8),
+    ("close", FLOAT8),
+    ("volume", FLOAT8),
+]
+# Giá NULL -> NaN (giống pd.read_sql), giữ mọi cột cố định 8 byte
+_COPY_PRICE_COLUMNS = """
+            EXTRACT(EPOCH FROM trade_date)::int8          AS ts,
+            COALESCE(open_price::float8, 'NaN'::float8)  AS open,
+            COALESCE(high_price::float8, 'NaN'::float8)  AS high,
+            COALESCE(low_price::float8, 'NaN'::float8)   AS low,
+            COALESCE(close_price::float8, 'NaN'::float8) AS close,
+            COALESCE(volume, 0)::float8                  AS volume
+"""
+
+
+# Cột của đường read_sql (trade_date giữ kiểu timestamp của DB)
+_READ_SQL_PRICE_COLUMNS = """
+            EXTRACT(EPOCH FROM trade_date)::bigint AS ts,
+            trade_date,
+            open_price::float  AS open,
+            high_price::float  AS high,
+            low_price::float   AS low,
+            close_price::float AS close,
+            COALESCE(volume, 0)::float AS volume
+"""
+
+
+def _warmup_union_query(columns: str) -> str:
+    """
+    `bars` bar ngay trước start (ORDER BY trade_date DESC LIMIT, đi ngược trên index)
+    UNION ALL các dòng trong [start, end] -> warm-up chính xác theo số bar trong 1 round trip.
+    """
+    return f"""
+        SELECT * FROM (
+            SELECT {columns}
+            FROM "StockPrice"
+            WHERE stock_symbol = %(symbol)s
+              AND trade_date < %(start)s
+            ORDER BY trade_date DESC
+            LIMIT %(bars)s
+        ) AS warmup
+        UNION ALL
+        SELECT {columns}
+        FROM "StockPrice"
+        WHERE stock_symbol = %(symbol)s
+          AND trade_date >= %(start)s
+          AND trade_date <= %(end)s
+        ORDER BY ts ASC
+    """
+
+
+def _use_copy_fetch() -> bool:
+    return PG_FETCH_MODE == "copy" and db_engine is not None and db_engine.dialect.driver == "psycopg2"
+
+
+def _price_arrays_to_frame(arrays: Dict[str, np.ndarray]) -> pd.DataFrame:
+    """Mảng từ COPY -> DataFrame đúng cột như query read_sql (trade_date tính từ ts)."""
+    frame = {"ts": arrays["ts"], "trade_date": arrays["ts"].astype("datetime64[s]").astype("datetime64[ns]")}
+    frame.update((col, arrays[col]) for col in ("open", "high", "low", "close", "volume"))
+    return pd.DataFrame(frame, copy=False)
+
+
+def _rows_to_price_arrays(rows: Sequence[Any], names: List[str]) -> Dict[str, np.ndarray]:
+    """Dòng (int8 / float8, NOT NULL) -> {cột: mảng} bằng 1 lần chuyển sang ma trận float64."""
+    matrix = np.array(rows, dtype=np.float64).reshape(len(rows), len(names))
+    out = {name: matrix[:, i].copy() for i, name in enumerate(names)}
+    # ts / symbol_idx < 2^53 -> qua float64 vẫn chính xác
+    for name in ("ts", "symbol_idx"):
+        if name in out:
+            out[name] = out[name].astype(np.int64)
+    return out
+
+
+def _pg_fetch_price_arrays(
+    symbol: str,
+    start: datetime,
+    end: datetime,
+    start_exclusive: bool = False,
+) -> Dict[str, np.ndarray]:
+    """Giá của 1 mã qua COPY binary: {ts, open, high, low, close, volume} (sort theo ngày)."""
+    if not db_engine:
+        raise RuntimeError("DB Engine not initialized. Check DATABASE_URL in .env")
+
+    start_op = ">" if start_exclusive else ">="
+    query = f"""
+        SELECT {_COPY_PRICE_COLUMNS}
+        FROM "StockPrice"
+        WHERE stock_symbol = %(symbol)s
+          AND trade_date {start_op} %(start)s
+          AND trade_date <= %(end)s
+        ORDER BY trade_date ASC
+    """
+    return copy_query_arrays(
+        db_engine, query, {"symbol": symbol, "start": start, "end": end}, _COPY_PRICE_FIELDS
+    )
+
+
+def _pg_fetch_price_arrays_bulk(
+    symbols: List[str],
+    start: datetime,
+    end: datetime,
+) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    Giá của nhiều mã trong 1 lần COPY (1 round trip): {symbol: {ts, open, ...}}.
+    Mã được gửi dưới dạng chỉ số trong symbols (int4) để dòng vẫn cố định độ rộng.
+    """
+    if not db_engine:
+        raise RuntimeError("DB Engine not initialized. Check DATABASE_URL in .env")
+
+    symbols = list(dict.fromkeys(symbols))
+    query = f"""
+        SELECT
+            array_position(%(symbols)s::text[], stock_symbol::text)::int4 AS symbol_idx,
+            {_COPY_PRICE_COLUMNS}
+        FROM "StockPrice"
+        WHERE stock_symbol = ANY(%(symbols)s)
+          AND trade_date >= %(start)s
+          AND trade_date <= %(end)s
+        ORDER BY symbol_idx ASC, trade_date ASC
+    """
+    arrays = copy_query_arrays(
+        db_engine,
+        query,
+        {"symbols": symbols, "start": start, "end": end},
+        [("symbol_idx", INT4), *_COPY_PRICE_FIELDS],
+    )
+    # Dòng đã sort theo symbol_idx -> mỗi mã là 1 đoạn liên tiếp, cắt bằng searchsorted (view)
+    idx = arrays.pop("symbol_idx")
+    bounds = np.searchsorted(idx, np.arange(1, len(symbols) + 2))
+    out: Dict[str, Dict[str, np.ndarray]] = {}
+    for i, symbol in enumerate(symbols):
+        lo, hi = bounds[i], bounds[i + 1]
+        if hi > lo:
+            out[symbol] = {col: values[lo:hi] for col, values in arrays.items()}
+    return out
+
+
+def _pg_fetch_price_frame_bulk(
+    symbols: List[str],
+    start: datetime,
+    end: datetime,
+) -> pd.DataFrame:
+    """
+    Load giá của nhiều mã trong 1 query (dạng long: stock_symbol, ts, trade_date, OHLC).
+    """
+    if not db_engine:
+        raise RuntimeError("DB Engine not initialized. Check DATABASE_URL in .env")
+
+    if _use_copy_fetch():
+        per_symbol = _pg_fetch_price_arrays_bulk(symbols, start, end)
+        empty = {col: np.empty(0, dtype=np.dtype(kind).newbyteorder("=")) for col, kind in _COPY_PRICE_FIELDS}
+        parts = list(per_symbol.values()) or [empty]
+        long = {col: np.concatenate([part[col] for part in parts]) for col, _ in _COPY_PRICE_FIELDS}
+        names = np.repeat(
+            np.array(list(per_symbol), dtype=object),
+            [len(part["ts"]) for part in per_symbol.values()],
+        )
+        # Cùng thứ tự với query read_sql: trade_date rồi stock_symbol
+        order = np.lexsort((names.astype(str), long["ts"]))
+        df = _price_arrays_to_frame({col: values[order] for col, values in long.items()})
+        df.insert(0, "stock_symbol", names[order])
+        return df
 
     query = """
         SELECT
+            stock_symbol,
             EXTRACT(EPOCH FROM trade_date)::bigint AS ts,
             trade_date,
             open_price::float  AS open,
             high_price::float  AS high,
             low_price::float   AS low,
-            close_price::float AS close
+            close_price::float AS close,
+            COALESCE(volume, 0)::float AS volume
         FROM "StockPrice"
-        WHERE stock_symbol = %(symbol)s
+        WHERE stock_symbol = ANY(%(symbols)s)
           AND trade_date >= %(start)s
           AND trade_date <= %(end)s
+        ORDER BY trade_date ASC, stock_symbol ASC
+    """
+    return pd.read_sql(
+        query,
+        db_engine,
+        params={"symbols": list(symbols), "start": start, "end": end},
+    )
+
+
+def _pg_fetch_price_frame(
+    symbol: str,
+    start: datetime,
+    end: datetime,
+    start_exclusive: bool = False,
+) -> pd.DataFrame:
+    """
+    Load giá của 1 mã trong [start, end] (hoặc (start, end] nếu start_exclusive=True,
+    dùng cho refresh tăng dần của price cache).
+    """
+    if not db_engine:
+        raise RuntimeError("DB Engine not initialized. Check DATABASE_URL in .env")
+
+    if _use_copy_fetch():
+        return _price_arrays_to_frame(_pg_fetch_price_arrays(symbol, start, end, start_exclusive))
+
+    start_op = ">" if start_exclusive else ">="
+    query = f"""
+        SELECT {_READ_SQL_PRICE_COLUMNS}
+        FROM "StockPrice"
+        WHERE stock_symbol = %(symbol)s
+          AND trade_date {start_op} %(start)s
+          AND trade_date <= %(end)s
         ORDER BY trade_date ASC
     """
+    return pd.read_sql(
+        query,
+        db_engine,
+        params={"symbol": symbol, "start": start, "end": end},
+    )
+
+
+def _pg_fetch_price_frame_warmup(
+    symbol: str,
+    start: datetime,
+    end: datetime,
+    bars: int,
+) -> pd.DataFrame:
+    """Giá của 1 mã: `bars` bar giao dịch ngay trước start + [start, end], trong 1 query."""
+    if not db_engine:
+        raise RuntimeError("DB Engine not initialized. Check DATABASE_URL in .env")
+
+    params = {"symbol": symbol, "start": start, "end": end, "bars": max(0, int(bars))}
+    if _use_copy_fetch():
+        return _price_arrays_to_frame(
+            copy_query_arrays(db_engine, _warmup_union_query(_COPY_PRICE_COLUMNS), params, _COPY_PRICE_FIELDS)
+        )
+    return pd.read_sql(_warmup_union_query(_READ_SQL_PRICE_COLUMNS), db_engine, params=params)
+
+
+def _pg_stream_price_frames(
+    symbol: str,
+    start: datetime,
+    end: datetime,
+    bars: int,
+    chunk_rows: int,
+) -> Iterator[pd.DataFrame]:
+    """
+    Cùng dữ liệu với _pg_fetch_price_frame_warmup nhưng đọc qua server-side cursor (psycopg2
+    named cursor): mỗi lần chỉ kéo chunk_rows dòng về client -> bộ nhớ không phụ thuộc độ dài lịch sử.
+    """
+    if not db_engine:
+        raise RuntimeError("DB Engine not initialized. Check DATABASE_URL in .env")
 
-    try:
-        df = pd.read_sql(
-            query,
-            db_engine,
-            params={
-                "symbol": job.symbol,
-                "start": dt_fetch_from,
-                "end": dt_to_req,
-            },
+    params = {"symbol": symbol, "start": start, "end": end, "bars": max(0, int(bars))}
+    if db_engine.dialect.driver != "psycopg2":
+        yield from pd.read_sql(
+            _warmup_union_query(_READ_SQL_PRICE_COLUMNS), db_engine, params=params, chunksize=chunk_rows
         )
+        return
+
+    names = [name for name, _ in _COPY_PRICE_FIELDS]
+    conn = db_engine.raw_connection()
+    try:
+        cur = conn.cursor(name=f"backtest_stream_{os.getpid()}_{id(params)}")
+        cur.itersize = chunk_rows
+        try:
+            cur.execute(_warmup_union_query(_COPY_PRICE_COLUMNS), params)
+            while True:
+                rows = cur.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                yield _price_arrays_to_frame(_rows_to_price_arrays(rows, names))
+        finally:
+            cur.close()
+            conn.rollback()
+    finally:
+        conn.close()
+
+
+def _pg_fetch_warmup_start(symbols: List[str], start: datetime, bars: int) -> datetime:
+    """
+    trade_date sớm nhất trong `bars` bar ngay trước start của mỗi mã (1 query cho mọi mã);
+    start nếu không mã nào có dữ liệu trước start.
+    """
+    if not db_engine:
+        raise RuntimeError("DB Engine not initialized. Check DATABASE_URL in .env")
+    if bars <= 0:
+        return start
+
+    query = """
+        SELECT MIN(trade_date) AS warmup_from
+        FROM (
+            SELECT
+                trade_date,
+                ROW_NUMBER() OVER (PARTITION BY stock_symbol ORDER BY trade_date DESC) AS bar_back
+            FROM "StockPrice"
+            WHERE stock_symbol = ANY(%(symbols)s)
+              AND trade_date < %(start)s
+        ) AS warmup
+        WHERE bar_back <= %(bars)s
+    """
+    value = pd.read_sql(
+        query,
+        db_engine,
+        params={"symbols": list(dict.fromkeys(symbols)), "start": start, "bars": int(bars)},
+    )["warmup_from"].iloc[0]
+    return start if value is None or pd.isna(value) else pd.Timestamp(value).to_pydatetime()
+
+
+def _pg_fetch_symbol_data_version(symbol: str) -> str:
+    """
+    "Data version" rẻ của 1 mã trên DB: số dòng + trade_date lớn nhất.
+    Có dòng StockPrice mới (kể cả điền bù ngày cũ) -> version đổi.
+    """
+    if not db_engine:
+        raise RuntimeError("DB Engine not initialized. Check DATABASE_URL in .env")
+
+    query = """
+        SELECT COUNT(*) AS n_rows, MAX(trade_date) AS last_date
+        FROM "StockPrice"
+        WHERE stock_symbol = %(symbol)s
+    """
+    row = pd.read_sql(query, db_engine, params={"symbol": symbol}).iloc[0]
+    return f"{int(row['n_rows'])}:{row['last_date']}"
+
+
+def _pg_list_symbols(
+    exchanges: Optional[List[str]] = None,
+    sectors: Optional[List[str]] = None,
+    active_only: bool = True,
+) -> List[str]:
+    """Mã trong bảng "Stock" (lọc theo sàn / ngành / is_active), sort theo symbol."""
+    if not db_engine:
+        raise RuntimeError("DB Engine not initialized. Check DATABASE_URL in .env")
+
+    conditions = ["TRUE"]
+    params: Dict[str, Any] = {}
+    if active_only:
+        conditions.append("is_active")
+    if exchanges:
+        conditions.append("exchange = ANY(%(exchanges)s)")
+        params["exchanges"] = list(exchanges)
+    if sectors:
+        conditions.append("sector = ANY(%(sectors)s)")
+        params["sectors"] = list(sectors)
+    query = f"""
+        SELECT symbol
+        FROM "Stock"
+        WHERE {" AND ".join(conditions)}
+        ORDER BY symbol ASC
+    """
+    return pd.read_sql(query, db_engine, params=params)["symbol"].tolist()
+
+
+POSTGRES_PRICE_SOURCE = PriceSource(
+    name="postgres",
+    fetch=_pg_fetch_price_frame,
+    fetch_bulk=_pg_fetch_price_frame_bulk,
+    data_version=_pg_fetch_symbol_data_version,
+    requires_db=True,
+    warmup_start=_pg_fetch_warmup_start,
+    fetch_warmup=_pg_fetch_price_frame_warmup,
+    stream=_pg_stream_price_frames,
+    list_symbols=_pg_list_symbols,
+)
+
+
+
+def make_local_price_source(store: Optional[LocalPriceStore] = None) -> PriceSource:
+    """Nguồn giá đọc từ kho cục bộ (file Arrow theo mã, đồng bộ bằng price_store sync)."""
+    store = store if store is not None else LocalPriceStore(PRICE_STORE_DIR)
+
+    def list_symbols(
+        exchanges: Optional[List[str]] = None,
+        sectors: Optional[List[str]] = None,
+        active_only: bool = True,
+    ) -> List[str]:
+        # Kho cục bộ chỉ có giá, không có metadata của bảng "Stock" (sàn, ngành, is_active)
+        if exchanges or sectors:
+            raise ValueError("Local price store cannot filter by exchange/sector, pass symbols instead")
+        return store.symbols()
+
+    return PriceSource(
+        name="local",
+        fetch=store.fetch,
+        fetch_bulk=store.fetch_bulk,
+        data_version=store.data_version,
+        warmup_start=store.warmup_start,
+        fetch_warmup=store.fetch_warmup,
+        stream=store.stream_warmup,
+        list_symbols=list_symbols,
+    )
+
+
+price_source: PriceSource = (
+    make_local_price_source() if PRICE_SOURCE_NAME == "local" else POSTGRES_PRICE_SOURCE
+)
+
+
+def fetch_price_frame(
+    symbol: str,
+    start: datetime,
+    end: datetime,
+    start_exclusive: bool = False,
+) -> pd.DataFrame:
+    """Giá của 1 mã từ nguồn hiện tại (xem PriceSource)."""
+    return price_source.fetch(symbol, start, end, start_exclusive=start_exclusive)
+
+
+def fetch_price_frame_bulk(
+    symbols: List[str],
+    start: datetime,
+    end: datetime,
+) -> pd.DataFrame:
+    """Giá của nhiều mã (dạng long, có stock_symbol) từ nguồn hiện tại."""
+    return price_source.fetch_bulk(symbols, start, end)
+
+
+# Đầu "toàn bộ lịch sử" cho nguồn giá không có hàm warm-up riêng
+_HISTORY_START = datetime(1900, 1, 1)
+
+
+def fetch_warmup_start(symbols: List[str], start: datetime, bars: int) -> datetime:
+    """Ngày bắt đầu load để mỗi mã có `bars` bar giao dịch trước start (xem PriceSource)."""
+    if bars <= 0:
+        return start
+    if price_source.warmup_start is not None:
+        return price_source.warmup_start(symbols, start, bars)
+    earliest = start
+    for symbol in dict.fromkeys(symbols):
+        history = price_source.fetch(symbol, _HISTORY_START, start)
+        dates = pd.to_datetime(history["trade_date"]).to_numpy(dtype="datetime64[ns]")
+        dates = dates[dates < np.datetime64(start, "ns")]
+        if len(dates):
+            earliest = min(earliest, pd.Timestamp(dates[max(0, len(dates) - bars)]).to_pydatetime())
+    return earliest
+
+
+def fetch_price_frame_warmup(symbol: str, start: datetime, end: datetime, bars: int) -> pd.DataFrame:
+    """Giá của 1 mã: `bars` bar giao dịch trước start + [start, end] từ nguồn hiện tại."""
+    if price_source.fetch_warmup is not None:
+        return price_source.fetch_warmup(symbol, start, end, bars)
+    return fetch_price_frame(symbol, fetch_warmup_start([symbol], start, bars), end)
+
+
+def stream_price_frames(
+    symbol: str,
+    start: datetime,
+    end: datetime,
+    bars: int,
+    chunk_rows: int,
+) -> Iterator[pd.DataFrame]:
+    """Giá của 1 mã (`bars` bar warm-up + [start, end]) theo từng chunk <= chunk_rows dòng."""
+    chunk_rows = max(1, int(chunk_rows))
+    if price_source.stream is not None:
+        yield from price_source.stream(symbol, start, end, bars, chunk_rows)
+        return
+    # Nguồn không hỗ trợ đọc theo chunk: load 1 lần rồi chia nhỏ (kết quả giống hệt)
+    df = fetch_price_frame_warmup(symbol, start, end, bars)
+    for lo in range(0, len(df), chunk_rows):
+        yield df.iloc[lo:lo + chunk_rows].reset_index(drop=True)
+
+
+def fetch_symbol_data_version(symbol: str) -> str:
+    """Data version của 1 mã theo nguồn hiện tại (key cho price/indicator/result cache)."""
+    return price_source.data_version(symbol)
+
+
+def list_universe_symbols(
+    exchanges: Optional[List[str]] = None,
+    sectors: Optional[List[str]] = None,
+    active_only: bool = True,
+) -> List[str]:
+    """Universe của nguồn giá hiện tại (Postgres: bảng "Stock") - dùng khi job không liệt kê mã."""
+    if price_source.list_symbols is None:
+        raise ValueError(f"Price source {price_source.name!r} cannot list symbols, pass symbols instead")
+    return price_source.list_symbols(exchanges=exchanges, sectors=sectors, active_only=active_only)
+
+
+def set_price_source(source: PriceSource) -> PriceSource:
+    """
+    Đổi nguồn giá của process (trả về nguồn cũ để khôi phục).
+    Cache giá & chỉ báo được xoá vì dữ liệu cũ thuộc nguồn khác.
+    """
+    global price_source
+    previous, price_source = price_source, source
+    if price_cache is not None:
+        price_cache.invalidate()
+    if indicator_cache is not None:
+        indicator_cache.invalidate()
+    return previous
+
+
+# Cache toàn cục của worker: hit -> slice mảng đã cache, miss/refresh -> chỉ query phần thiếu
+price_cache: Optional[PriceSeriesCache] = (
+    PriceSeriesCache(
+        fetch_fn=fetch_price_frame,
+        bulk_fetch_fn=fetch_price_frame_bulk,
+        max_bytes=int(PRICE_CACHE_MAX_MB * 1024 * 1024),
+        refresh_seconds=PRICE_CACHE_REFRESH_SECONDS,
+        warmup_start_fn=fetch_warmup_start,
+    )
+    if PRICE_CACHE_ENABLED
+    else None
+)
+
+
+def load_data_as_dataframe(
+    job: BacktestJobMessage,
+    required: Optional[Dict[str, set]] = None,
+    prices: Optional[pd.DataFrame] = None,
+) -> pd.DataFrame:
+    """
+    Load giá + tính chỉ báo cho job.
+    required: indicator/period cần tính thêm; None -> suy ra từ strategy/job_config của job.
+    prices: giá đã load sẵn gồm đủ warm-up (job_warmup_bars) trước data_from
+            (vd consumer đọc qua async_price_db); None -> đọc qua price cache / price source.
+    Warm-up là đúng N bar giao dịch trước data_from, N lấy từ lookback của DAG chỉ báo.
+    """
+    print(f"[FastAPI] Loading data for {job.symbol}...")
+
+    if prices is None and price_source.requires_db and not db_engine:
+        raise RuntimeError("DB Engine not initialized. Check DATABASE_URL in .env")
+
+    # Xử lý ngày tháng input
+    dt_from_req, dt_to_req = job_datetime_range(job)
+
+    # Warm-up: lấy thêm đúng số bar cần để chỉ báo dài nhất có giá trị từ data_from
+    if required is None:
+        required = required_indicators_for_job(job)
+    warmup_bars = indicator_warmup_bars(required)
+
+    try:
+        with stage_timer("load"):
+            if prices is not None:
+                df = slice_with_warmup(prices, dt_from_req, dt_to_req, warmup_bars)
+            elif price_cache is not None:
+                df = price_cache.get_warmup(job.symbol, dt_from_req, dt_to_req, warmup_bars)
+            else:
+                df = fetch_price_frame_warmup(job.symbol, dt_from_req, dt_to_req, warmup_bars)
+        count_metric("rows_loaded", len(df))
 
         if df.empty:
             print(f"[FastAPI] ⚠ No price data for symbol={job.symbol}")
             return df
 
-        # Tính toán chỉ báo mặc định
-        df = calculate_indicators(df)
+        # Chỉ báo chỉ dùng lại được khi biết lineage của chuỗi giá (tức là đi qua price cache)
+        series_key = None
+        if price_cache is not None and prices is None:
+            lineage = price_cache.lineage(job.symbol)
+            series_key = (job.symbol, lineage) if lineage is not None else None
 
-        # Tính thêm indicator tùy theo strategy (nếu có)
-        strategy = _get_strategy_dict(job)
-        required = _extract_required_indicators(strategy)
-        if required:
-            df = _compute_extra_indicators_for_strategy(df, required)
+        with stage_timer("indicators"):
+            # Tính toán chỉ báo mặc định
+            df = calculate_indicators(df, series_key)
 
-        # Chuẩn hóa trade_date
-        df["trade_date"] = pd.to_datetime(df["trade_date"])
+            # Chuẩn hóa trade_date
+            df["trade_date"] = pd.to_datetime(df["trade_date"], cache=False)
+            in_range = (df["trade_date"] >= pd.to_datetime(dt_from_req)).to_numpy()
+
+            # Tính thêm indicator tùy theo strategy (nếu có), EMA seed theo dòng đầu tiên >= data_from
+            if required:
+                origin = int(np.argmax(in_range)) if in_range.any() else len(df)
+                df = _compute_extra_indicators_for_strategy(df, required, series_key, origin)
 
         # Cắt bỏ phần warm-up: chỉ giữ lại data từ ngày user yêu cầu trở đi
-        df_final = df[df["trade_date"] >= pd.to_datetime(dt_from_req)].copy()
+        df_final = df[in_range].copy()
         df_final.reset_index(drop=True, inplace=True)
 
         print(
@@ -259,251 +992,536 @@ def load_data_as_dataframe(job: BacktestJobMessage) -> pd.DataFrame:
 
 
 # ============================================================
-# 5) USER RULE EVALUATION HELPERS
+# 5) USER RULE COMPILER (VECTORIZED)
 # ============================================================
 
-def _get_indicator_value_from_row(
-    row: Any,
-    df: pd.DataFrame,
-    idx: int,
+# Action của rule được gom về 2 nhóm: BUY (mở long) và SELL (đóng long)
+_BUY_ACTIONS = ("BUY", "LONG")
+_SELL_ACTIONS = ("SELL", "SHORT", "CLOSE", "CLOSE_POSITION")
+
+
+@dataclass
+class CompiledRules:
+    """
+    Kết quả compile strategy.rules cho 1 DataFrame cụ thể.
+    - buy_signal[i]  = True nếu có ít nhất 1 rule BUY kích hoạt tại bar i.
+    - sell_signal[i] = True nếu có ít nhất 1 rule SELL/CLOSE kích hoạt tại bar i.
+    """
+    buy_signal: np.ndarray
+    sell_signal: np.ndarray
+    n_buy_rules: int = 0
+    n_sell_rules: int = 0
+
+
+def _resolve_indicator_column(
     indicator: Optional[str],
     params: Optional[Dict[str, Any]],
-) -> Optional[float]:
+) -> Optional[str]:
     """
-    Đọc giá trị indicator/price từ 1 row theo chuẩn JSON strategy:
-      indicator: "SMA", "RSI", "OPEN", "CLOSE", "HIGH", "LOW"
-      params: { "period": 10 } (cho SMA/RSI).
+    Ánh xạ indicator/params theo chuẩn JSON strategy sang tên cột trong DataFrame:
+      "OPEN"/"CLOSE"/"HIGH"/"LOW" -> open/close/high/low
+      "SMA"/"EMA" + period        -> sma_{period} / ema_{period}
+      "RSI" + period              -> rsi_{period} (không có period -> rsi mặc định 14)
+      "MACD" + fast/slow/signal/output      -> macd_* / macd_signal_* / macd_hist_*
+      "BOLLINGER" + period/std_dev/band     -> sma_{period} / bb_upper_* / bb_lower_*
+    Trả về None nếu indicator chưa được đăng ký trong indicator_registry.
     """
     if not indicator:
         return None
 
-    indicator = str(indicator).upper()
-    period = None
-    if params:
-        period = params.get("period")
-        if period is not None:
-            try:
-                period = int(period)
-            except Exception:
-                period = None
-
-    # Giá cơ bản
-    if indicator == "OPEN":
-        return float(row.open)
-    if indicator == "CLOSE":
-        return float(row.close)
-    if indicator == "HIGH":
-        return float(row.high)
-    if indicator == "LOW":
-        return float(row.low)
-
-    # SMA
-    if indicator == "SMA":
-        if period is None:
+    if str(indicator).upper() == "RSI" and (params or {}).get("period") is None:
+        return "rsi"
+
+    node = rule_node(indicator, params)
+    return column_name(node) if node is not None else None
+
+
+# Hàm lấy cột theo tên: trả về mảng float (1D theo bar, hoặc 2D bar x symbol) hoặc None
+ColumnGetter = Callable[[str], Optional[np.ndarray]]
+
+
+def _frame_column_getter(df: pd.DataFrame) -> ColumnGetter:
+    """
+    ColumnGetter cho 1 DataFrame; cache cột đã convert sang numpy
+    để các rule dùng chung indicator không copy lại.
+    """
+    column_cache: Dict[str, np.ndarray] = {}
+
+    def get_column(name: str) -> Optional[np.ndarray]:
+        if name not in df.columns:
             return None
-        col_name = f"sma_{period}"
-        return getattr(row, col_name, None)
-
-    # RSI
-    if indicator == "RSI":
-        if period is not None:
-            col_name = f"rsi_{period}"
-            return getattr(row, col_name, None)
-        # fallback: dùng rsi mặc định 14
-        return getattr(row, "rsi", None)
-
-    # Chưa hỗ trợ: EMA, MACD, BOLLINGER -> None (rule sẽ không kích hoạt)
+        if name not in column_cache:
+            column_cache[name] = df[name].to_numpy(dtype=float)
+        return column_cache[name]
+
+    return get_column
+
+
+def _resolve_operand(
+    side: Dict[str, Any],
+    get_column: ColumnGetter,
+) -> Optional[Union[np.ndarray, float]]:
+    """
+    Lấy giá trị cho 1 vế của điều kiện: mảng của indicator, hoặc số (value cố định).
+    Trả về None nếu không có dữ liệu -> rule không bao giờ kích hoạt.
+    """
+    if "indicator" in side:
+        col_name = _resolve_indicator_column(side.get("indicator"), side.get("params") or {})
+        if col_name is None:
+            return None
+        return get_column(col_name)
+
+    if "value" in side:
+        try:
+            return float(side["value"])
+        except Exception:
+            return None
+
     return None
 
 
-def _evaluate_single_rule(
+def _shift_one(values: Union[np.ndarray, float]) -> Union[np.ndarray, float]:
+    """Dời mảng 1 bar về sau theo trục 0 (bar đầu tiên không có previous -> NaN)."""
+    if not isinstance(values, np.ndarray):
+        return values  # hằng số: giá trị bar trước = chính nó
+    prev = np.empty_like(values)
+    if len(values) > 0:
+        prev[0] = np.nan
+        prev[1:] = values[:-1]
+    return prev
+
+
+def _compile_single_rule(
     rule: Dict[str, Any],
-    df: pd.DataFrame,
-    row: Any,
-    idx: int,
-) -> bool:
+    get_column: ColumnGetter,
+    shape: Tuple[int, ...],
+) -> np.ndarray:
     """
-    Đánh giá 1 rule tại 1 bar:
+    Compile 1 rule thành mảng bool theo bar:
       condition: { indicator, params, operator, compare_to }
-    Hỗ trợ operator: "<", ">", "cross_over", "cross_under"
+    Hỗ trợ operator: "<", ">", "cross_over", "cross_under".
+    So sánh với NaN luôn False nên bar thiếu dữ liệu không kích hoạt rule.
     """
+    never = np.zeros(shape, dtype=bool)
+
     cond = rule.get("condition") or {}
     operator = cond.get("operator")
-    cmp_ = cond.get("compare_to") or {}
-
     if not operator:
-        return False
-
-    left_val = _get_indicator_value_from_row(
-        row,
-        df,
-        idx,
-        cond.get("indicator"),
-        cond.get("params") or {},
-    )
-
-    # value so sánh có thể là indicator khác hoặc value cố định
-    right_val = None
-    if "indicator" in cmp_:
-        right_val = _get_indicator_value_from_row(
-            row,
-            df,
-            idx,
-            cmp_.get("indicator"),
-            cmp_.get("params") or {},
-        )
-    elif "value" in cmp_:
-        try:
-            right_val = float(cmp_["value"])
-        except Exception:
-            right_val = None
+        return never
 
-    # Thiếu dữ liệu -> rule không kích hoạt
-    if left_val is None or right_val is None:
-        return False
+    left_side = {"indicator": cond.get("indicator"), "params": cond.get("params")}
+    left = _resolve_operand(left_side, get_column)
+    right = _resolve_operand(cond.get("compare_to") or {}, get_column)
+    if left is None or right is None:
+        return never
 
-    # Operator thường
     if operator == "<":
-        return left_val < right_val
+        return left < right
     if operator == ">":
-        return left_val > right_val
+        return left > right
 
-    # cross_over / cross_under cần giá trị bar trước
     if operator in ("cross_over", "cross_under"):
-        if idx == 0:
-            return False  # bar đầu tiên không có previous
-
-        prev_row = df.iloc[idx - 1]
-
-        prev_left = _get_indicator_value_from_row(
-            prev_row,
-            df,
-            idx - 1,
-            cond.get("indicator"),
-            cond.get("params") or {},
-        )
-        if "indicator" in cmp_:
-            prev_right = _get_indicator_value_from_row(
-                prev_row,
-                df,
-                idx - 1,
-                cmp_.get("indicator"),
-                cmp_.get("params") or {},
-            )
-        elif "value" in cmp_:
-            try:
-                prev_right = float(cmp_["value"])
-            except Exception:
-                prev_right = None
-        else:
-            prev_right = None
-
-        if prev_left is None or prev_right is None:
-            return False
-
+        prev_left = _shift_one(left)
+        prev_right = _shift_one(right)
         if operator == "cross_over":
             # trước: dưới hoặc bằng, hiện tại: trên
-            return prev_left <= prev_right and left_val > right_val
-        else:  # cross_under
-            # trước: trên hoặc bằng, hiện tại: dưới
-            return prev_left >= prev_right and left_val < right_val
+            return (prev_left <= prev_right) & (left > right)
+        # cross_under: trước: trên hoặc bằng, hiện tại: dưới
+        return (prev_left >= prev_right) & (left < right)
 
-    return False
+    return never
 
 
-def _decide_action_from_user_rules(
+def compile_rule_signals(
     rules: List[Dict[str, Any]],
-    df: pd.DataFrame,
-    row: Any,
-    idx: int,
-    have_position: bool,
-) -> Optional[str]:
+    get_column: ColumnGetter,
+    shape: Tuple[int, ...],
+) -> CompiledRules:
     """
-    Quyết định action "BUY"/"SELL" từ danh sách user rules.
-    - Nếu chưa có position -> chỉ xét các rule action BUY.
-    - Nếu đang có position -> chỉ xét các rule action SELL / CLOSE / CLOSE_POSITION.
-    Rule được ưu tiên theo ruleOrder tăng dần.
+    Compile toàn bộ strategy.rules 1 lần cho cả job:
+    OR tất cả rule BUY thành buy_signal, OR tất cả rule SELL/CLOSE thành sell_signal.
+    Vòng lặp mô phỏng chỉ còn đọc 1 phần tử mảng mỗi bar, không phụ thuộc số rule.
+    shape: (n_bars,) cho 1 mã, (n_bars, n_symbols) cho panel nhiều mã.
     """
-    # Sort theo ruleOrder cho ổn định
-    sorted_rules = sorted(rules, key=lambda r: r.get("ruleOrder", 0))
+    buy_signal = np.zeros(shape, dtype=bool)
+    sell_signal = np.zeros(shape, dtype=bool)
+    n_buy = 0
+    n_sell = 0
 
-    if not have_position:
-        # Tìm BUY rule
-        for r in sorted_rules:
-            action = str(r.get("action", "")).upper()
-            if action not in ("BUY", "LONG"):
-                continue
-            if _evaluate_single_rule(r, df, row, idx):
-                return "BUY"
-    else:
-        # Đang có position -> tìm SELL / CLOSE rule
-        for r in sorted_rules:
-            action = str(r.get("action", "")).upper()
-            if action not in ("SELL", "SHORT", "CLOSE", "CLOSE_POSITION"):
-                continue
-            if _evaluate_single_rule(r, df, row, idx):
-                return "SELL"
+    for rule in rules:
+        action = str(rule.get("action", "")).upper()
+        if action in _BUY_ACTIONS:
+            buy_signal |= _compile_single_rule(rule, get_column, shape)
+            n_buy += 1
+        elif action in _SELL_ACTIONS:
+            sell_signal |= _compile_single_rule(rule, get_column, shape)
+            n_sell += 1
+
+    return CompiledRules(
+        buy_signal=buy_signal,
+        sell_signal=sell_signal,
+        n_buy_rules=n_buy,
+        n_sell_rules=n_sell,
+    )
 
-    return None
+
+def compile_user_rules(
+    rules: List[Dict[str, Any]],
+    df: pd.DataFrame,
+) -> CompiledRules:
+    """Compile strategy.rules trên DataFrame của 1 mã."""
+    return compile_rule_signals(rules, _frame_column_getter(df), (len(df),))
 
 
 # ============================================================
-# 6) CORE BACKTEST LOGIC (LONG-ONLY, THỰC TẾ)
+# 6) SIMULATION CORES (LONG-ONLY, THỰC TẾ)
 # ============================================================
 
-def run_backtest(job: BacktestJobMessage) -> BacktestResultMessage:
-    """
-    Hàm thực thi backtest chính.
+# Có 2 core mô phỏng cho cùng 1 state machine:
+#   - "array" : chạy trên mảng NumPy cấp phát sẵn, chỉ tạo EquityPoint/BacktestTrade 1 lần ở cuối.
+#   - "legacy": vòng lặp itertuples cũ, tạo Pydantic object mỗi bar (giữ lại để đối chiếu parity).
+# Chọn core qua tham số run_backtest(core=...), job_config["engine_core"] hoặc env BACKTEST_ENGINE_CORE.
+ENGINE_CORE_ARRAY = "array"
+ENGINE_CORE_LEGACY = "legacy"
+DEFAULT_ENGINE_CORE = os.getenv("BACKTEST_ENGINE_CORE", ENGINE_CORE_ARRAY)
 
-    - Nếu KHÔNG có strategy.rules:
-        + Sử dụng chiến lược MẶC ĐỊNH:
-          * Long-only (không short selling).
-          * All-in (mua hết vốn khả dụng).
-          * Mua khi: SMA10 > SMA50 và RSI > 50.
-          * Bán khi: chạm stop-loss, take-profit hoặc SMA10 < SMA50.
 
-    - Nếu CÓ strategy.rules:
-        + Bỏ hoàn toàn logic signal mặc định.
-        + BUY / SELL được quyết định 100% theo rule của người dùng
-          (vẫn giữ stop-loss / take-profit là lớp risk management bổ sung).
+@dataclass
+class SimulationParams:
+    """Tham số giao dịch/risk management của 1 job."""
+    initial_capital: float
+    stop_loss_pct: float
+    take_profit_pct: float
+    commission_rate: float
 
-    Đồng thời:
-    - Không bao giờ cho lỗ vượt quá 100% initialCapital (equity không thể âm).
-    - Mỗi lệnh BUY đều sizing theo số tiền hiện có (cash).
+
+@dataclass
+class StrategySignals:
     """
-    df = load_data_as_dataframe(job)
+    Signal theo bar cho state machine long-only:
+    - entry[i]: được phép mở vị thế tại bar i (khi đang không có vị thế).
+    - exit[i] : đóng vị thế tại bar i (ngoài stop-loss / take-profit).
+    - valid[i]: bar có đủ chỉ báo để ra quyết định (False -> chỉ cập nhật equity).
+    """
+    entry: np.ndarray
+    exit: np.ndarray
+    valid: np.ndarray
+    has_user_rules: bool = False
 
-    if df.empty:
-        print(f"[FastAPI] ⚠ No data found for job {job.job_id}. Returning empty result.")
-        return _create_empty_result(job)
 
-    # --- BƯỚC 1: ĐỌC STRATEGY VÀ RULES (NẾU CÓ) ---
+@dataclass
+class SimulationOutput:
+    """
+    Kết quả thô của 1 lần mô phỏng, dùng chung cho mọi core.
+    Equity/drawdown giữ dạng mảng; EquityPoint chỉ được tạo khi build result message.
+    """
+    times: np.ndarray      # int64 unix ts
+    equity: np.ndarray     # float64
+    drawdown: np.ndarray   # float64 (<= 0)
+    trades: List[BacktestTrade]
+    final_cash: float
+    win_trades: int
+
+
+def simulation_params_from_job(job: BacktestJobMessage) -> SimulationParams:
+    cfg = job.job_config or {}
+    return SimulationParams(
+        # SAFETY: đảm bảo vốn ban đầu không âm
+        initial_capital=max(0.0, float(job.initial_capital or 0.0)),
+        stop_loss_pct=float(cfg.get("stop_loss", 0.05)),       # 5%
+        take_profit_pct=float(cfg.get("take_profit", 0.10)),   # 10%
+        commission_rate=float(job.commission_rate or 0.0015),  # 0.15%
+    )
+
+
+def get_user_rules(job: BacktestJobMessage) -> List[Dict[str, Any]]:
     strategy_dict = _get_strategy_dict(job)
-    user_rules: List[Dict[str, Any]] = []
-    if strategy_dict:
-        user_rules = strategy_dict.get("rules") or []
-    has_user_rules = len(user_rules) > 0
+    if not strategy_dict:
+        return []
+    return strategy_dict.get("rules") or []
 
-    if has_user_rules:
-        print(
-            f"[FastAPI] ▶ Using USER STRATEGY for job {job.job_id} "
-            f"with {len(user_rules)} rule(s)."
-        )
-    else:
-        print(
-            f"[FastAPI] ▶ Using DEFAULT SMA/RSI STRATEGY for job {job.job_id} "
-            f"(no user rules provided)."
+
+def build_strategy_signals(
+    user_rules: List[Dict[str, Any]],
+    df: pd.DataFrame,
+    cfg: Optional[Dict[str, Any]] = None,
+) -> StrategySignals:
+    """
+    Tính toàn bộ signal của job trên cả DataFrame (vectorized).
+    - Có user rules: entry/exit lấy từ compile_user_rules, mọi bar đều hợp lệ.
+    - Không có: chiến lược mặc định SMA10/SMA50/RSI14 (chu kỳ/ngưỡng override qua cfg)
+        * Mua khi: SMA10 > SMA50 và RSI > 50.
+        * Bán khi: SMA10 < SMA50 (SL/TP xử lý trong state machine).
+    """
+    n = len(df)
+    if user_rules:
+        compiled = compile_user_rules(user_rules, df)
+        return StrategySignals(
+            entry=compiled.buy_signal,
+            exit=compiled.sell_signal,
+            valid=np.ones(n, dtype=bool),
+            has_user_rules=True,
         )
 
-    # --- BƯỚC 2: CẤU HÌNH ---
-    cfg = job.job_config or {}
-    stop_loss_pct = float(cfg.get("stop_loss", 0.05))      # 5%
-    take_profit_pct = float(cfg.get("take_profit", 0.10))  # 10%
-    commission_rate = float(job.commission_rate or 0.0015)  # 0.15%
+    params = default_strategy_params(cfg)
+    columns = default_strategy_columns(params)
+    sma_fast = df[columns["sma_fast"]].to_numpy(dtype=float)
+    sma_slow = df[columns["sma_slow"]].to_numpy(dtype=float)
+    rsi = df[columns["rsi"]].to_numpy(dtype=float)
+
+    valid = ~(np.isnan(sma_fast) | np.isnan(sma_slow) | np.isnan(rsi))
+    entry = (sma_slow > 0) & (sma_fast > sma_slow) & (rsi > params["rsi_threshold"])
+    exit_ = sma_fast < sma_slow
+    return StrategySignals(entry=entry, exit=exit_, valid=valid, has_user_rules=False)
+
+
+def compute_drawdown(
+    equity: np.ndarray,
+    initial_capital: float,
+    start_peak: Optional[float] = None,
+) -> np.ndarray:
+    """
+    Underwater curve: equity / peak - 1, peak chạy bắt đầu từ initial_capital.
+    start_peak: đỉnh equity của các đoạn trước (mô phỏng theo chunk) -> peak nối tiếp liền mạch.
+    """
+    if len(equity) == 0:
+        return np.empty(0, dtype=float)
+    floor = initial_capital if start_peak is None else max(initial_capital, start_peak)
+    peak = np.maximum.accumulate(np.maximum(equity, floor))
+    ratio = np.divide(equity, peak, out=np.ones_like(equity), where=peak > 0)
+    return ratio - 1.0
 
-    # --- BƯỚC 3: BIẾN TRẠNG THÁI ---
-    # SAFETY: đảm bảo vốn ban đầu không âm
-    initial_capital = max(0.0, float(job.initial_capital or 0.0))
+
+class SimulationState:
+    """
+    State machine long-only (all-in BUY, SL/TP, phí, equity >= 0) chạy tiếp được qua nhiều đoạn bar:
+    _simulate_arrays chạy 1 đoạn cho cả job, streaming_engine chạy từng chunk với cùng state
+    -> cùng phép tính float theo đúng thứ tự, kết quả trùng từng bit.
+    """
+
+    def __init__(self, params: SimulationParams, control: Optional[JobControl] = None) -> None:
+        self.params = params
+        self.control = control
+        self.cash = params.initial_capital
+        self.position_qty = 0.0
+        self.entry_price = 0.0
+        self.win_trades = 0
+        # (ts, entry_price, exit_price, qty, pnl)
+        self.trade_rows: List[tuple] = []
+        self.bars_done = 0
+        self.last_ts: Optional[int] = None
+        self.last_price: Optional[float] = None
+        # Chunk boundary cho cancel/timeout/progress (-1 = không có control, không bao giờ khớp)
+        self.next_checkpoint = CHECKPOINT_BARS if control is not None else -1
+
+    def run(
+        self,
+        ts: np.ndarray,
+        close: np.ndarray,
+        signals: StrategySignals,
+        equity_out: np.ndarray,
+        times_out: np.ndarray,
+        total: int,
+    ) -> None:
+        """Chạy len(close) bar tiếp theo, ghi equity/time của từng bar vào equity_out/times_out."""
+        n = len(close)
+        if n == 0:
+            return
+        control = self.control
+        commission_rate = self.params.commission_rate
+        stop_loss_pct = self.params.stop_loss_pct
+        take_profit_pct = self.params.take_profit_pct
+
+        close_l = close.tolist()
+        ts_l = ts.tolist()
+        entry_l = signals.entry.tolist()
+        exit_l = signals.exit.tolist()
+        valid_l = signals.valid.tolist()
+
+        cash = self.cash
+        position_qty = self.position_qty
+        entry_price = self.entry_price
+        win_trades = self.win_trades
+        trade_rows = self.trade_rows
+        offset = self.bars_done
+        # Chỉ số checkpoint tính theo bar của cả job, đổi về chỉ số trong đoạn này
+        next_checkpoint = self.next_checkpoint - offset if control is not None else -1
+
+        for i in range(n):
+            if i == next_checkpoint:
+                prev_price = close_l[i - 1] if i > 0 else self.last_price
+                control.checkpoint(offset + i, total, cash + position_qty * prev_price)
+                next_checkpoint += CHECKPOINT_BARS
+
+            current_price = close_l[i]
+            times_out[i] = ts_l[i]
+
+            if not valid_l[i]:
+                equity_out[i] = cash + position_qty * current_price
+                continue
+
+            if position_qty > 0:
+                position_value = position_qty * current_price
+                entry_value = position_qty * entry_price
+                pnl_pct = (
+                    (position_value - entry_value) / entry_value
+                    if entry_value > 0
+                    else 0.0
+                )
+                # SL / TP / signal thoát lệnh
+                if pnl_pct <= -stop_loss_pct or pnl_pct >= take_profit_pct or exit_l[i]:
+                    gross_rev = position_qty * current_price
+                    fee = gross_rev * commission_rate
+                    net_rev = gross_rev - fee
+                    trade_pnl = net_rev - (position_qty * entry_price)
+
+                    cash += net_rev
+                    if trade_pnl > 0:
+                        win_trades += 1
+                    trade_rows.append((ts_l[i], entry_price, current_price, position_qty, trade_pnl))
+
+                    position_qty = 0.0
+                    entry_price = 0.0
+
+            elif entry_l[i] and cash > 0:
+                # All-in: Qty = Cash / (Price * (1 + commission))
+                qty = cash / (current_price * (1.0 + commission_rate))
+                if qty > 0:
+                    gross_cost = qty * current_price
+                    fee = gross_cost * commission_rate
+                    total_cost = gross_cost + fee
+
+                    cash -= total_cost
+                    # SAFETY: không cho cash âm do sai số float
+                    if cash < 0:
+                        cash = 0.0
+
+                    position_qty = qty
+                    entry_price = current_price
+
+            current_equity_value = cash + position_qty * current_price
+            # SAFETY: equity không thể âm
+            if current_equity_value < 0:
+                current_equity_value = 0.0
+            equity_out[i] = current_equity_value
+
+        self.cash = cash
+        self.position_qty = position_qty
+        self.entry_price = entry_price
+        self.win_trades = win_trades
+        self.bars_done = offset + n
+        if control is not None:
+            self.next_checkpoint = offset + next_checkpoint
+        self.last_ts = ts_l[-1]
+        self.last_price = close_l[-1]
+
+    def close_position(self) -> Optional[Tuple[int, float]]:
+        """Đóng vị thế cuối cùng (nếu còn) ở bar cuối -> điểm equity (ts, equity) thêm vào cuối đường cong."""
+        if self.position_qty <= 0 or self.bars_done == 0:
+            return None
+        last_price = self.last_price
+        last_ts = self.last_ts
+        position_qty = self.position_qty
+
+        gross = position_qty * last_price
+        fee = gross * self.params.commission_rate
+        net = gross - fee
+        pnl = net - (position_qty * self.entry_price)
+
+        self.cash += net
+        if pnl > 0:
+            self.win_trades += 1
+        self.trade_rows.append((last_ts, self.entry_price, last_price, position_qty, pnl))
+        self.position_qty = 0.0
+        self.entry_price = 0.0
+        return last_ts, (self.cash if self.cash > 0 else 0.0)
+
+    def trades(self) -> List[BacktestTrade]:
+        return [
+            BacktestTrade(
+                # entryTime/exitTime cùng ts (không đổi schema)
+                entryTime=int(t),
+                exitTime=int(t),
+                entryPrice=float(e_price),
+                exitPrice=float(x_price),
+                quantity=float(qty),
+                profit=float(pnl),
+                side="buy",  # close long
+            )
+            for t, e_price, x_price, qty, pnl in self.trade_rows
+        ]
+
+
+def _simulate_arrays(
+    ts: np.ndarray,
+    close: np.ndarray,
+    signals: StrategySignals,
+    params: SimulationParams,
+    control: Optional[JobControl] = None,
+) -> SimulationOutput:
+    """
+    Core mô phỏng trên mảng:
+    - State machine (SimulationState) chạy trên float Python thuần,
+      ghi equity vào mảng NumPy cấp phát sẵn.
+    - Drawdown tính vectorized sau vòng lặp.
+    - EquityPoint / BacktestTrade chỉ được tạo 1 lần ở cuối.
+    """
+    n = len(close)
+
+    # +1 slot cho điểm equity khi đóng vị thế cuối cùng
+    equity = np.empty(n + 1, dtype=float)
+    times = np.empty(n + 1, dtype=np.int64)
+
+    state = SimulationState(params, control)
+    state.run(ts, close, signals, equity, times, n)
+
+    n_points = n
+
+    # Đóng vị thế cuối cùng nếu còn
+    final_point = state.close_position()
+    if final_point is not None:
+        times[n], equity[n] = final_point
+        n_points = n + 1
+
+    equity = equity[:n_points]
+    times = times[:n_points]
+
+    drawdown = compute_drawdown(equity, params.initial_capital)
+
+    return SimulationOutput(
+        times=times,
+        equity=equity,
+        drawdown=drawdown,
+        trades=state.trades(),
+        final_cash=state.cash,
+        win_trades=state.win_trades,
+    )
+
+
+def _simulate_legacy(
+    df: pd.DataFrame,
+    signals: StrategySignals,
+    params: SimulationParams,
+    cfg: Optional[Dict[str, Any]] = None,
+    control: Optional[JobControl] = None,
+) -> SimulationOutput:
+    """
+    Core cũ: itertuples + tạo EquityPoint mỗi bar.
+    Giữ nguyên logic để đối chiếu parity với core mảng (compare_engine_cores).
+    """
+    has_user_rules = signals.has_user_rules
+    default_params = default_strategy_params(cfg)
+    default_columns = default_strategy_columns(default_params)
+    rsi_threshold = default_params["rsi_threshold"]
+    buy_signal = signals.entry.tolist()
+    sell_signal = signals.exit.tolist()
+
+    stop_loss_pct = params.stop_loss_pct
+    take_profit_pct = params.take_profit_pct
+    commission_rate = params.commission_rate
+
+    # --- BIẾN TRẠNG THÁI ---
+    initial_capital = params.initial_capital
     cash = initial_capital          # tiền mặt
     position_qty = 0.0              # số lượng cổ phiếu đang giữ
     entry_price = 0.0               # giá vốn
@@ -514,16 +1532,22 @@ def run_backtest(job: BacktestJobMessage) -> BacktestResultMessage:
     underwater: List[EquityPoint] = []
 
     win_trades = 0
+    n_bars = len(df)
+    next_checkpoint = CHECKPOINT_BARS if control is not None else -1
 
-    # --- BƯỚC 4: VÒNG LẶP GIAO DỊCH ---
+    # --- VÒNG LẶP GIAO DỊCH ---
     for idx, row in enumerate(df.itertuples()):
+        if idx == next_checkpoint:
+            control.checkpoint(idx, n_bars, cash + position_qty * float(row.close))
+            next_checkpoint += CHECKPOINT_BARS
+
         current_price = float(row.close)
         ts = int(row.ts)
 
         # --- CHỈ SỐ MẶC ĐỊNH (CHỈ DÙNG CHO CHIẾN LƯỢC MẶC ĐỊNH) ---
-        sma_fast = float(row.sma_fast) if hasattr(row, "sma_fast") else np.nan
-        sma_slow = float(row.sma_slow) if hasattr(row, "sma_slow") else np.nan
-        rsi_val = float(row.rsi) if hasattr(row, "rsi") else np.nan
+        sma_fast = float(getattr(row, default_columns["sma_fast"], np.nan))
+        sma_slow = float(getattr(row, default_columns["sma_slow"], np.nan))
+        rsi_val = float(getattr(row, default_columns["rsi"], np.nan))
 
         # Chỉ số phải hợp lệ nếu dùng default strategy
         if not has_user_rules:
@@ -540,14 +1564,10 @@ def run_backtest(job: BacktestJobMessage) -> BacktestResultMessage:
 
         # --- LOGIC TỪ USER RULES (NẾU CÓ) ---
         if has_user_rules:
-            have_pos = position_qty > 0
-            action = _decide_action_from_user_rules(
-                user_rules,
-                df,
-                row,
-                idx,
-                have_pos,
-            )
+            if position_qty > 0:
+                action = "SELL" if sell_signal[idx] else None
+            else:
+                action = "BUY" if buy_signal[idx] else None
 
             # Nếu đang có position thì vẫn ưu tiên SL/TP trước SELL từ rule
             if position_qty > 0:
@@ -568,7 +1588,7 @@ def run_backtest(job: BacktestJobMessage) -> BacktestResultMessage:
         else:
             if position_qty == 0:
                 # Không có vị thế -> tìm điểm MUA
-                if sma_slow > 0 and sma_fast > sma_slow and rsi_val > 50:
+                if sma_slow > 0 and sma_fast > sma_slow and rsi_val > rsi_threshold:
                     action = "BUY"
             else:
                 # Đang có vị thế -> tìm điểm BÁN
@@ -667,7 +1687,7 @@ def run_backtest(job: BacktestJobMessage) -> BacktestResultMessage:
             dd = 0.0
         underwater.append(EquityPoint(time=ts, value=float(dd)))
 
-    # --- BƯỚC 5: ĐÓNG VỊ THẾ CUỐI CÙNG NẾU CÒN ---
+    # --- ĐÓNG VỊ THẾ CUỐI CÙNG NẾU CÒN ---
     if position_qty > 0:
         last_row = df.iloc[-1]
         last_price = float(last_row.close)
@@ -704,9 +1724,68 @@ def run_backtest(job: BacktestJobMessage) -> BacktestResultMessage:
         dd = (final_equity_value / peak_equity - 1.0) if peak_equity > 0 else 0.0
         underwater.append(EquityPoint(time=last_ts, value=float(dd)))
 
-    # --- BƯỚC 6: TÍNH TOÁN KẾT QUẢ ---
+
+    return SimulationOutput(
+        times=np.array([p.time for p in equity_curve], dtype=np.int64),
+        equity=np.array([p.value for p in equity_curve], dtype=float),
+        drawdown=np.array([p.value for p in underwater], dtype=float),
+        trades=trades,
+        final_cash=cash,
+        win_trades=win_trades,
+    )
+
+
+def _resolve_engine_core(job: BacktestJobMessage, core: Optional[str]) -> str:
+    cfg = job.job_config or {}
+    resolved = str(core or cfg.get("engine_core") or DEFAULT_ENGINE_CORE).lower()
+    if resolved not in (ENGINE_CORE_ARRAY, ENGINE_CORE_LEGACY):
+        print(f"[FastAPI] ⚠ Unknown engine core '{resolved}', falling back to '{ENGINE_CORE_ARRAY}'")
+        resolved = ENGINE_CORE_ARRAY
+    return resolved
+
+
+def simulate(
+    df: pd.DataFrame,
+    signals: StrategySignals,
+    params: SimulationParams,
+    core: str = ENGINE_CORE_ARRAY,
+    cfg: Optional[Dict[str, Any]] = None,
+    control: Optional[JobControl] = None,
+) -> SimulationOutput:
+    """
+    Chạy state machine long-only trên DataFrame đã có chỉ báo bằng core được chọn.
+    control: mỗi CHECKPOINT_BARS bar kiểm tra cancel/timeout + gửi progress (None = bỏ qua).
+    """
+    if core == ENGINE_CORE_LEGACY:
+        return _simulate_legacy(df, signals, params, cfg, control)
+    return _simulate_arrays(
+        df["ts"].to_numpy(dtype=np.int64),
+        df["close"].to_numpy(dtype=float),
+        signals,
+        params,
+        control,
+    )
+
+
+# ============================================================
+# 7) RESULT BUILDING & ENTRY POINTS
+# ============================================================
+
+def compute_summary_metrics(
+    params: SimulationParams,
+    output: SimulationOutput,
+    min_drawdown: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    Tính các chỉ số tổng hợp từ kết quả mô phỏng:
+    netProfit, winRate (%), maxDrawdown (%), profitFactor, totalTrades.
+    min_drawdown: đáy underwater đã gom sẵn (streaming không giữ cả mảng drawdown).
+    """
+    initial_capital = params.initial_capital
+    trades = output.trades
+
     # SAFETY: equity cuối cùng không âm
-    final_equity = max(0.0, cash)
+    final_equity = max(0.0, output.final_cash)
 
     total_trades = len(trades)
     net_profit_raw = final_equity - initial_capital
@@ -723,14 +1802,15 @@ def run_backtest(job: BacktestJobMessage) -> BacktestResultMessage:
         net_profit = net_profit_raw
 
     if total_trades > 0:
-        win_rate = (win_trades / total_trades) * 100.0
+        win_rate = (output.win_trades / total_trades) * 100.0
     else:
         win_rate = 0.0
 
     max_dd = 0.0
-    if underwater:
-        min_dd = min(p.value for p in underwater)
-        max_dd = abs(min_dd) * 100.0  # chuyển về % dương
+    if min_drawdown is not None:
+        max_dd = abs(float(min_drawdown)) * 100.0
+    elif len(output.drawdown) > 0:
+        max_dd = abs(float(output.drawdown.min())) * 100.0  # chuyển về % dương
 
     gross_win = sum(t.profit for t in trades if t.profit > 0)
     gross_loss = abs(sum(t.profit for t in trades if t.profit < 0))
@@ -739,28 +1819,279 @@ def run_backtest(job: BacktestJobMessage) -> BacktestResultMessage:
     else:
         profit_factor = gross_win if gross_win > 0 else 0.0
 
+    return {
+        "netProfit": float(net_profit),
+        "winRate": float(win_rate),
+        "maxDrawdown": float(max_dd),
+        "profitFactor": float(profit_factor),
+        "totalTrades": total_trades,
+    }
+
+
+def build_result_message(
+    job: BacktestJobMessage,
+    params: SimulationParams,
+    output: SimulationOutput,
+    result_cls: Type[BacktestResultMessage] = BacktestResultMessage,
+    curves: Optional[Dict[str, Any]] = None,
+    min_drawdown: Optional[float] = None,
+    **extra_fields: Any,
+) -> BacktestResultMessage:
+    """
+    Tạo BacktestResultMessage (equity/underwater được encode 1 lần ở đây, xem result_encoding).
+    result_cls/extra_fields: dùng cho các message mở rộng (vd walk-forward có thêm folds).
+    curves/min_drawdown: đường cong đã encode + đáy drawdown tính sẵn (streaming_engine),
+    khi đó output chỉ cần trades/final_cash/win_trades.
+    """
+    metrics = compute_summary_metrics(params, output, min_drawdown)
+
     print(
         f"[FastAPI] 🏁 Job {job.job_id} Done. "
-        f"Trades: {total_trades}, NetProfit: {net_profit:,.2f}, "
-        f"WinRate: {win_rate:.2f}%, MaxDD: {max_dd:.2f}%, PF: {profit_factor:.2f}"
+        f"Trades: {metrics['totalTrades']}, NetProfit: {metrics['netProfit']:,.2f}, "
+        f"WinRate: {metrics['winRate']:.2f}%, MaxDD: {metrics['maxDrawdown']:.2f}%, "
+        f"PF: {metrics['profitFactor']:.2f}"
     )
 
-    return BacktestResultMessage(
+    # equityCurve/underwater (hoặc bản compact) theo job_config.result_format / max_points
+    if curves is None:
+        curves = encode_curves(output.times, output.equity, output.drawdown, job.job_config)
+
+    # Phân tích Monte Carlo tuỳ chọn (job_config.monte_carlo); streaming truyền sẵn qua extra_fields
+    if "monteCarlo" not in extra_fields:
+        mc_options = monte_carlo_options(job.job_config, job.job_id)
+        if mc_options is not None:
+            with stage_timer("monte_carlo"):
+                extra_fields["monteCarlo"] = run_monte_carlo(
+                    trade_returns(
+                        [t.quantity * t.entryPrice for t in output.trades],
+                        [t.profit for t in output.trades],
+                        params.commission_rate,
+                    ),
+                    daily_closes(output.times, output.equity),
+                    params.initial_capital,
+                    mc_options,
+                )
+
+    return result_cls(
         job_id=job.job_id,
         status="COMPLETED",
-        netProfit=float(net_profit),
-        winRate=float(win_rate),
-        maxDrawdown=float(max_dd),
-        profitFactor=float(profit_factor),
-        totalTrades=total_trades,
-        equityCurve=equity_curve,
-        underwater=underwater,
-        trades=trades,
+        trades=output.trades,
+        **curves,
+        **metrics,
+        **extra_fields,
     )
 
 
+def run_backtest_on_frame(
+    job: BacktestJobMessage,
+    df: pd.DataFrame,
+    core: Optional[str] = None,
+    control: Optional[JobControl] = None,
+) -> BacktestResultMessage:
+    """
+    Chạy backtest trên DataFrame đã load + tính chỉ báo sẵn (không truy cập DB).
+    control: cancel/timeout/progress (JobCancelled được raise lên cho caller xử lý).
+    """
+    if control is not None:
+        control.check()
+    if df.empty:
+        print(f"[FastAPI] ⚠ No data found for job {job.job_id}. Returning empty result.")
+        return _create_empty_result(job)
+
+    # --- BƯỚC 1: ĐỌC STRATEGY VÀ RULES (NẾU CÓ) ---
+    user_rules = get_user_rules(job)
+    if user_rules:
+        print(
+            f"[FastAPI] ▶ Using USER STRATEGY for job {job.job_id} "
+            f"with {len(user_rules)} rule(s)."
+        )
+    else:
+        print(
+            f"[FastAPI] ▶ Using DEFAULT SMA/RSI STRATEGY for job {job.job_id} "
+            f"(no user rules provided)."
+        )
+
+    # --- BƯỚC 2: SIGNAL + CẤU HÌNH ---
+    with stage_timer("rules"):
+        signals = build_strategy_signals(user_rules, df, job.job_config)
+    params = simulation_params_from_job(job)
+    if control is not None:
+        control.check()
+
+    # --- BƯỚC 3: MÔ PHỎNG ---
+    with stage_timer("simulate"):
+        output = simulate(
+            df, signals, params, _resolve_engine_core(job, core), job.job_config, control
+        )
+    if control is not None:
+        control.check()
+        control.finish(len(df), float(output.equity[-1]) if len(output.equity) else None)
+
+    # --- BƯỚC 4: TÍNH TOÁN KẾT QUẢ ---
+    with stage_timer("serialize"):
+        return build_result_message(job, params, output)
+
+
+def is_streaming_job(job: BacktestJobMessage) -> bool:
+    """Job chạy bằng streaming_engine (đọc giá theo chunk, bộ nhớ không phụ thuộc độ dài lịch sử)?"""
+    return bool((job.job_config or {}).get("streaming", STREAMING_DEFAULT))
+
+
+def run_backtest(
+    job: BacktestJobMessage,
+    core: Optional[str] = None,
+    control: Optional[JobControl] = None,
+    prices: Optional[pd.DataFrame] = None,
+) -> BacktestResultMessage:
+    """
+    Hàm thực thi backtest chính.
+
+    - Nếu KHÔNG có strategy.rules:
+        + Sử dụng chiến lược MẶC ĐỊNH:
+          * Long-only (không short selling).
+          * All-in (mua hết vốn khả dụng).
+          * Mua khi: SMA10 > SMA50 và RSI > 50.
+          * Bán khi: chạm stop-loss, take-profit hoặc SMA10 < SMA50.
+
+    - Nếu CÓ strategy.rules:
+        + Bỏ hoàn toàn logic signal mặc định.
+        + BUY / SELL được quyết định 100% theo rule của người dùng
+          (vẫn giữ stop-loss / take-profit là lớp risk management bổ sung).
+
+    Đồng thời:
+    - Không bao giờ cho lỗ vượt quá 100% initialCapital (equity không thể âm).
+    - Mỗi lệnh BUY đều sizing theo số tiền hiện có (cash).
+
+    core: "array" (mặc định) hoặc "legacy" - xem DEFAULT_ENGINE_CORE.
+    control: cancel/timeout/progress; job bị huỷ / quá giờ -> kết quả FAILED (kèm error).
+    prices: giá đã load sẵn (xem load_data_as_dataframe).
+    Job streaming (is_streaming_job, không có prices) -> streaming_engine, chỉ core "array".
+    """
+    try:
+        if control is not None:
+            control.check()
+        if prices is None and is_streaming_job(job):
+            from app.services.streaming_engine import run_backtest_streaming
+
+            return run_backtest_streaming(job, control)
+        df = load_data_as_dataframe(job, prices=prices)
+        return run_backtest_on_frame(job, df, core, control)
+    except JobCancelled as e:
+        print(f"[FastAPI] ⛔ {e}")
+        return _create_failed_result(job, str(e))
+
+
+def run_backtest_batch(
+    jobs: List[BacktestJobMessage],
+    core: Optional[str] = None,
+    controls: Optional[List[Optional[JobControl]]] = None,
+    prices: Optional[Dict[str, pd.DataFrame]] = None,
+) -> List[Union[BacktestResultMessage, Exception]]:
+    """
+    Chạy nhiều job backtest (thường cùng symbol) với phần load dữ liệu dùng chung:
+    - Mỗi symbol: load giá 1 lần cho khoảng rộng nhất (nạp vào price cache).
+    - Mỗi nhóm (symbol, data_from): tính chỉ báo 1 lần cho union indicator của cả nhóm,
+      tới data_to lớn nhất; mỗi job chạy trên phần cắt tới data_to của chính nó.
+      Chỉ báo chỉ phụ thuộc dữ liệu quá khứ nên cắt phần cuối cho kết quả giống hệt
+      khi chạy riêng; điểm bắt đầu (warm-up) khác nhau thì phải tính riêng.
+    Trả về kết quả theo đúng thứ tự jobs; job lỗi -> Exception ở vị trí đó (không ảnh hưởng job khác).
+    controls: JobControl theo thứ tự jobs; job bị huỷ / quá giờ -> kết quả FAILED của riêng job đó.
+      Timeout của mỗi job tính từ lúc batch bắt đầu chạy chính job đó (load dùng chung của nhóm
+      tính cho job đầu nhóm), không tính thời gian chờ các job đứng trước.
+    prices: symbol -> giá đã load sẵn bao trùm mọi job của symbol đó (không đi qua price cache).
+    """
+    controls = controls or [None] * len(jobs)
+    prices = prices or {}
+    results: List[Union[BacktestResultMessage, Exception, None]] = [None] * len(jobs)
+
+    groups: Dict[Tuple[str, Any], List[int]] = {}
+    for i, job in enumerate(jobs):
+        if is_streaming_job(job):
+            # Job streaming tự đọc giá theo chunk, không dùng chung load in-memory của batch
+            if controls[i] is not None:
+                controls[i].start()
+            try:
+                results[i] = run_backtest(job, core, controls[i])
+            except Exception as e:
+                print(f"[FastAPI] ❌ Batch job {job.job_id} failed: {e}")
+                results[i] = e
+            continue
+        groups.setdefault((job.symbol, job.data_from), []).append(i)
+
+    # 1 lần load cho khoảng rộng nhất của mỗi symbol (data_from sớm nhất, warm-up dài nhất);
+    # các lần load bên dưới là cache hit
+    if price_cache is not None:
+        ranges: Dict[str, Tuple[datetime, datetime, int]] = {}
+        for job in jobs:
+            if job.symbol in prices or is_streaming_job(job):
+                continue
+            dt_from, dt_to = job_datetime_range(job)
+            bars = job_warmup_bars(job)
+            lo, hi, warm = ranges.get(job.symbol, (dt_from, dt_to, bars))
+            ranges[job.symbol] = (min(lo, dt_from), max(hi, dt_to), max(warm, bars))
+        for symbol, (start, end, bars) in ranges.items():
+            try:
+                price_cache.get_warmup(symbol, start, end, bars)
+            except Exception as e:
+                print(f"[FastAPI] ⚠ Batch prefetch failed for {symbol}: {e}")
+
+    for (symbol, _), idxs in groups.items():
+        group_jobs = [jobs[i] for i in idxs]
+        widest = max(group_jobs, key=lambda j: job_datetime_range(j)[1])
+        required = merge_required_indicators(*(required_indicators_for_job(j) for j in group_jobs))
+        print(f"[FastAPI] 📦 Batch: {len(group_jobs)} job(s) for {symbol} share one data load")
+        if controls[idxs[0]] is not None:
+            controls[idxs[0]].start()
+        df = load_data_as_dataframe(widest, required=required, prices=prices.get(symbol))
+
+        for i in idxs:
+            job = jobs[i]
+            if controls[i] is not None:
+                controls[i].start()
+            try:
+                _, dt_to = job_datetime_range(job)
+                job_df = df
+                if not df.empty and job is not widest:
+                    job_df = df[df["trade_date"] <= pd.Timestamp(dt_to)].reset_index(drop=True)
+                results[i] = run_backtest_on_frame(job, job_df, core, controls[i])
+            except JobCancelled as e:
+                print(f"[FastAPI] ⛔ {e}")
+                results[i] = _create_failed_result(job, str(e))
+            except Exception as e:
+                print(f"[FastAPI] ❌ Batch job {job.job_id} failed: {e}")
+                results[i] = e
+
+    return results
+
+
+def compare_engine_cores(job: BacktestJobMessage) -> Dict[str, Any]:
+    """
+    Chạy core "legacy" và "array" trên cùng 1 DataFrame (load 1 lần) để kiểm tra parity.
+    Trả về thời gian chạy của từng core và danh sách field khác nhau (rỗng = khớp).
+    """
+    df = load_data_as_dataframe(job)
+
+    timings: Dict[str, float] = {}
+    results: Dict[str, Dict[str, Any]] = {}
+    for core in (ENGINE_CORE_LEGACY, ENGINE_CORE_ARRAY):
+        started = time.perf_counter()
+        results[core] = run_backtest_on_frame(job, df, core).model_dump()
+        timings[core] = time.perf_counter() - started
+
+    legacy, array = results[ENGINE_CORE_LEGACY], results[ENGINE_CORE_ARRAY]
+    mismatched = [key for key in legacy if legacy[key] != array[key]]
+
+    return {
+        "job_id": job.job_id,
+        "rows": len(df),
+        "match": not mismatched,
+        "mismatched_fields": mismatched,
+        "seconds": timings,
+    }
+
+
 # ============================================================
-# 7) EMPTY RESULT HELPER
+# 8) EMPTY RESULT HELPER
 # ============================================================
 
 def _create_empty_result(job: BacktestJobMessage) -> BacktestResultMessage:
@@ -777,3 +2108,8 @@ def _create_empty_result(job: BacktestJobMessage) -> BacktestResultMessage:
         underwater=[],
         trades=[],
     )
+
+
+def _create_failed_result(job: BacktestJobMessage, error: str) -> BacktestResultMessage:
+    """Kết quả FAILED (job bị huỷ / quá timeout)."""
+    return _create_empty_result(job).model_copy(update={"status": "FAILED", "error": error})
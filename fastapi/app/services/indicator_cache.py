@@ -0,0 +1,176 @@
+# app/services/indicator_cache.py
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Hashable, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+# (symbol, lineage, first_ts): định danh 1 chuỗi đầu vào tính từ bar đầu tiên
+SeriesId = Tuple[str, int, int]
+# (series, indicator, params)
+IndicatorKey = Tuple[SeriesId, str, Tuple[Hashable, ...]]
+
+
+class SeriesSpan(NamedTuple):
+    """Chuỗi giá đầu vào của 1 lần tính: symbol, lineage (price_cache) và mảng ts theo dòng."""
+    symbol: str
+    lineage: int
+    ts: np.ndarray
+
+    @property
+    def series_id(self) -> SeriesId:
+        return (self.symbol, self.lineage, int(self.ts[0]))
+
+
+def series_span(symbol: str, lineage: int, ts: np.ndarray) -> Optional[SeriesSpan]:
+    """Span của 1 chuỗi giá; None nếu rỗng (không cache)."""
+    if len(ts) == 0:
+        return None
+    return SeriesSpan(symbol, int(lineage), np.asarray(ts, dtype=np.int64))
+
+
+@dataclass
+class _CachedSeries:
+    """ts dài nhất đã thấy của 1 SeriesId + số cột đang cache trên chuỗi đó."""
+    ts: np.ndarray
+    columns: int = 0
+
+
+class IndicatorCache:
+    """
+    LRU cache (giới hạn theo số byte) cho cột chỉ báo đã tính.
+
+    Mọi kernel của indicator_registry là nhân quả (giá trị tại bar i chỉ phụ thuộc bar <= i,
+    rolling/ewm của pandas cộng dồn theo thứ tự từ đầu chuỗi) -> cột tính trên 1 chuỗi cũng là
+    kết quả từng bit cho mọi prefix của chuỗi đó. Vì vậy key là (symbol, lineage, ts đầu tiên)
+    chứ không phải span chính xác:
+      - Hit: chuỗi yêu cầu là prefix của chuỗi đã cache (so cả mảng ts) -> cắt (slice) cột.
+      - Append: chuỗi yêu cầu dài hơn và nối tiếp chuỗi đã cache (refresh có dòng mới) ->
+        tính lại trên cả chuỗi rồi thay entry bằng cột dài hơn; job sau (ngắn hơn) lại hit.
+    Lineage của price_cache không đổi khi chỉ nối thêm dòng, nên dòng đã có giữ nguyên giá trị.
+    """
+
+    def __init__(self, max_bytes: int = 128 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[IndicatorKey, np.ndarray]" = OrderedDict()
+        self._series: Dict[SeriesId, _CachedSeries] = {}
+        self._lock = threading.Lock()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.extensions = 0
+        self.evictions = 0
+
+    def get_or_compute(
+        self,
+        span: Optional[SeriesSpan],
+        indicator: str,
+        params: Tuple[Hashable, ...],
+        compute: Callable[[], np.ndarray],
+    ) -> np.ndarray:
+        """Trả về bản copy của cột đã cache (cắt theo span), hoặc tính bằng compute() rồi lưu lại."""
+        if span is None:
+            return compute()
+
+        n = len(span.ts)
+        key: IndicatorKey = (span.series_id, indicator, params)
+        with self._lock:
+            series = self._series.get(key[0])
+            values = self._entries.get(key)
+            if values is not None and len(values) >= n and _is_prefix(span.ts, series.ts):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return values[:n].copy()
+
+        values = np.asarray(compute(), dtype=float)
+        with self._lock:
+            self.misses += 1
+            if self._track_series(key[0], span.ts):
+                self._put(key, values)
+                self._evict()
+        return values
+
+    def invalidate(self, symbol: Optional[str] = None) -> None:
+        """Xoá các cột của 1 mã (hoặc toàn bộ nếu symbol=None)."""
+        with self._lock:
+            if symbol is None:
+                self._entries.clear()
+                self._series.clear()
+                self._bytes = 0
+                return
+            for key in [k for k in self._entries if k[0][0] == symbol]:
+                self._drop(key)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "series": len(self._series),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "extensions": self.extensions,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+            }
+
+    # ---------- Internal (gọi khi đang giữ lock) ----------
+
+    def _track_series(self, series_id: SeriesId, ts: np.ndarray) -> bool:
+        """
+        Ghi nhận ts của chuỗi vừa tính; False nếu không khớp chuỗi đã cache
+        (không phải prefix cũng không nối tiếp) -> không lưu cột.
+        """
+        series = self._series.get(series_id)
+        if series is None:
+            self._series[series_id] = _CachedSeries(_readonly(ts))
+            self._bytes += ts.nbytes
+            return True
+        if _is_prefix(ts, series.ts):
+            return True
+        if not _is_prefix(series.ts, ts):
+            return False
+        # Append: cột cũ (ngắn hơn) vẫn là prefix hợp lệ của chuỗi mới
+        self.extensions += 1
+        self._bytes += ts.nbytes - series.ts.nbytes
+        series.ts = _readonly(ts)
+        return True
+
+    def _put(self, key: IndicatorKey, values: np.ndarray) -> None:
+        old = self._entries.get(key)
+        if old is not None:
+            if len(old) >= len(values):
+                return
+            self._bytes -= old.nbytes
+        else:
+            self._series[key[0]].columns += 1
+        self._entries[key] = _readonly(values)
+        self._entries.move_to_end(key)
+        self._bytes += values.nbytes
+
+    def _drop(self, key: IndicatorKey) -> None:
+        self._bytes -= self._entries.pop(key).nbytes
+        series = self._series[key[0]]
+        series.columns -= 1
+        if series.columns == 0:
+            self._bytes -= self._series.pop(key[0]).ts.nbytes
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and self._entries:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+
+def _is_prefix(ts: np.ndarray, longer: np.ndarray) -> bool:
+    return len(ts) <= len(longer) and np.array_equal(longer[:len(ts)], ts)
+
+
+def _readonly(values: np.ndarray) -> np.ndarray:
+    stored = values.copy()
+    stored.flags.writeable = False
+    return stored
@@ -0,0 +1,421 @@
+# app/services/indicator_registry.py
+
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+# ============================================================
+# 1) NODE & SPEC
+# ============================================================
+
+# Node = (tên indicator, param key). Param key là int khi chỉ có 1 tham số (period),
+# tuple khi có nhiều tham số -> giữ nguyên dạng Dict[str, set(period)] của "required".
+Node = Tuple[str, Hashable]
+
+# Cột giá gốc trong DataFrame (node nguồn, không cần tính)
+SOURCE_COLUMNS: Dict[str, str] = {
+    "OPEN": "open",
+    "HIGH": "high",
+    "LOW": "low",
+    "CLOSE": "close",
+    "VOLUME": "volume",
+}
+CLOSE: Node = ("CLOSE", None)
+
+
+# EMA (adjust=False) phụ thuộc toàn bộ quá khứ kể từ bar seed: EMA luôn được seed đúng
+# EMA_WARMUP_PERIODS * period bar trước data_from (xem compute_indicator_columns, origin)
+# -> giá trị không phụ thuộc lượng lịch sử đã load; trọng số của seed còn ~e^-(2 * 4) ~ 3e-4
+EMA_WARMUP_PERIODS = 4
+
+
+@dataclass(frozen=True)
+class IndicatorSpec:
+    """
+    1 indicator trong registry:
+      - inputs(params) -> các node phụ thuộc (cột giá hoặc indicator khác)
+      - kernel(*input_arrays, *params) -> mảng float cùng shape: 1D (1 mã) hoặc 2D (n_bars, n_mã), tính theo cột
+      - lookback(params) -> số bar kernel cần thêm trước bar đầu tiên có giá trị
+        (tính từ bar hợp lệ đầu tiên của input; warm-up của input được cộng dồn theo DAG)
+      - seeded: kết quả phụ thuộc bar bắt đầu của input (EMA adjust=False) -> input được cắt
+        tại seed_start() thay vì bắt đầu ở bar đầu tiên đã load
+    """
+    name: str
+    kernel: Callable[..., np.ndarray]
+    inputs: Callable[..., List[Node]]
+    lookback: Callable[..., int]
+    seeded: bool = False
+
+
+_REGISTRY: Dict[str, IndicatorSpec] = {}
+
+# indicator trong rule JSON -> (params của rule -> node cần đọc); None = không hỗ trợ
+RuleAdapter = Callable[[Dict[str, Any]], Optional[Node]]
+_RULE_ADAPTERS: Dict[str, RuleAdapter] = {}
+
+
+def register_indicator(
+    name: str,
+    inputs: Callable[..., List[Node]],
+    lookback: Callable[..., int] = lambda *_params: 0,
+    seeded: bool = False,
+):
+    """Decorator đăng ký kernel cho 1 indicator."""
+    def decorator(kernel: Callable[..., np.ndarray]) -> Callable[..., np.ndarray]:
+        _REGISTRY[name] = IndicatorSpec(
+            name=name, kernel=kernel, inputs=inputs, lookback=lookback, seeded=seeded
+        )
+        return kernel
+    return decorator
+
+
+def register_rule_indicator(name: str, adapter: RuleAdapter) -> None:
+    """Đăng ký cách đọc 1 indicator trong strategy.rules (tên + params -> node)."""
+    _RULE_ADAPTERS[name.upper()] = adapter
+
+
+def is_registered(name: str) -> bool:
+    return name in _REGISTRY
+
+
+def indicator_spec(name: str) -> IndicatorSpec:
+    """Spec đã đăng ký của 1 indicator (KeyError nếu chưa đăng ký)."""
+    return _REGISTRY[name]
+
+
+def params_tuple(key: Hashable) -> Tuple[Any, ...]:
+    if key is None:
+        return ()
+    return key if isinstance(key, tuple) else (key,)
+
+
+def _format_param(value: Any) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def column_name(node: Node) -> str:
+    """Tên cột trong DataFrame: SMA 20 -> sma_20, MACD_SIGNAL (12, 26, 9) -> macd_signal_12_26_9."""
+    name, key = node
+    if name in SOURCE_COLUMNS:
+        return SOURCE_COLUMNS[name]
+    return "_".join([name.lower()] + [_format_param(p) for p in params_tuple(key)])
+
+
+def rule_node(indicator: Optional[str], params: Optional[Dict[str, Any]]) -> Optional[Node]:
+    """Node tương ứng với 1 vế của rule (indicator + params); None nếu không hỗ trợ."""
+    if not indicator:
+        return None
+    indicator = str(indicator).upper()
+    if indicator in SOURCE_COLUMNS:
+        return (indicator, None)
+    adapter = _RULE_ADAPTERS.get(indicator)
+    if adapter is None:
+        return None
+    try:
+        return adapter(params or {})
+    except (TypeError, ValueError):
+        return None
+
+
+# ============================================================
+# 2) DAG RESOLUTION & COMPUTE
+# ============================================================
+
+def required_nodes(required: Dict[str, Iterable[Hashable]]) -> List[Node]:
+    """Dict indicator -> set(param key) (dạng "required" của engine) -> danh sách node đã đăng ký."""
+    nodes: List[Node] = []
+    for name, keys in required.items():
+        if name not in _REGISTRY:
+            continue
+        for key in sorted(keys, key=repr):
+            nodes.append((name, key))
+    return nodes
+
+
+def resolve_plan(nodes: Iterable[Node]) -> List[Node]:
+    """
+    Thứ tự tính (topological) cho các node yêu cầu + mọi node trung gian,
+    mỗi node chỉ xuất hiện 1 lần (vd EMA12 dùng chung cho EMA rule và MACD).
+    """
+    order: List[Node] = []
+    state: Dict[Node, int] = {}  # 1 = đang duyệt, 2 = xong
+
+    def visit(node: Node) -> None:
+        mark = state.get(node)
+        if mark == 2:
+            return
+        if mark == 1:
+            raise ValueError(f"Indicator dependency cycle at {node}")
+        state[node] = 1
+        name, key = node
+        if name not in SOURCE_COLUMNS:
+            spec = _REGISTRY[name]
+            for dep in spec.inputs(*params_tuple(key)):
+                visit(dep)
+            order.append(node)
+        state[node] = 2
+
+    for node in nodes:
+        visit(node)
+    return order
+
+
+def node_lookback(node: Node, _memo: Optional[Dict[Node, int]] = None) -> int:
+    """
+    Số bar quá khứ cần có trước 1 bar để node có giá trị đúng tại bar đó
+    = lookback của kernel + lookback lớn nhất trong các input (đi theo DAG).
+    Vd SMA 200 -> 199, MACD_SIGNAL (12, 26, 9) -> warm-up EMA 26 + warm-up EMA 9 của đường MACD.
+    """
+    memo = {} if _memo is None else _memo
+    if node in memo:
+        return memo[node]
+    name, key = node
+    if name in SOURCE_COLUMNS:
+        return 0
+    spec = _REGISTRY[name]
+    params = params_tuple(key)
+    deps = spec.inputs(*params)
+    memo[node] = int(spec.lookback(*params)) + max((node_lookback(dep, memo) for dep in deps), default=0)
+    return memo[node]
+
+
+def depends_on_origin(node: Node) -> bool:
+    """Node seeded hoặc có input (theo DAG) seeded -> giá trị phụ thuộc origin."""
+    name, key = node
+    if name in SOURCE_COLUMNS:
+        return False
+    spec = _REGISTRY[name]
+    return spec.seeded or any(depends_on_origin(dep) for dep in spec.inputs(*params_tuple(key)))
+
+
+def seed_start(node: Node, origin: int, _memo: Optional[Dict[Node, int]] = None) -> int:
+    """
+    Bar bắt đầu của node seeded: đúng node_lookback bar trước origin (bar đầu tiên >= data_from).
+    Input trước bar này bị bỏ (NaN) -> cùng 1 bar seed dù load thêm bao nhiêu lịch sử
+    (job chạy riêng / trong batch / trong panel portfolio cho cùng kết quả từng bit).
+    """
+    return origin - node_lookback(node, _memo)
+
+
+def max_lookback(nodes: Iterable[Node]) -> int:
+    """Warm-up (số bar) đủ cho mọi node: max node_lookback, 0 nếu không có node."""
+    memo: Dict[Node, int] = {}
+    return max((node_lookback(node, memo) for node in nodes), default=0)
+
+
+def compute_indicator_columns(
+    nodes: Iterable[Node],
+    get_column: Callable[[str], Optional[np.ndarray]],
+    compute: Optional[Callable[[Node, Callable[[], np.ndarray]], np.ndarray]] = None,
+    origin: Optional[int] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Tính các node (và node trung gian) theo DAG.
+    get_column(tên cột) -> mảng đã có sẵn (cột giá, hoặc indicator đã tính) hoặc None.
+    compute(node, fn) -> bọc fn() (vd qua indicator cache); mặc định gọi thẳng fn().
+    origin: chỉ số bar đầu tiên >= data_from (theo trục bar, axis 0) -> node seeded (EMA...)
+            bỏ input trước seed_start(); None -> seed ở bar đầu tiên của input.
+    Trả về {tên cột: mảng} cho mọi node vừa tính (không gồm cột đã có sẵn).
+    """
+    values: Dict[Node, np.ndarray] = {}
+    computed: Dict[str, np.ndarray] = {}
+    memo: Dict[Node, int] = {}
+
+    def input_array(node: Node) -> np.ndarray:
+        if node in values:
+            return values[node]
+        array = get_column(column_name(node))
+        if array is None:
+            raise KeyError(f"Missing input column {column_name(node)}")
+        return array
+
+    for node in resolve_plan(nodes):
+        existing = get_column(column_name(node))
+        if existing is not None:
+            values[node] = existing
+            continue
+
+        name, key = node
+        spec = _REGISTRY[name]
+        params = params_tuple(key)
+        inputs = [input_array(dep) for dep in spec.inputs(*params)]
+        if spec.seeded and origin is not None:
+            start = seed_start(node, origin, memo)
+            if start > 0:
+                inputs = [_drop_before(array, start) for array in inputs]
+
+        def run(spec=spec, inputs=inputs, params=params) -> np.ndarray:
+            return np.asarray(spec.kernel(*inputs, *params), dtype=float)
+
+        values[node] = run() if compute is None else compute(node, run)
+        computed[column_name(node)] = values[node]
+
+    return computed
+
+
+# ============================================================
+# 3) KERNELS
+# ============================================================
+
+def compute_rsi_series(close, period: int):
+    """
+    Tính RSI cho một chu kỳ bất kỳ (Series, hoặc DataFrame -> từng cột).
+    """
+    delta = close.diff()
+    gain = delta.where(delta > 0, 0.0)
+    loss = -delta.where(delta < 0, 0.0)
+
+    avg_gain = gain.rolling(window=period, min_periods=period).mean()
+    avg_loss = loss.rolling(window=period, min_periods=period).mean()
+
+    rs = avg_gain / avg_loss
+    rsi = 100.0 - (100.0 / (1.0 + rs))
+    return rsi
+
+
+def _drop_before(values: np.ndarray, start: int) -> np.ndarray:
+    # NaN đầu chuỗi được ewm bỏ qua khi seed -> giống hệt tính trên input đã cắt từ start
+    values = np.array(values, dtype=float)
+    values[:start] = np.nan
+    return values
+
+
+def _close_only(*_params) -> List[Node]:
+    return [CLOSE]
+
+
+def _pandas(values: np.ndarray):
+    # Kernel nhận mảng 1D (1 mã) hoặc 2D (n_bars, n_mã) - pandas tính độc lập từng cột
+    return pd.DataFrame(values) if values.ndim == 2 else pd.Series(values)
+
+
+def _ema_array(values: np.ndarray, period: int) -> np.ndarray:
+    # ewm(adjust=False) chạy trong C; NaN đầu chuỗi (vd đường MACD) được bỏ qua khi seed
+    return _pandas(values).ewm(span=period, adjust=False, min_periods=period).mean().to_numpy()
+
+
+def _window_lookback(period: int, *_params) -> int:
+    # rolling(window=period, min_periods=period): giá trị đầu tiên ở bar thứ period
+    return int(period) - 1
+
+
+def _ema_lookback(period: int, *_params) -> int:
+    return max(int(period) - 1, EMA_WARMUP_PERIODS * int(period))
+
+
+@register_indicator("SMA", inputs=_close_only, lookback=_window_lookback)
+def sma_kernel(close: np.ndarray, period: int) -> np.ndarray:
+    # Giữ đúng rolling mean của pandas để kết quả trùng từng bit với cột sma_* cũ
+    return _pandas(close).rolling(window=period, min_periods=period).mean().to_numpy()
+
+
+# RSI: diff() mất 1 bar rồi mới tới cửa sổ period
+@register_indicator("RSI", inputs=_close_only, lookback=lambda period: int(period))
+def rsi_kernel(close: np.ndarray, period: int) -> np.ndarray:
+    return compute_rsi_series(_pandas(close), period).to_numpy()
+
+
+@register_indicator("EMA", inputs=_close_only, lookback=_ema_lookback, seeded=True)
+def ema_kernel(close: np.ndarray, period: int) -> np.ndarray:
+    return _ema_array(close, period)
+
+
+@register_indicator("STDDEV", inputs=_close_only, lookback=_window_lookback)
+def stddev_kernel(close: np.ndarray, period: int) -> np.ndarray:
+    """Độ lệch chuẩn tổng thể (ddof=0) trên cửa sổ trượt, dùng cho Bollinger."""
+    # 2D: mỗi mã thành 1 hàng liên tục trong bộ nhớ -> std rút gọn giống hệt chuỗi 1D
+    series = np.ascontiguousarray(close.T)
+    out = np.full(series.shape, np.nan)
+    if series.shape[-1] >= period:
+        out[..., period - 1:] = sliding_window_view(series, period, axis=-1).std(axis=-1)
+    return out.T
+
+
+@register_indicator("MACD", inputs=lambda fast, slow: [("EMA", fast), ("EMA", slow)])
+def macd_kernel(ema_fast: np.ndarray, ema_slow: np.ndarray, fast: int, slow: int) -> np.ndarray:
+    return ema_fast - ema_slow
+
+
+@register_indicator(
+    "MACD_SIGNAL",
+    inputs=lambda fast, slow, signal: [("MACD", (fast, slow))],
+    lookback=lambda fast, slow, signal: _ema_lookback(signal),
+    seeded=True,
+)
+def macd_signal_kernel(macd: np.ndarray, fast: int, slow: int, signal: int) -> np.ndarray:
+    return _ema_array(macd, signal)
+
+
+@register_indicator(
+    "MACD_HIST",
+    inputs=lambda fast, slow, signal: [("MACD", (fast, slow)), ("MACD_SIGNAL", (fast, slow, signal))],
+)
+def macd_hist_kernel(macd: np.ndarray, signal_line: np.ndarray, fast: int, slow: int, signal: int) -> np.ndarray:
+    return macd - signal_line
+
+
+@register_indicator("BB_UPPER", inputs=lambda period, num_std: [("SMA", period), ("STDDEV", period)])
+def bb_upper_kernel(mid: np.ndarray, std: np.ndarray, period: int, num_std: float) -> np.ndarray:
+    return mid + num_std * std
+
+
+@register_indicator("BB_LOWER", inputs=lambda period, num_std: [("SMA", period), ("STDDEV", period)])
+def bb_lower_kernel(mid: np.ndarray, std: np.ndarray, period: int, num_std: float) -> np.ndarray:
+    return mid - num_std * std
+
+
+# ============================================================
+# 4) RULE ADAPTERS (strategy JSON -> node)
+# ============================================================
+
+def _int_param(params: Dict[str, Any], name: str, default: Optional[int] = None) -> Optional[int]:
+    value = params.get(name, default)
+    return int(value) if value is not None else None
+
+
+def _period_adapter(name: str) -> RuleAdapter:
+    def adapter(params: Dict[str, Any]) -> Optional[Node]:
+        period = _int_param(params, "period")
+        return (name, period) if period is not None else None
+    return adapter
+
+
+def _macd_adapter(params: Dict[str, Any]) -> Optional[Node]:
+    """params: fast=12, slow=26, signal=9, output = macd | signal | histogram."""
+    fast = _int_param(params, "fast", 12)
+    slow = _int_param(params, "slow", 26)
+    signal = _int_param(params, "signal", 9)
+    output = str(params.get("output", "macd")).lower()
+    if output == "macd":
+        return ("MACD", (fast, slow))
+    if output == "signal":
+        return ("MACD_SIGNAL", (fast, slow, signal))
+    if output in ("histogram", "hist"):
+        return ("MACD_HIST", (fast, slow, signal))
+    return None
+
+
+def _bollinger_adapter(params: Dict[str, Any]) -> Optional[Node]:
+    """params: period=20, std_dev=2, band = middle | upper | lower."""
+    period = _int_param(params, "period", 20)
+    num_std = float(params.get("std_dev", 2.0))
+    band = str(params.get("band", "middle")).lower()
+    if band == "middle":
+        return ("SMA", period)
+    if band == "upper":
+        return ("BB_UPPER", (period, num_std))
+    if band == "lower":
+        return ("BB_LOWER", (period, num_std))
+    return None
+
+
+register_rule_indicator("SMA", _period_adapter("SMA"))
+register_rule_indicator("RSI", _period_adapter("RSI"))
+register_rule_indicator("EMA", _period_adapter("EMA"))
+register_rule_indicator("MACD", _macd_adapter)
+register_rule_indicator("BOLLINGER", _bollinger_adapter)
@@ -0,0 +1,103 @@
+# app/services/job_batcher.py
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Set
+
+from app.models.backtest_models import BacktestJobMessage
+from app.services.job_control import JobControl
+
+# run_group(jobs cùng symbol, control của từng job) -> kết quả theo đúng thứ tự
+# (dict hoặc Exception cho từng job)
+GroupRunner = Callable[
+    [List[BacktestJobMessage], List[Optional[JobControl]]], Awaitable[Sequence[Any]]
+]
+
+
+class SymbolBatcher:
+    """
+    Gom job backtest đến trong 1 cửa sổ ngắn (window_seconds) rồi chạy theo nhóm symbol:
+    mỗi nhóm = 1 lần load dữ liệu + tính chỉ báo, mỗi job vẫn có kết quả riêng.
+    Chạy trong event loop của consumer (không thread-safe, không cần lock).
+    """
+
+    def __init__(self, window_seconds: float, max_jobs: int, run_group: GroupRunner) -> None:
+        self.window_seconds = max(0.0, window_seconds)
+        self.max_jobs = max(1, max_jobs)
+        self._run_group = run_group
+        self._pending: List[tuple] = []  # (job, control, future)
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set["asyncio.Task[None]"] = set()
+
+        self.batches = 0
+        self.jobs = 0
+        self.groups = 0
+
+    async def submit(
+        self,
+        job: BacktestJobMessage,
+        control: Optional[JobControl] = None,
+    ) -> Dict[str, Any]:
+        """Đưa job vào batch hiện tại, chờ kết quả của riêng job đó."""
+        loop = asyncio.get_running_loop()
+        future: "asyncio.Future[Dict[str, Any]]" = loop.create_future()
+        self._pending.append((job, control, future))
+
+        if len(self._pending) >= self.max_jobs:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window_seconds, self._flush)
+        return await future
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window_seconds": self.window_seconds,
+            "max_jobs": self.max_jobs,
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "groups": self.groups,
+            "jobs": self.jobs,
+        }
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        by_symbol: Dict[str, List[tuple]] = {}
+        for item in pending:
+            by_symbol.setdefault(item[0].symbol, []).append(item)
+
+        self.batches += 1
+        self.jobs += len(pending)
+        self.groups += len(by_symbol)
+
+        for items in by_symbol.values():
+            # Giữ tham chiếu tới task, tránh bị GC khi đang chạy
+            task = asyncio.ensure_future(self._run(items))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, items: List[tuple]) -> None:
+        jobs = [job for job, _, _ in items]
+        controls = [control for _, control, _ in items]
+        try:
+            results = await self._run_group(jobs, controls)
+        except BaseException as e:
+            # Lỗi cả nhóm (vd worker chết) -> từng job nhận exception
+            for _, _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            return
+
+        for (_, _, future), result in zip(items, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,129 @@
+# app/services/job_control.py
+
+import os
+import time
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, MutableMapping, Optional
+
+# Mỗi bao nhiêu bar thì engine dừng lại 1 lần (chunk boundary) để kiểm tra cancel/timeout
+CHECKPOINT_BARS = int(os.getenv("BACKTEST_CHECKPOINT_BARS", "2000") or 2000)
+
+# Khoảng cách tối thiểu giữa 2 lần đọc cờ cancel (IPC tới manager process) / 2 event progress
+CANCEL_CHECK_SECONDS = float(os.getenv("BACKTEST_CANCEL_CHECK_SECONDS", "0.2"))
+PROGRESS_INTERVAL_SECONDS = float(os.getenv("BACKTEST_PROGRESS_INTERVAL_SECONDS", "1.0"))
+
+# Timeout wall-clock mặc định cho 1 job (job_config.timeout_seconds override), 0 = không giới hạn
+DEFAULT_JOB_TIMEOUT_SECONDS = float(os.getenv("BACKTEST_JOB_TIMEOUT_SECONDS", "900") or 0)
+
+
+class JobCancelled(Exception):
+    """Job bị huỷ (message backtest.cancel) - engine dừng ở chunk boundary kế tiếp."""
+
+
+class JobTimedOut(JobCancelled):
+    """Job chạy quá timeout wall-clock."""
+
+
+def job_timeout_seconds(job_config: Optional[Dict[str, Any]]) -> float:
+    """Timeout của job: job_config.timeout_seconds, không có -> BACKTEST_JOB_TIMEOUT_SECONDS."""
+    value = (job_config or {}).get("timeout_seconds", DEFAULT_JOB_TIMEOUT_SECONDS)
+    try:
+        return max(0.0, float(value or 0))
+    except (TypeError, ValueError):
+        return DEFAULT_JOB_TIMEOUT_SECONDS
+
+
+@dataclass
+class JobControl:
+    """
+    Điều khiển 1 job đang chạy trong worker (picklable, gửi kèm job sang executor):
+      - cancel_flags: dict dùng chung (Manager) job_id -> thời điểm huỷ
+      - progress_sink: queue dùng chung (Manager), consumer publish lên backtest.progress
+      - timeout: số giây tối đa kể từ lúc worker bắt đầu chạy job (start()), 0 = không giới hạn;
+        thời gian chờ trong batcher / hàng đợi executor không bị tính
+      - deadline: time.time() tại đó job bị coi là timeout (None = không giới hạn)
+    Engine gọi checkpoint() ở mỗi chunk boundary; cờ cancel & event progress đều bị throttle.
+    """
+    job_id: int
+    deadline: Optional[float] = None
+    cancel_flags: Optional[MutableMapping[int, float]] = None
+    progress_sink: Optional[Any] = None
+    started_at: float = field(default_factory=time.time)
+    timeout: float = 0.0
+    running: bool = False
+    _last_cancel_check: float = 0.0
+    _last_progress: float = 0.0
+
+    def start(self) -> None:
+        """
+        Worker bắt đầu chạy job: tính deadline từ thời điểm này, gửi event "start"
+        (consumer bắt đầu đếm watchdog). Gọi nhiều lần chỉ có tác dụng lần đầu.
+        """
+        if self.running:
+            return
+        self.running = True
+        self.started_at = time.time()
+        if self.timeout > 0:
+            self.deadline = self.started_at + self.timeout
+        if self.progress_sink is not None:
+            self._emit(0, 0, None, "start", self.started_at)
+
+    def subtask(self) -> "JobControl":
+        """
+        Bản cho task con trong pool (process khác): cùng job_id, cờ cancel và deadline,
+        không gửi progress (job cha tự tổng hợp progress khi nhận kết quả task).
+        """
+        return replace(self, progress_sink=None, _last_cancel_check=0.0, _last_progress=0.0)
+
+    def check(self) -> None:
+        """Raise JobCancelled / JobTimedOut nếu job cần dừng (không throttle)."""
+        now = time.time()
+        self._last_cancel_check = now
+        if self.deadline is not None and now >= self.deadline:
+            raise JobTimedOut(
+                f"Job {self.job_id} timed out after {self.deadline - self.started_at:.0f}s"
+            )
+        if self.cancel_flags is not None and self.job_id in self.cancel_flags:
+            raise JobCancelled(f"Job {self.job_id} cancelled")
+
+    def checkpoint(
+        self,
+        done: int,
+        total: int,
+        equity: Optional[float] = None,
+        stage: str = "simulate",
+    ) -> None:
+        """Chunk boundary: kiểm tra cancel/timeout, gửi progress (đã throttle)."""
+        now = time.time()
+        if now - self._last_cancel_check >= CANCEL_CHECK_SECONDS:
+            self.check()
+        if self.progress_sink is not None and now - self._last_progress >= PROGRESS_INTERVAL_SECONDS:
+            self._last_progress = now
+            self._emit(done, total, equity, stage, now)
+
+    def finish(self, total: int, equity: Optional[float] = None) -> None:
+        """Event 100% (luôn gửi, không throttle)."""
+        if self.progress_sink is not None:
+            self._emit(total, total, equity, "done", time.time())
+
+    def _emit(self, done: int, total: int, equity: Optional[float], stage: str, now: float) -> None:
+        event = {
+            "job_id": self.job_id,
+            "stage": stage,
+            # total <= 0: chưa biết tổng số bar (streaming đọc theo chunk) -> progress None
+            "progress": (
+                round(100.0 * done / total, 2) if total > 0
+                else {"done": 100.0, "start": 0.0}.get(stage)
+            ),
+            # stage "simulate": đơn vị là bar; "sweep": số lần đánh giá tổ hợp (cửa sổ x tổ hợp);
+            # "screen": số mã đã chạy xong; "start": worker vừa bắt đầu chạy job
+            "processed": int(done),
+            "total": int(total),
+            "equity": None if equity is None else float(equity),
+            "elapsedSeconds": round(now - self.started_at, 3),
+        }
+        try:
+            self.progress_sink.put_nowait(event)
+        except Exception:
+            # Progress chỉ là thông tin phụ: không để lỗi IPC làm hỏng job
+            pass
@@ -0,0 +1,105 @@
+# app/services/message_codec.py
+
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+# msgpack / orjson là tuỳ chọn: thiếu thì dùng JSON của stdlib
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - tuỳ môi trường
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - tuỳ môi trường
+    orjson = None
+
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_MSGPACK = "application/msgpack"
+
+# Các content_type khác nhau cho cùng 1 định dạng
+_CONTENT_TYPE_ALIASES = {
+    "application/x-msgpack": CONTENT_TYPE_MSGPACK,
+    "application/vnd.msgpack": CONTENT_TYPE_MSGPACK,
+    "text/json": CONTENT_TYPE_JSON,
+}
+
+# "orjson" (mặc định nếu đã cài) hoặc "stdlib" cho application/json
+JSON_CODEC = os.getenv("BACKTEST_JSON_CODEC", "orjson").lower()
+
+
+@dataclass(frozen=True)
+class MessageCodec:
+    name: str
+    content_type: str
+    encode: Callable[[Any], bytes]
+    decode: Callable[[bytes], Any]
+
+
+def _stdlib_encode(obj: Any) -> bytes:
+    return json.dumps(obj).encode()
+
+
+def _stdlib_decode(body: bytes) -> Any:
+    return json.loads(body.decode())
+
+
+STDLIB_JSON_CODEC = MessageCodec("json", CONTENT_TYPE_JSON, _stdlib_encode, _stdlib_decode)
+
+_CODECS: Dict[str, MessageCodec] = {CONTENT_TYPE_JSON: STDLIB_JSON_CODEC}
+
+if orjson is not None:
+    ORJSON_CODEC: Optional[MessageCodec] = MessageCodec(
+        "orjson",
+        CONTENT_TYPE_JSON,
+        # NaN/Infinity -> null (stdlib sẽ ghi NaN, JSON.parse phía NestJS không đọc được)
+        orjson.dumps,
+        orjson.loads,
+    )
+    if JSON_CODEC == "orjson":
+        _CODECS[CONTENT_TYPE_JSON] = ORJSON_CODEC
+else:
+    ORJSON_CODEC = None
+
+if msgpack is not None:
+    MSGPACK_CODEC: Optional[MessageCodec] = MessageCodec(
+        "msgpack",
+        CONTENT_TYPE_MSGPACK,
+        lambda obj: msgpack.packb(obj, use_bin_type=True, default=str),
+        lambda body: msgpack.unpackb(body, raw=False, strict_map_key=False),
+    )
+    _CODECS[CONTENT_TYPE_MSGPACK] = MSGPACK_CODEC
+else:
+    MSGPACK_CODEC = None
+
+
+def normalize_content_type(content_type: Optional[str]) -> str:
+    """Bỏ tham số (";charset=utf-8"), đổi alias -> content_type chuẩn; trống -> JSON."""
+    if not content_type:
+        return CONTENT_TYPE_JSON
+    base = content_type.split(";", 1)[0].strip().lower()
+    return _CONTENT_TYPE_ALIASES.get(base, base)
+
+
+def codec_for(content_type: Optional[str]) -> MessageCodec:
+    """
+    Codec cho content_type của message AMQP. Không hỗ trợ (hoặc thiếu thư viện) -> JSON,
+    để job từ NestJS (không set content_type) vẫn chạy như cũ.
+    """
+    codec = _CODECS.get(normalize_content_type(content_type))
+    if codec is None:
+        print(f"[FastAPI] ⚠ Unsupported content_type={content_type!r}, falling back to JSON")
+        return _CODECS[CONTENT_TYPE_JSON]
+    return codec
+
+
+def available_codecs() -> List[MessageCodec]:
+    """Mọi codec dùng được trong môi trường hiện tại (kể cả stdlib JSON khi đã có orjson)."""
+    codecs = [STDLIB_JSON_CODEC]
+    if ORJSON_CODEC is not None:
+        codecs.append(ORJSON_CODEC)
+    if MSGPACK_CODEC is not None:
+        codecs.append(MSGPACK_CODEC)
+    return codecs
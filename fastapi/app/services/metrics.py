@@ -0,0 +1,286 @@
+# app/services/metrics.py
+
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Bucket (giây) cho thời gian từng giai đoạn / cả job
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+METRICS_ENABLED = os.getenv("BACKTEST_METRICS", "1").lower() not in ("0", "false", "no")
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+# ============================================================
+# 1) METRIC TYPES (Prometheus text format, không cần prometheus_client)
+# ============================================================
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = STAGE_BUCKETS,
+    ) -> None:
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label -> (đếm theo bucket, sum, count)
+        self._values: Dict[LabelValues, List[Any]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v[0]), v[1], v[2]) for k, v in self._values.items()]
+        lines = []
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS: Histogram = REGISTRY.register(Histogram(
+    "backtest_stage_seconds",
+    "Thời gian từng giai đoạn của job (load, indicators, rules, simulate, serialize, encode, publish)",
+    ["stage"],
+))
+JOB_SECONDS: Histogram = REGISTRY.register(Histogram(
+    "backtest_job_seconds", "Thời gian xử lý 1 message job (nhận -> publish)", ["job_type"],
+))
+QUEUE_LAG_SECONDS: Histogram = REGISTRY.register(Histogram(
+    "backtest_queue_lag_seconds", "Thời gian message nằm trong queue (timestamp AMQP -> nhận)", [],
+))
+JOBS_TOTAL: Counter = REGISTRY.register(Counter(
+    "backtest_jobs_total", "Số job đã xử lý (rate() = jobs/s)", ["job_type", "status"],
+))
+JOBS_IN_FLIGHT: Gauge = REGISTRY.register(Gauge(
+    "backtest_jobs_in_flight", "Số job đang chạy trong consumer", [],
+))
+ROWS_LOADED_TOTAL: Counter = REGISTRY.register(Counter(
+    "backtest_rows_loaded_total", "Số dòng giá đã load cho job (sau cache)", [],
+))
+CACHE_EVENTS: Gauge = REGISTRY.register(Gauge(
+    "backtest_cache_events",
+    "Hit/miss... cộng dồn của price/indicator cache (qua các worker process) và result cache",
+    ["cache", "event"],
+))
+SLOW_JOB_PROFILES_TOTAL: Counter = REGISTRY.register(Counter(
+    "backtest_slow_job_profiles_total", "Số profile đã ghi cho job chậm", [],
+))
+
+
+def render_prometheus() -> str:
+    return REGISTRY.render()
+
+
+# ============================================================
+# 2) PER-JOB COLLECTOR (chạy trong worker, gửi về consumer kèm kết quả)
+# ============================================================
+
+class JobMetrics:
+    """Số liệu của 1 job, thu trong worker (process/thread) rồi gửi về consumer để ghi vào REGISTRY."""
+
+    def __init__(self) -> None:
+        self.stages: Dict[str, float] = {}
+        self.counts: Dict[str, float] = {}
+
+    def add_stage(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def count(self, name: str, amount: float = 1.0) -> None:
+        self.counts[name] = self.counts.get(name, 0.0) + amount
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"stages": self.stages, "counts": self.counts}
+
+
+_current: ContextVar[Optional[JobMetrics]] = ContextVar("backtest_job_metrics", default=None)
+
+
+@contextmanager
+def collect_job_metrics() -> Iterator[JobMetrics]:
+    """Bật collector cho đoạn code chạy 1 job; stage_timer/count_metric bên trong ghi vào đây."""
+    metrics = JobMetrics()
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """Đo 1 giai đoạn của job; không có collector (vd benchmark, API đồng bộ) -> không làm gì."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_stage(stage, time.perf_counter() - started)
+
+
+def count_metric(name: str, amount: float = 1.0) -> None:
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.count(name, amount)
+
+
+# ============================================================
+# 3) GHI VÀO REGISTRY (process consumer)
+# ============================================================
+
+# pid worker -> {(cache, event): giá trị cộng dồn của process đó}
+_worker_cache_stats: Dict[int, Dict[Tuple[str, str], float]] = {}
+_worker_cache_lock = threading.Lock()
+_CACHE_EVENTS = ("hits", "misses", "refreshes", "backfills", "extensions", "evictions")
+
+
+def cache_stats_snapshot(caches: Dict[str, Optional[Any]]) -> Dict[str, Dict[str, float]]:
+    """Counter của các cache trong process hiện tại (gửi kèm kết quả job về consumer)."""
+    snapshot: Dict[str, Dict[str, float]] = {}
+    for name, cache in caches.items():
+        if cache is None:
+            continue
+        stats = cache.stats()
+        snapshot[name] = {e: float(stats[e]) for e in _CACHE_EVENTS if e in stats}
+    return snapshot
+
+
+def record_job_metrics(payload: Optional[Dict[str, Any]]) -> None:
+    """Ghi số liệu 1 job (từ JobMetrics.as_dict + cache snapshot của worker) vào REGISTRY."""
+    if not METRICS_ENABLED or not payload:
+        return
+    for stage, seconds in (payload.get("stages") or {}).items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
+    counts = payload.get("counts") or {}
+    if counts.get("rows_loaded"):
+        ROWS_LOADED_TOTAL.inc(counts["rows_loaded"])
+    if counts.get("slow_job_profiles"):
+        SLOW_JOB_PROFILES_TOTAL.inc(counts["slow_job_profiles"])
+
+    caches = payload.get("caches")
+    pid = payload.get("pid")
+    if caches and pid is not None:
+        # Counter của cache là cộng dồn theo process -> giữ bản mới nhất mỗi pid rồi cộng lại
+        with _worker_cache_lock:
+            _worker_cache_stats[pid] = {
+                (cache, event): value
+                for cache, events in caches.items()
+                for event, value in events.items()
+            }
+            totals: Dict[Tuple[str, str], float] = {}
+            for stats in _worker_cache_stats.values():
+                for key, value in stats.items():
+                    totals[key] = totals.get(key, 0.0) + value
+        for (cache, event), value in totals.items():
+            CACHE_EVENTS.set(value, cache=cache, event=event)
@@ -0,0 +1,368 @@
+# app/services/monte_carlo.py
+"""
+Phân tích Monte Carlo / bootstrap sau backtest: lấy mẫu lại danh sách lệnh và lợi nhuận theo ngày
+hàng nghìn lần để thấy phân phối netProfit / maxDrawdown thay vì 1 giá trị điểm.
+  trade_shuffle        : hoán vị thứ tự lệnh (lợi nhuận cuối không đổi, drawdown thay đổi)
+  trade_bootstrap      : rút lệnh có hoàn lại (iid)
+  daily_block_bootstrap: rút các khối lợi nhuận ngày liên tiếp (circular block bootstrap,
+                         giữ tự tương quan ngắn hạn của equity)
+Mọi phương pháp chạy trên ma trận 2D (đường mô phỏng x mẫu) bằng NumPy, chia lô theo
+BACKTEST_MC_BATCH_ELEMENTS để bộ nhớ bị chặn; 10.000 đường x vài trăm lệnh mất vài chục ms.
+
+Bật theo job: job_config.monte_carlo = true hoặc
+  {"simulations": 10000, "methods": [...], "block_size": 20, "confidence": 0.95, "seed": 1}
+"""
+
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from app.models.backtest_models import MonteCarloDistribution, MonteCarloMethodResult, MonteCarloReport
+
+MC_DEFAULT_SIMULATIONS = int(os.getenv("BACKTEST_MC_SIMULATIONS", "10000") or 10000)
+MC_MAX_SIMULATIONS = int(os.getenv("BACKTEST_MC_MAX_SIMULATIONS", "100000") or 100000)
+# Số phần tử tối đa của 1 ma trận (đường x mẫu) mỗi lô, ~8 byte / phần tử
+MC_BATCH_ELEMENTS = int(os.getenv("BACKTEST_MC_BATCH_ELEMENTS", "4000000") or 4000000)
+
+METHOD_TRADE_SHUFFLE = "trade_shuffle"
+METHOD_TRADE_BOOTSTRAP = "trade_bootstrap"
+METHOD_DAILY_BLOCK_BOOTSTRAP = "daily_block_bootstrap"
+ALL_METHODS: Tuple[str, ...] = (METHOD_TRADE_SHUFFLE, METHOD_TRADE_BOOTSTRAP, METHOD_DAILY_BLOCK_BOOTSTRAP)
+
+PERCENTILES: Tuple[int, ...] = (1, 5, 25, 50, 75, 95, 99)
+SECONDS_PER_DAY = 86_400
+# log của số float dương nhỏ nhất (~ -708): log-growth của 1 bước lỗ 100%
+LOG_GROWTH_FLOOR = float(np.log(np.finfo(float).tiny))
+
+
+# ============================================================
+# 1) OPTIONS
+# ============================================================
+
+@dataclass
+class MonteCarloOptions:
+    simulations: int = MC_DEFAULT_SIMULATIONS
+    methods: Tuple[str, ...] = ALL_METHODS
+    # None -> T^(1/3) ngày (quy tắc thường dùng cho block bootstrap)
+    block_size: Optional[int] = None
+    confidence: float = 0.95
+    seed: Optional[int] = None
+
+
+def monte_carlo_options(
+    job_config: Optional[Dict[str, Any]],
+    default_seed: Optional[int] = None,
+) -> Optional[MonteCarloOptions]:
+    """Đọc job_config.monte_carlo (true / dict); None = không chạy phân tích."""
+    raw = (job_config or {}).get("monte_carlo")
+    if not raw:
+        return None
+    cfg = raw if isinstance(raw, dict) else {}
+
+    try:
+        simulations = int(cfg.get("simulations", MC_DEFAULT_SIMULATIONS))
+    except (TypeError, ValueError):
+        simulations = MC_DEFAULT_SIMULATIONS
+    methods = tuple(m for m in (cfg.get("methods") or ALL_METHODS) if m in ALL_METHODS) or ALL_METHODS
+    try:
+        block_size = max(1, int(cfg["block_size"])) if cfg.get("block_size") else None
+    except (TypeError, ValueError):
+        block_size = None  # -> tự chọn theo số ngày
+    try:
+        confidence = float(cfg.get("confidence", 0.95))
+    except (TypeError, ValueError):
+        confidence = 0.95
+    seed = cfg.get("seed", default_seed)
+    try:
+        seed = int(seed) if seed is not None else None
+    except (TypeError, ValueError):
+        seed = default_seed
+
+    return MonteCarloOptions(
+        simulations=min(max(1, simulations), MC_MAX_SIMULATIONS),
+        methods=methods,
+        block_size=block_size,
+        confidence=min(max(confidence, 0.5), 0.999),
+        seed=seed,
+    )
+
+
+# ============================================================
+# 2) INPUT SERIES
+# ============================================================
+
+def trade_returns(
+    entry_values: Sequence[float],
+    profits: Sequence[float],
+    commission_rate: float,
+) -> np.ndarray:
+    """
+    Lợi nhuận theo tỉ lệ equity của từng lệnh. Engine all-in: mua bằng toàn bộ cash
+    (qty * entry * (1 + phí)), bán thu về qty * entry + profit (profit đã trừ phí bán)
+    -> equity sau lệnh / equity trước lệnh, tích các lệnh = equity cuối / vốn ban đầu.
+    """
+    cost = np.asarray(entry_values, dtype=float)
+    revenue = cost + np.asarray(profits, dtype=float)
+    cost = cost * (1.0 + commission_rate)
+    returns = np.divide(revenue, cost, out=np.ones_like(cost), where=cost > 0) - 1.0
+    # Không lỗ quá 100% equity
+    return np.maximum(returns, -1.0)
+
+
+def daily_closes(times: np.ndarray, equity: np.ndarray) -> np.ndarray:
+    """Equity cuối mỗi ngày (UTC) từ đường equity theo bar."""
+    if len(times) == 0:
+        return np.empty(0, dtype=float)
+    day = np.asarray(times, dtype=np.int64) // SECONDS_PER_DAY
+    last = np.append(np.flatnonzero(np.diff(day)), len(day) - 1)
+    return np.asarray(equity, dtype=float)[last]
+
+
+class DailyCloseAccumulator:
+    """daily_closes theo chunk (streaming_engine): chỉ giữ 1 giá trị / ngày."""
+
+    def __init__(self) -> None:
+        self._parts: List[np.ndarray] = []
+        self._last_day: Optional[int] = None
+
+    def append(self, times: np.ndarray, equity: np.ndarray) -> None:
+        if len(times) == 0:
+            return
+        day = np.asarray(times, dtype=np.int64) // SECONDS_PER_DAY
+        last = np.append(np.flatnonzero(np.diff(day)), len(day) - 1)
+        # Ngày đầu chunk trùng ngày cuối chunk trước -> giá trị mới thay giá trị cũ
+        if self._last_day is not None and int(day[0]) == self._last_day:
+            self._parts[-1] = self._parts[-1][:-1]
+        self._parts.append(np.asarray(equity, dtype=float)[last])
+        self._last_day = int(day[-1])
+
+    def values(self) -> np.ndarray:
+        return np.concatenate(self._parts) if self._parts else np.empty(0, dtype=float)
+
+
+def daily_returns(closes: np.ndarray, initial_capital: float) -> np.ndarray:
+    """Lợi nhuận ngày từ equity cuối ngày (ngày đầu so với vốn ban đầu)."""
+    equity = np.concatenate(([initial_capital], closes))
+    prev = equity[:-1]
+    ratio = np.divide(equity[1:], prev, out=np.ones(len(closes)), where=prev > 0)
+    return np.maximum(ratio - 1.0, -1.0)
+
+
+# ============================================================
+# 3) VECTORIZED SIMULATION
+# ============================================================
+
+def log_growth(returns: np.ndarray) -> np.ndarray:
+    """
+    log(1 + r); lỗ 100% (equity về 0) -> LOG_GROWTH_FLOOR thay cho -inf: vẫn là "cháy tài khoản"
+    (không đường nào hồi lại được e^708 lần) nhưng tránh inf - inf = nan khi cộng dồn.
+    """
+    with np.errstate(divide="ignore"):
+        return np.maximum(np.log1p(returns), LOG_GROWTH_FLOOR)
+
+
+def path_metrics(log_steps: np.ndarray, initial_capital: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Ma trận log-growth (đường x bước) -> (netProfit, maxDrawdown %) của từng đường.
+    Cộng dồn log thay cho nhân dồn (1 + r): không tràn số với hàng nghìn lệnh.
+    Ghi đè log_steps (dùng làm buffer) để mỗi lô chỉ cần thêm 1 ma trận.
+    """
+    level = np.cumsum(log_steps, axis=1, out=log_steps)
+    # Đỉnh bắt đầu từ vốn ban đầu (log = 0) như compute_drawdown
+    peak = np.maximum(level, 0.0)
+    np.maximum.accumulate(peak, axis=1, out=peak)
+    dd = np.subtract(peak, level, out=peak).max(axis=1)
+    max_drawdown = -np.expm1(-dd) * 100.0
+    net_profit = initial_capital * np.expm1(level[:, -1])
+    return net_profit, max_drawdown
+
+
+@dataclass
+class BlockStats:
+    """
+    Thống kê của mọi khối dài `length` (circular) theo vị trí bắt đầu, trên log-growth:
+      total   : log-growth cả khối
+      high    : max log-growth tích luỹ trong khối (tính cả điểm 0)
+      low     : min log-growth tích luỹ trong khối (tính cả điểm 0)
+      inner_dd: drawdown (log) lớn nhất chỉ xét đỉnh trong khối
+    Đủ để tính netProfit / maxDrawdown của chuỗi khối nối nhau mà không dựng lại đường theo ngày.
+    """
+    total: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    inner_dd: np.ndarray
+
+
+_BLOCK_FIELDS: Tuple[str, ...] = ("total", "high", "low", "inner_dd")
+
+
+def block_stats(log_growth: np.ndarray, length: int) -> BlockStats:
+    n = len(log_growth)
+    ext = np.concatenate((log_growth, log_growth[: length - 1]))
+    windows = sliding_window_view(ext, length)[:n]
+    stats = BlockStats(*(np.empty(n) for _ in range(4)))
+    # Chia lô theo vị trí bắt đầu: ma trận (khối x length) bị chặn như lô mô phỏng
+    step = max(1, MC_BATCH_ELEMENTS // length)
+    for lo in range(0, n, step):
+        cum = np.cumsum(windows[lo:lo + step], axis=1)
+        stats.total[lo:lo + step] = cum[:, -1]
+        running = np.maximum.accumulate(np.maximum(cum, 0.0), axis=1)
+        stats.high[lo:lo + step] = running[:, -1]
+        stats.low[lo:lo + step] = np.minimum(cum.min(axis=1), 0.0)
+        stats.inner_dd[lo:lo + step] = (running - cum).max(axis=1)
+    return stats
+
+
+def block_path_metrics(
+    total: np.ndarray,
+    high: np.ndarray,
+    low: np.ndarray,
+    inner_dd: np.ndarray,
+    initial_capital: float,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (netProfit, maxDrawdown %) của các đường ghép từ khối (đường x khối), tính trên log-growth:
+    đỉnh trước khối i = max(0, max_{j<i}(đầu khối j + high_j)),
+    drawdown trong khối i = max(đỉnh - đầu khối i - low_i, inner_dd_i).
+    """
+    end = np.cumsum(total, axis=1)
+    start = end - total
+    peak = np.maximum.accumulate(start + high, axis=1)
+    peak[:, 1:] = peak[:, :-1]
+    peak[:, 0] = 0.0
+    np.maximum(peak, 0.0, out=peak)
+    dd = np.maximum(peak - start - low, inner_dd).max(axis=1)
+    max_drawdown = -np.expm1(-dd) * 100.0
+    net_profit = initial_capital * np.expm1(end[:, -1])
+    return net_profit, max_drawdown
+
+
+def _sample_batch(
+    method: str,
+    samples: np.ndarray,
+    rows: int,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    n = len(samples)
+    if method == METHOD_TRADE_SHUFFLE:
+        return rng.permuted(np.tile(samples, (rows, 1)), axis=1)
+    return samples[rng.integers(0, n, size=(rows, n))]
+
+
+def simulate_trades(
+    method: str,
+    samples: np.ndarray,
+    initial_capital: float,
+    simulations: int,
+    rng: np.random.Generator,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """(netProfit, maxDrawdown %) của `simulations` đường theo lệnh, chia lô <= MC_BATCH_ELEMENTS phần tử."""
+    steps = log_growth(samples)
+    batch_rows = max(1, MC_BATCH_ELEMENTS // max(1, len(steps)))
+    profits: List[np.ndarray] = []
+    drawdowns: List[np.ndarray] = []
+    for lo in range(0, simulations, batch_rows):
+        rows = min(batch_rows, simulations - lo)
+        net, dd = path_metrics(_sample_batch(method, steps, rows, rng), initial_capital)
+        profits.append(net)
+        drawdowns.append(dd)
+    return np.concatenate(profits), np.concatenate(drawdowns)
+
+
+def simulate_block_bootstrap(
+    samples: np.ndarray,
+    initial_capital: float,
+    simulations: int,
+    block_size: int,
+    rng: np.random.Generator,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Circular block bootstrap: ceil(n / block) khối bắt đầu ngẫu nhiên, khối cuối cắt cho đủ n ngày.
+    Thống kê khối tính trước 1 lần theo vị trí bắt đầu -> mỗi đường chỉ xử lý n / block phần tử.
+    """
+    n = len(samples)
+    n_blocks = -(-n // block_size)
+    steps = log_growth(samples)
+    full = block_stats(steps, block_size)
+    tail_length = n - (n_blocks - 1) * block_size
+    tail = full if tail_length == block_size else block_stats(steps, tail_length)
+
+    batch_rows = max(1, MC_BATCH_ELEMENTS // n_blocks)
+    profits: List[np.ndarray] = []
+    drawdowns: List[np.ndarray] = []
+    for lo in range(0, simulations, batch_rows):
+        rows = min(batch_rows, simulations - lo)
+        starts = rng.integers(0, n, size=(rows, n_blocks))
+        picked: List[np.ndarray] = []
+        for name in _BLOCK_FIELDS:
+            values = getattr(full, name)[starts]
+            values[:, -1] = getattr(tail, name)[starts[:, -1]]
+            picked.append(values)
+        net, dd = block_path_metrics(*picked, initial_capital)
+        profits.append(net)
+        drawdowns.append(dd)
+    return np.concatenate(profits), np.concatenate(drawdowns)
+
+
+# ============================================================
+# 4) REPORT
+# ============================================================
+
+def distribution(values: np.ndarray, confidence: float) -> MonteCarloDistribution:
+    tail = (1.0 - confidence) / 2.0 * 100.0
+    q = np.percentile(values, [*PERCENTILES, tail, 100.0 - tail])
+    return MonteCarloDistribution(
+        mean=float(values.mean()),
+        std=float(values.std()),
+        min=float(values.min()),
+        max=float(values.max()),
+        percentiles={f"p{p}": float(v) for p, v in zip(PERCENTILES, q)},
+        ciLow=float(q[-2]),
+        ciHigh=float(q[-1]),
+    )
+
+
+def run_monte_carlo(
+    trade_rets: np.ndarray,
+    closes: np.ndarray,
+    initial_capital: float,
+    options: MonteCarloOptions,
+) -> Optional[MonteCarloReport]:
+    """
+    trade_rets: lợi nhuận tỉ lệ từng lệnh (trade_returns) theo thứ tự đóng lệnh;
+    closes: equity cuối mỗi ngày (daily_closes). Phương pháp không đủ dữ liệu bị bỏ qua.
+    """
+    if initial_capital <= 0:
+        return None
+    rng = np.random.default_rng(options.seed)
+    by_day = daily_returns(closes, initial_capital)
+
+    results: List[MonteCarloMethodResult] = []
+    for method in options.methods:
+        block_size: Optional[int] = None
+        if method == METHOD_DAILY_BLOCK_BOOTSTRAP:
+            if len(by_day) == 0:
+                continue
+            block_size = options.block_size or max(1, round(len(by_day) ** (1.0 / 3.0)))
+            block_size = min(block_size, len(by_day))
+            sample_size = len(by_day)
+            net, dd = simulate_block_bootstrap(by_day, initial_capital, options.simulations, block_size, rng)
+        else:
+            if len(trade_rets) == 0:
+                continue
+            sample_size = len(trade_rets)
+            net, dd = simulate_trades(method, trade_rets, initial_capital, options.simulations, rng)
+        results.append(MonteCarloMethodResult(
+            method=method,
+            simulations=options.simulations,
+            sampleSize=sample_size,
+            blockSize=block_size,
+            netProfit=distribution(net, options.confidence),
+            maxDrawdown=distribution(dd, options.confidence),
+            probabilityOfLoss=float(np.mean(net < 0)),
+        ))
+
+    return MonteCarloReport(confidence=options.confidence, seed=options.seed, methods=results)
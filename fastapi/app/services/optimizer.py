@@ -0,0 +1,511 @@
+# app/services/optimizer.py
+
+import copy
+import itertools
+import math
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.models.backtest_models import (
+    BacktestJobMessage,
+    SweepJobMessage,
+    SweepResultMessage,
+    SweepResultRow,
+    WalkForwardFold,
+    WalkForwardJobMessage,
+    WalkForwardResultMessage,
+)
+from app.services.backtest_engine import (
+    ENGINE_CORE_ARRAY,
+    SimulationOutput,
+    build_result_message,
+    build_strategy_signals,
+    compute_drawdown,
+    compute_summary_metrics,
+    get_user_rules,
+    load_data_as_dataframe,
+    merge_required_indicators,
+    required_indicators_for_job,
+    simulate,
+    simulation_params_from_job,
+)
+from app.services.job_control import JobControl
+from app.services.worker_pool import make_process_pool, resolve_max_workers, split_chunks
+
+# ============================================================
+# 1) CONFIG
+# ============================================================
+
+# Các key của param_grid được ghi đè thẳng vào job_config
+SWEEP_JOB_CONFIG_KEYS = (
+    "stop_loss",
+    "take_profit",
+    "sma_fast",
+    "sma_slow",
+    "rsi_period",
+    "rsi_threshold",
+)
+# Key bắt đầu bằng "rules." là đường dẫn vào strategy, vd "rules.0.condition.compare_to.value"
+RULE_PATH_PREFIX = "rules."
+
+# Giới hạn số tổ hợp để tránh 1 job sweep chiếm worker quá lâu
+MAX_SWEEP_COMBINATIONS = int(os.getenv("BACKTEST_SWEEP_MAX_COMBINATIONS", "20000"))
+
+# Dưới ngưỡng này chạy tuần tự trong process hiện tại (không đáng để spawn pool)
+MIN_COMBINATIONS_FOR_POOL = int(os.getenv("BACKTEST_SWEEP_MIN_POOL_SIZE", "16"))
+
+# Mỗi worker nhận vài chunk để cân tải khi các tổ hợp chạy nhanh/chậm khác nhau
+CHUNKS_PER_WORKER = 4
+
+RANKABLE_METRICS = ("netProfit", "maxDrawdown", "profitFactor", "winRate", "totalTrades")
+# Metric "càng nhỏ càng tốt"
+ASCENDING_METRICS = {"maxDrawdown"}
+
+
+# ============================================================
+# 2) PARAMETER GRID
+# ============================================================
+
+def expand_param_grid(param_grid: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """
+    Trải param_grid thành danh sách tổ hợp (tích Descartes), thứ tự key được giữ nguyên.
+    {"stop_loss": [0.03, 0.05], "sma_fast": [5, 10]} -> 4 tổ hợp.
+    """
+    if not param_grid:
+        return [{}]
+
+    for key in param_grid:
+        if key not in SWEEP_JOB_CONFIG_KEYS and not key.startswith(RULE_PATH_PREFIX):
+            raise ValueError(f"Unsupported sweep parameter: {key}")
+
+    keys = list(param_grid.keys())
+    values = [
+        list(param_grid[k]) if isinstance(param_grid[k], (list, tuple)) else [param_grid[k]]
+        for k in keys
+    ]
+
+    total = math.prod(len(v) for v in values)
+    if total > MAX_SWEEP_COMBINATIONS:
+        raise ValueError(
+            f"Parameter grid has {total} combinations, limit is {MAX_SWEEP_COMBINATIONS}"
+        )
+
+    return [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+
+
+def _set_by_path(obj: Any, path: List[str], value: Any) -> None:
+    """Gán value vào dict/list lồng nhau theo đường dẫn ["rules", "0", "condition", ...]."""
+    for part in path[:-1]:
+        obj = obj[int(part)] if isinstance(obj, list) else obj.setdefault(part, {})
+    last = path[-1]
+    if isinstance(obj, list):
+        obj[int(last)] = value
+    else:
+        obj[last] = value
+
+
+def apply_params(job: BacktestJobMessage, params: Dict[str, Any]) -> BacktestJobMessage:
+    """
+    Tạo job dẫn xuất với tham số của 1 tổ hợp:
+    - key job_config -> ghi đè job_config
+    - key "rules...." -> ghi đè vào bản sao của strategy
+    """
+    job_config = dict(job.job_config or {})
+    strategy = copy.deepcopy(job.strategy) if job.strategy else None
+
+    for key, value in params.items():
+        if key.startswith(RULE_PATH_PREFIX):
+            if not strategy:
+                raise ValueError(f"Sweep parameter {key} requires strategy.rules")
+            _set_by_path(strategy, key.split("."), value)
+        else:
+            job_config[key] = value
+
+    return job.model_copy(update={"job_config": job_config, "strategy": strategy})
+
+
+# ============================================================
+# 3) EVALUATION
+# ============================================================
+
+def evaluate_on_frame(job: BacktestJobMessage, df: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Chạy 1 job trên DataFrame đã có đủ chỉ báo, chỉ trả về metric tổng hợp
+    (không tạo EquityPoint, không in log theo job).
+    """
+    if df.empty:
+        return {
+            "netProfit": 0.0,
+            "winRate": 0.0,
+            "maxDrawdown": 0.0,
+            "profitFactor": 0.0,
+            "totalTrades": 0,
+        }
+    signals = build_strategy_signals(get_user_rules(job), df, job.job_config)
+    params = simulation_params_from_job(job)
+    output = simulate(df, signals, params, ENGINE_CORE_ARRAY)
+    return compute_summary_metrics(params, output)
+
+
+def _evaluate_combinations(
+    job: BacktestJobMessage,
+    df: pd.DataFrame,
+    combos: List[Dict[str, Any]],
+    control: Optional[JobControl] = None,
+    done: int = 0,
+    total: int = 0,
+) -> List[Dict[str, Any]]:
+    rows = []
+    for combo in combos:
+        if control is not None:
+            control.checkpoint(done + len(rows), total, stage="sweep")
+        metrics = evaluate_on_frame(apply_params(job, combo), df)
+        rows.append({"params": combo, **metrics})
+    return rows
+
+
+# --- Worker process state (được set 1 lần bởi initializer) ---
+_WORKER_JOB: Optional[BacktestJobMessage] = None
+_WORKER_FRAME: Optional[pd.DataFrame] = None
+_WORKER_CONTROL: Optional[JobControl] = None
+
+
+def _init_sweep_worker(
+    job_payload: Dict[str, Any],
+    df: pd.DataFrame,
+    control: Optional[JobControl] = None,
+) -> None:
+    global _WORKER_JOB, _WORKER_FRAME, _WORKER_CONTROL
+    _WORKER_JOB = BacktestJobMessage(**job_payload)
+    _WORKER_FRAME = df
+    _WORKER_CONTROL = control
+
+
+def _evaluate_task_in_worker(
+    task: Tuple[int, int, int, List[Dict[str, Any]]],
+) -> Tuple[int, List[Dict[str, Any]]]:
+    window_idx, start, stop, combos = task
+    window = _WORKER_FRAME.iloc[start:stop]
+    return window_idx, _evaluate_combinations(_WORKER_JOB, window, combos, _WORKER_CONTROL)
+
+
+def evaluate_windows(
+    job: BacktestJobMessage,
+    df: pd.DataFrame,
+    windows: List[Tuple[int, int]],
+    combos: List[Dict[str, Any]],
+    max_workers: Optional[int] = None,
+    control: Optional[JobControl] = None,
+) -> List[List[Dict[str, Any]]]:
+    """
+    Chạy toàn bộ tổ hợp trên từng cửa sổ [start, stop) của cùng 1 DataFrame.
+    Trả về danh sách kết quả theo thứ tự windows.
+
+    DataFrame được gửi sang mỗi worker đúng 1 lần (qua initializer); mỗi task chỉ chứa
+    chỉ số cửa sổ + 1 chunk tổ hợp, nên mọi (cửa sổ x chunk) dùng chung 1 pool.
+    control: kiểm tra cancel/timeout + progress sau mỗi tổ hợp (tuần tự) / mỗi task (pool);
+    worker của pool cũng kiểm tra cancel/timeout giữa các tổ hợp -> huỷ job thì task đang chạy
+    dừng luôn, không chạy nốt cả chunk.
+    """
+    workers = resolve_max_workers(max_workers)
+    total_evals = len(windows) * len(combos)
+    if workers <= 1 or total_evals < MIN_COMBINATIONS_FOR_POOL:
+        return [
+            _evaluate_combinations(
+                job, df.iloc[start:stop], combos, control, window_idx * len(combos), total_evals
+            )
+            for window_idx, (start, stop) in enumerate(windows)
+        ]
+
+    # Chỉ gửi các field của BacktestJobMessage (bỏ param_grid...) sang worker
+    base_payload = job.model_dump(include=set(BacktestJobMessage.model_fields))
+    chunks_per_window = max(1, (workers * CHUNKS_PER_WORKER) // max(1, len(windows)))
+    tasks = [
+        (window_idx, start, stop, chunk)
+        for window_idx, (start, stop) in enumerate(windows)
+        for chunk in split_chunks(combos, chunks_per_window)
+    ]
+
+    results: List[List[Dict[str, Any]]] = [[] for _ in windows]
+    done = 0
+    pool = make_process_pool(
+        workers,
+        initializer=_init_sweep_worker,
+        initargs=(base_payload, df, control.subtask() if control is not None else None),
+    )
+    try:
+        # pool.map giữ thứ tự task -> thứ tự tổ hợp trong mỗi cửa sổ được giữ nguyên
+        for window_idx, rows in pool.map(_evaluate_task_in_worker, tasks):
+            results[window_idx].extend(rows)
+            done += len(rows)
+            if control is not None:
+                control.checkpoint(done, total_evals, stage="sweep")
+    except BaseException:
+        # Huỷ / timeout / lỗi -> bỏ các task chưa chạy, không chờ pool chạy hết
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown(wait=True)
+    return results
+
+
+def evaluate_grid(
+    job: BacktestJobMessage,
+    df: pd.DataFrame,
+    combos: List[Dict[str, Any]],
+    max_workers: Optional[int] = None,
+    control: Optional[JobControl] = None,
+) -> List[Dict[str, Any]]:
+    """Chạy toàn bộ tổ hợp trên cả DataFrame."""
+    return evaluate_windows(job, df, [(0, len(df))], combos, max_workers, control)[0]
+
+
+def rank_results(
+    rows: List[Dict[str, Any]],
+    rank_by: str = "netProfit",
+    top_n: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Sắp xếp kết quả theo metric (maxDrawdown tăng dần, còn lại giảm dần)."""
+    if rank_by not in RANKABLE_METRICS:
+        raise ValueError(f"Unsupported rank_by: {rank_by}")
+
+    ascending = rank_by in ASCENDING_METRICS
+
+    def sort_key(row: Dict[str, Any]) -> float:
+        value = row.get(rank_by)
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            return math.inf
+        return value if ascending else -value
+
+    ranked = sorted(rows, key=sort_key)
+    if top_n is not None and top_n > 0:
+        ranked = ranked[:top_n]
+    return ranked
+
+
+# ============================================================
+# 4) SWEEP ENTRY POINT
+# ============================================================
+
+def load_frame_for_jobs(
+    base_job: BacktestJobMessage,
+    jobs: List[BacktestJobMessage],
+) -> pd.DataFrame:
+    """Load giá 1 lần và tính 1 lượt chỉ báo cho hợp (union) chu kỳ của tất cả job."""
+    required = merge_required_indicators(*(required_indicators_for_job(j) for j in jobs))
+    return load_data_as_dataframe(base_job, required=required)
+
+
+def run_parameter_sweep(
+    job: SweepJobMessage,
+    control: Optional[JobControl] = None,
+) -> SweepResultMessage:
+    """
+    Grid optimization:
+    1. Trải param_grid thành các tổ hợp.
+    2. Load giá 1 lần + tính chỉ báo cho union mọi chu kỳ cần dùng.
+    3. Chạy các tổ hợp trên process pool (mỗi worker nhận DataFrame 1 lần).
+    4. Trả về bảng metric đã xếp hạng thay vì N kết quả đầy đủ.
+    control: huỷ / quá timeout -> FAILED (error ghi lý do).
+    """
+    started = time.perf_counter()
+    try:
+        combos = expand_param_grid(job.param_grid)
+        derived_jobs = [apply_params(job, combo) for combo in combos]
+        df = load_frame_for_jobs(job, derived_jobs)
+
+        if control is not None:
+            control.check()
+        rows = evaluate_grid(job, df, combos, job.max_workers, control)
+        ranked = rank_results(rows, job.rank_by, job.top_n)
+    except Exception as e:
+        print(f"[FastAPI] ❌ Sweep job {job.job_id} failed: {e}")
+        return SweepResultMessage(
+            job_id=job.job_id,
+            status="FAILED",
+            rankBy=job.rank_by,
+            totalCombinations=0,
+            results=[],
+            error=str(e),
+        )
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"[FastAPI] 🏁 Sweep job {job.job_id} done: {len(combos)} combinations "
+        f"on {len(df)} bars in {elapsed:.2f}s"
+    )
+
+    return SweepResultMessage(
+        job_id=job.job_id,
+        status="COMPLETED",
+        rankBy=job.rank_by,
+        totalCombinations=len(combos),
+        results=[SweepResultRow(**row) for row in ranked],
+    )
+
+
+# ============================================================
+# 5) WALK-FORWARD OPTIMIZATION
+# ============================================================
+
+def build_walk_forward_windows(
+    n_bars: int,
+    in_sample_bars: int,
+    out_of_sample_bars: int,
+    step_bars: Optional[int] = None,
+    anchored: bool = False,
+) -> List[Tuple[Tuple[int, int], Tuple[int, int]]]:
+    """
+    Chia [0, n_bars) thành các fold ((is_start, is_stop), (oos_start, oos_stop)).
+    - Rolling: in-sample trượt theo step_bars.
+    - Anchored: in-sample luôn bắt đầu từ bar 0.
+    Fold cuối được giữ lại nếu phần out-of-sample còn thiếu (cắt tới n_bars).
+    """
+    if in_sample_bars <= 0 or out_of_sample_bars <= 0:
+        raise ValueError("in_sample_bars and out_of_sample_bars must be positive")
+
+    step = step_bars if step_bars and step_bars > 0 else out_of_sample_bars
+    folds = []
+    start = 0
+    while start + in_sample_bars < n_bars:
+        is_start = 0 if anchored else start
+        is_stop = start + in_sample_bars
+        oos_stop = min(is_stop + out_of_sample_bars, n_bars)
+        folds.append(((is_start, is_stop), (is_stop, oos_stop)))
+        start += step
+    return folds
+
+
+def _stitch_outputs(outputs: List[SimulationOutput], initial_capital: float) -> SimulationOutput:
+    """Nối equity OOS của các fold (vốn cộng dồn), drawdown tính lại trên toàn bộ đường nối."""
+    if not outputs:
+        empty = np.empty(0, dtype=float)
+        return SimulationOutput(
+            times=np.empty(0, dtype=np.int64),
+            equity=empty,
+            drawdown=empty,
+            trades=[],
+            final_cash=initial_capital,
+            win_trades=0,
+        )
+
+    equity = np.concatenate([o.equity for o in outputs])
+    return SimulationOutput(
+        times=np.concatenate([o.times for o in outputs]),
+        equity=equity,
+        drawdown=compute_drawdown(equity, initial_capital),
+        trades=[t for o in outputs for t in o.trades],
+        final_cash=outputs[-1].final_cash,
+        win_trades=sum(o.win_trades for o in outputs),
+    )
+
+
+def _failed_walk_forward(job: WalkForwardJobMessage, error: str) -> WalkForwardResultMessage:
+    return WalkForwardResultMessage(
+        job_id=job.job_id,
+        status="FAILED",
+        netProfit=0.0,
+        winRate=0.0,
+        maxDrawdown=0.0,
+        profitFactor=0.0,
+        totalTrades=0,
+        equityCurve=[],
+        underwater=[],
+        trades=[],
+        error=error,
+    )
+
+
+def run_walk_forward(
+    job: WalkForwardJobMessage,
+    control: Optional[JobControl] = None,
+) -> WalkForwardResultMessage:
+    """
+    Walk-forward optimization:
+    1. Load giá 1 lần, tính chỉ báo 1 lần cho union chu kỳ của mọi tổ hợp
+       (cột chỉ báo dùng lại cho mọi cửa sổ, không query lại DB).
+    2. Tối ưu param_grid trên từng cửa sổ in-sample - tất cả (fold x chunk) chạy song song
+       trên 1 process pool.
+    3. Chạy bộ tham số tốt nhất của mỗi fold trên cửa sổ out-of-sample kế tiếp,
+       vốn của fold sau = equity cuối của fold trước.
+    4. Nối các đường equity OOS thành 1 kết quả tương thích BacktestResultMessage.
+    control: huỷ / quá timeout -> FAILED (error ghi lý do).
+    """
+    started = time.perf_counter()
+    try:
+        combos = expand_param_grid(job.param_grid)
+        derived_jobs = [apply_params(job, combo) for combo in combos]
+        df = load_frame_for_jobs(job, derived_jobs)
+
+        folds = build_walk_forward_windows(
+            len(df),
+            job.in_sample_bars,
+            job.out_of_sample_bars,
+            job.step_bars,
+            job.anchored,
+        )
+        if not folds:
+            return _failed_walk_forward(
+                job,
+                f"Not enough data ({len(df)} bars) for in_sample_bars={job.in_sample_bars}",
+            )
+
+        if control is not None:
+            control.check()
+        in_sample_rows = evaluate_windows(
+            job, df, [is_window for is_window, _ in folds], combos, job.max_workers, control
+        )
+
+        ts = df["ts"].to_numpy()
+        initial_capital = simulation_params_from_job(job).initial_capital
+        capital = initial_capital
+        outputs: List[SimulationOutput] = []
+        fold_reports: List[WalkForwardFold] = []
+
+        for fold_idx, ((is_start, is_stop), (oos_start, oos_stop)) in enumerate(folds):
+            best = rank_results(in_sample_rows[fold_idx], job.rank_by, top_n=1)[0]
+
+            fold_job = apply_params(job, best["params"]).model_copy(
+                update={"initial_capital": capital}
+            )
+            window = df.iloc[oos_start:oos_stop]
+            params = simulation_params_from_job(fold_job)
+            signals = build_strategy_signals(get_user_rules(fold_job), window, fold_job.job_config)
+            output = simulate(window, signals, params, ENGINE_CORE_ARRAY, control=control)
+            outputs.append(output)
+
+            fold_reports.append(
+                WalkForwardFold(
+                    fold=fold_idx,
+                    inSampleFrom=int(ts[is_start]),
+                    inSampleTo=int(ts[is_stop - 1]),
+                    outOfSampleFrom=int(ts[oos_start]),
+                    outOfSampleTo=int(ts[oos_stop - 1]),
+                    bestParams=best["params"],
+                    inSampleScore=float(best[job.rank_by]),
+                    outOfSampleNetProfit=float(max(0.0, output.final_cash) - capital),
+                )
+            )
+            capital = max(0.0, output.final_cash)
+
+        stitched = _stitch_outputs(outputs, initial_capital)
+    except Exception as e:
+        print(f"[FastAPI] ❌ Walk-forward job {job.job_id} failed: {e}")
+        return _failed_walk_forward(job, str(e))
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"[FastAPI] 🏁 Walk-forward job {job.job_id}: {len(folds)} folds x "
+        f"{len(combos)} combinations on {len(df)} bars in {elapsed:.2f}s"
+    )
+
+    return build_result_message(
+        job,
+        simulation_params_from_job(job),
+        stitched,
+        result_cls=WalkForwardResultMessage,
+        folds=fold_reports,
+    )
@@ -0,0 +1,90 @@
+# app/services/pg_copy.py
+"""
+Đọc kết quả query Postgres bằng COPY ... TO STDOUT (FORMAT binary) thẳng vào mảng NumPy.
+
+Mọi cột phải có độ rộng cố định và NOT NULL (int4 / int8 / float8, dùng COALESCE trong SQL)
+-> mỗi dòng có cùng số byte, cả payload được đọc bằng 1 structured dtype (np.frombuffer),
+không tạo object Python theo từng ô như pd.read_sql (Decimal -> float, Timestamp...).
+"""
+
+import io
+from typing import Any, Dict, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+# (tên cột, kiểu numpy big-endian của cột trong COPY binary)
+CopyField = Tuple[str, str]
+
+INT4 = ">i4"
+INT8 = ">i8"
+FLOAT8 = ">f8"
+
+# Header COPY binary: signature 11 byte + flags (int32) + độ dài phần mở rộng (int32)
+_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+_HEADER_LEN = len(_SIGNATURE) + 8
+# Trailer: số cột = -1 (int16)
+_TRAILER = b"\xff\xff"
+
+
+def _row_dtype(fields: Sequence[CopyField]) -> np.dtype:
+    """Mỗi dòng: số cột (int16) rồi từng cột (độ dài int32 + dữ liệu)."""
+    spec = [("__n", ">i2")]
+    for name, kind in fields:
+        spec.append((f"__len_{name}", ">i4"))
+        spec.append((name, kind))
+    return np.dtype(spec)
+
+
+def parse_copy_binary(data: Any, fields: Sequence[CopyField]) -> Dict[str, np.ndarray]:
+    """
+    Payload COPY binary -> {cột: mảng native-endian}.
+    Raise ValueError nếu payload không đúng định dạng / có cột NULL hoặc độ rộng khác khai báo.
+    """
+    view = memoryview(data)
+    if len(view) < _HEADER_LEN + len(_TRAILER) or bytes(view[: len(_SIGNATURE)]) != _SIGNATURE:
+        raise ValueError("Not a PostgreSQL binary COPY payload")
+    ext_len = int.from_bytes(view[_HEADER_LEN - 4 : _HEADER_LEN], "big")
+    start = _HEADER_LEN + ext_len
+    end = len(view) - len(_TRAILER)
+    if bytes(view[end:]) != _TRAILER:
+        raise ValueError("Binary COPY payload has no trailer")
+
+    dtype = _row_dtype(fields)
+    n_bytes = end - start
+    if n_bytes % dtype.itemsize:
+        raise ValueError("Binary COPY rows are not fixed-width (NULL or unexpected column type?)")
+    rows = np.frombuffer(view, dtype=dtype, count=n_bytes // dtype.itemsize, offset=start)
+
+    if len(rows) and not (rows["__n"] == len(fields)).all():
+        raise ValueError(f"Binary COPY rows do not have {len(fields)} columns")
+    out: Dict[str, np.ndarray] = {}
+    for name, kind in fields:
+        width = np.dtype(kind).itemsize
+        if len(rows) and not (rows[f"__len_{name}"] == width).all():
+            raise ValueError(f"Column {name} is NULL or not {width} bytes wide")
+        out[name] = rows[name].astype(np.dtype(kind).newbyteorder("="))
+    return out
+
+
+def copy_query_arrays(
+    engine: Any,
+    query: str,
+    params: Optional[Mapping[str, Any]],
+    fields: Sequence[CopyField],
+) -> Dict[str, np.ndarray]:
+    """
+    Chạy query qua COPY binary trên 1 connection psycopg2 của pool SQLAlchemy.
+    Tham số được bind phía client (cursor.mogrify) vì COPY không nhận bind parameter.
+    """
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        try:
+            sql = cur.mogrify(query, params).decode()
+            buf = io.BytesIO()
+            cur.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT binary)", buf)
+        finally:
+            cur.close()
+    finally:
+        conn.close()
+    return parse_copy_binary(buf.getbuffer(), fields)
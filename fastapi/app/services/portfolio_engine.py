@@ -0,0 +1,478 @@
+# app/services/portfolio_engine.py
+
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from app.models.backtest_models import (
+    PortfolioJobMessage,
+    PortfolioResultMessage,
+    PortfolioSymbolSummary,
+    PortfolioTrade,
+)
+from app.services.backtest_engine import (
+    DEFAULT_INDICATOR_NODES,
+    SimulationOutput,
+    build_result_message,
+    compile_rule_signals,
+    compute_drawdown,
+    default_strategy_columns,
+    default_strategy_params,
+    fetch_price_frame_bulk,
+    fetch_warmup_start,
+    get_user_rules,
+    indicator_warmup_bars,
+    job_datetime_range,
+    price_cache,
+    required_indicators_for_job,
+    simulation_params_from_job,
+)
+from app.services.indicator_registry import Node, column_name, compute_indicator_columns, required_nodes
+from app.services.job_control import CHECKPOINT_BARS, JobControl
+
+# ============================================================
+# 1) PRICE PANEL (date x symbol)
+# ============================================================
+
+PRICE_FIELDS = ("open", "high", "low", "close")
+
+
+@dataclass
+class PricePanel:
+    """
+    Giá + chỉ báo của nhiều mã, căn theo cùng 1 trục thời gian.
+    Mỗi cột trong `columns` là mảng 2D (n_bars, n_symbols); NaN = mã không giao dịch ở bar đó.
+    valid: bar có trong backtest 1 mã của mã đó (giao dịch + đủ chỉ báo mặc định,
+           tức là hàng còn lại sau dropna của calculate_indicators).
+    """
+    symbols: List[str]
+    ts: np.ndarray                       # (n_bars,) int64 unix ts
+    columns: Dict[str, np.ndarray] = field(default_factory=dict)
+    valid: Optional[np.ndarray] = None   # (n_bars, n_symbols) bool
+
+    @property
+    def shape(self):
+        return (len(self.ts), len(self.symbols))
+
+    def get_column(self, name: str) -> Optional[np.ndarray]:
+        return self.columns.get(name)
+
+    def require_column(self, name: str) -> np.ndarray:
+        """Như get_column nhưng thiếu cột -> lỗi (rule đọc cột không được tính = bug, không phải "không có signal")."""
+        values = self.columns.get(name)
+        if values is None:
+            raise ValueError(f"Price panel has no column {name}")
+        return values
+
+
+# Cột chỉ báo mặc định của panel <- node tương ứng (cùng tên cột với calculate_indicators)
+_DEFAULT_PANEL_COLUMNS: Dict[str, Node] = dict(zip(("sma_fast", "sma_slow", "rsi"), DEFAULT_INDICATOR_NODES))
+
+
+def _all_present(columns: Dict[str, np.ndarray]) -> np.ndarray:
+    """Bar mà mọi cột đều có giá trị (không NaN)."""
+    return np.all([~np.isnan(values) for values in columns.values()], axis=0)
+
+
+def _has_interior_gaps(rows: np.ndarray) -> np.ndarray:
+    """(n_symbols,) mã nào có bar bị loại nằm giữa bar được giữ đầu tiên và cuối cùng."""
+    started = np.maximum.accumulate(rows, axis=0)
+    not_ended = np.maximum.accumulate(rows[::-1], axis=0)[::-1]
+    return (started & not_ended & ~rows).any(axis=0)
+
+
+def _columnwise(
+    inputs: Dict[str, np.ndarray],
+    rows: np.ndarray,
+    compute: Callable[[Dict[str, np.ndarray], int], Dict[str, np.ndarray]],
+    origin: int,
+) -> Dict[str, np.ndarray]:
+    """
+    compute(inputs, origin) trên chuỗi gồm các bar `rows` của từng mã, như khi backtest riêng mã đó.
+    Mã mà các bar được giữ liền nhau (chỉ thiếu ở đầu / cuối) -> tính 1 lượt trên cả panel 2D
+    (NaN đầu chuỗi được kernel bỏ qua như chuỗi đã cắt); mã có bar bị loại ở giữa (tạm ngừng
+    giao dịch...) -> tính riêng trên chuỗi đã nén. Kết quả NaN ở các bar không thuộc `rows`.
+    origin: dòng panel đầu tiên >= data_from (chuỗi nén: số bar được giữ đứng trước dòng đó).
+    """
+    masked = {name: np.where(rows, values, np.nan) for name, values in inputs.items()}
+    gappy = _has_interior_gaps(rows)
+    out: Dict[str, np.ndarray] = {}
+
+    def place(results: Dict[str, np.ndarray], index) -> None:
+        for name, values in results.items():
+            if name not in out:
+                out[name] = np.full(rows.shape, np.nan)
+            out[name][index] = values
+
+    contiguous = np.flatnonzero(~gappy)
+    if len(contiguous):
+        sub = {name: values[:, contiguous] for name, values in masked.items()}
+        place(compute(sub, origin), (slice(None), contiguous))
+    for j in np.flatnonzero(gappy):
+        kept = np.flatnonzero(rows[:, j])
+        sub = {name: values[kept, j] for name, values in masked.items()}
+        place(compute(sub, int(np.searchsorted(kept, origin))), (kept, j))
+
+    for values in out.values():
+        values[~rows] = np.nan
+    return out
+
+
+def _default_indicator_columns(prices: Dict[str, np.ndarray], origin: int) -> Dict[str, np.ndarray]:
+    default = compute_indicator_columns(DEFAULT_INDICATOR_NODES, prices.get, origin=origin)
+    return {name: default[column_name(node)] for name, node in _DEFAULT_PANEL_COLUMNS.items()}
+
+
+def _load_raw_prices(symbols: List[str], start, end) -> pd.DataFrame:
+    """Giá dạng long (stock_symbol, ts, trade_date, OHLCV): qua price cache nếu bật, không thì 1 query bulk."""
+    if price_cache is None:
+        return fetch_price_frame_bulk(symbols, start, end)
+
+    frames = price_cache.get_many(symbols, start, end)
+    parts = {symbol: frame for symbol, frame in frames.items() if not frame.empty}
+    if not parts:
+        return pd.DataFrame()
+    raw = pd.concat(parts.values(), keys=list(parts), names=["stock_symbol", None])
+    return raw.reset_index(level="stock_symbol").reset_index(drop=True)
+
+
+def _panel_warmup_start(symbols: List[str], start, bars: int):
+    """Ngày bắt đầu load để mỗi mã có đủ `bars` bar giao dịch trước start."""
+    if price_cache is None:
+        return fetch_warmup_start(symbols, start, bars)
+    return price_cache.warmup_start(symbols, start, bars)
+
+
+def load_price_panel(job: PortfolioJobMessage) -> PricePanel:
+    """
+    Load giá của mọi mã trong 1 query, pivot thành panel date x symbol,
+    tính chỉ báo (mặc định + theo strategy) cho từng mã rồi cắt phần warm-up.
+    """
+    symbols = list(dict.fromkeys(job.symbols))
+    dt_from_req, dt_to_req = job_datetime_range(job)
+    required = required_indicators_for_job(job)
+
+    # Cùng warm-up với engine 1 mã: cột mặc định + chỉ báo theo strategy cộng dồn
+    warmup_bars = indicator_warmup_bars(required)
+    dt_fetch_from = _panel_warmup_start(symbols, dt_from_req, warmup_bars)
+
+    print(f"[FastAPI] Loading price panel for {len(symbols)} symbols...")
+    raw = _load_raw_prices(symbols, dt_fetch_from, dt_to_req)
+    if raw.empty:
+        return PricePanel(symbols=symbols, ts=np.empty(0, dtype=np.int64))
+
+    raw["trade_date"] = pd.to_datetime(raw["trade_date"], cache=False)
+    fields = [name for name in PRICE_FIELDS + ("volume",) if name in raw.columns]
+    wide = raw.pivot(index="trade_date", columns="stock_symbol", values=fields)
+    wide = wide.sort_index()
+    ts_by_date = raw.drop_duplicates("trade_date").set_index("trade_date")["ts"]
+
+    prices = {name: wide[name].reindex(columns=symbols).to_numpy(dtype=float) for name in fields}
+
+    # Theo pipeline engine 1 mã, tính theo cột cho cả panel:
+    # 1. Chỉ báo mặc định (SMA10, SMA50, RSI14) trên các bar mã thực sự giao dịch (đủ giá).
+    # 2. Bỏ bar mà chỉ báo mặc định còn NaN (dropna) -> valid.
+    # 3. Mọi node theo strategy/job_config (SMA, RSI, EMA, MACD, BOLLINGER...) trên các bar valid.
+    # EMA seed tại bar cố định trước data_from như engine 1 mã (không theo union warm-up của panel)
+    keep = wide.index >= pd.to_datetime(dt_from_req)
+    origin = int(np.argmax(keep)) if keep.any() else len(keep)
+    traded = _all_present(prices)
+    defaults = _columnwise(prices, traded, _default_indicator_columns, origin)
+    valid = traded & _all_present(defaults)
+    nodes = required_nodes(required)
+    extras = _columnwise(
+        {**prices, **defaults},
+        valid,
+        lambda inputs, symbol_origin: compute_indicator_columns(nodes, inputs.get, origin=symbol_origin),
+        origin,
+    )
+    columns: Dict[str, np.ndarray] = {**prices, **defaults, **extras}
+
+    # Cắt bỏ phần warm-up
+    ts = ts_by_date.reindex(wide.index).to_numpy(dtype=np.int64)[keep]
+    columns = {name: values[keep] for name, values in columns.items()}
+    valid = valid[keep]
+
+    print(
+        f"[FastAPI] ✅ Loaded {len(raw)} price rows -> panel "
+        f"{len(ts)} bars x {len(symbols)} symbols"
+    )
+    return PricePanel(symbols=symbols, ts=ts, columns=columns, valid=valid)
+
+
+# ============================================================
+# 2) SIGNALS (2D)
+# ============================================================
+
+def _compile_panel_rules(user_rules: List[Dict[str, Any]], panel: PricePanel, valid: np.ndarray):
+    """
+    Compile strategy.rules trên các bar valid của từng mã: bar trước của 1 bar (cho cross_over /
+    cross_under) là bar valid trước đó của chính mã, như khi backtest riêng mã đó.
+    Cột ngoài valid bị che thành NaN -> mã chỉ thiếu bar ở đầu / cuối compile 1 lượt trên cả panel;
+    mã có bar bị loại ở giữa compile riêng trên chuỗi đã nén.
+    """
+    masked: Dict[str, np.ndarray] = {}
+
+    def get_column(name: str) -> np.ndarray:
+        if name not in masked:
+            masked[name] = np.where(valid, panel.require_column(name), np.nan)
+        return masked[name]
+
+    compiled = compile_rule_signals(user_rules, get_column, panel.shape)
+    entry, exit_ = compiled.buy_signal, compiled.sell_signal
+    for j in np.flatnonzero(_has_interior_gaps(valid)):
+        rows = np.flatnonzero(valid[:, j])
+        single = compile_rule_signals(user_rules, lambda name: get_column(name)[rows, j], (len(rows),))
+        entry[:, j] = False
+        exit_[:, j] = False
+        entry[rows, j] = single.buy_signal
+        exit_[rows, j] = single.sell_signal
+    return entry & valid, exit_ & valid
+
+
+def build_panel_signals(job: PortfolioJobMessage, panel: PricePanel):
+    """
+    Signal entry/exit/valid dạng 2D (n_bars, n_symbols), cùng ngữ nghĩa với
+    build_strategy_signals của engine 1 mã, tính theo cột cho toàn bộ panel.
+    Bar ngoài panel.valid (engine 1 mã không có bar đó) không bao giờ ra quyết định.
+    """
+    valid = panel.valid if panel.valid is not None else np.ones(panel.shape, dtype=bool)
+    user_rules = get_user_rules(job)
+    if user_rules:
+        entry, exit_ = _compile_panel_rules(user_rules, panel, valid)
+        return entry, exit_, valid
+
+    params = default_strategy_params(job.job_config)
+    columns = default_strategy_columns(params)
+    sma_fast = panel.get_column(columns["sma_fast"])
+    sma_slow = panel.get_column(columns["sma_slow"])
+    rsi = panel.get_column(columns["rsi"])
+
+    valid = valid & ~(np.isnan(sma_fast) | np.isnan(sma_slow) | np.isnan(rsi))
+    entry = (sma_slow > 0) & (sma_fast > sma_slow) & (rsi > params["rsi_threshold"])
+    exit_ = sma_fast < sma_slow
+    return entry, exit_, valid
+
+
+# ============================================================
+# 3) SHARED-CASH SIMULATION
+# ============================================================
+
+def simulate_portfolio(
+    job: PortfolioJobMessage,
+    panel: PricePanel,
+    entry: np.ndarray,
+    exit_: np.ndarray,
+    valid: np.ndarray,
+    control: Optional[JobControl] = None,
+) -> SimulationOutput:
+    """
+    State machine long-only trên nhiều mã với 1 quỹ tiền mặt chung.
+    Mỗi bar xử lý mọi mã cùng lúc bằng phép toán mảng:
+      1. Đóng vị thế chạm SL/TP hoặc có signal thoát.
+      2. Mở vị thế mới cho các mã có signal vào lệnh (theo thứ tự trong symbols),
+         mỗi vị thế tối đa position_size_pct * equity, không vượt quá số slot còn trống.
+    Vị thế được định giá theo giá đóng cửa gần nhất của mã (kể cả bar mã không giao dịch).
+    """
+    params = simulation_params_from_job(job)
+    commission_rate = params.commission_rate
+    stop_loss_pct = params.stop_loss_pct
+    take_profit_pct = params.take_profit_pct
+
+    close = panel.get_column("close")
+    n_bars, n_symbols = panel.shape
+    max_positions = job.max_positions or n_symbols
+    position_size_pct = job.position_size_pct or (1.0 / max_positions)
+
+    cash = params.initial_capital
+    qty = np.zeros(n_symbols, dtype=float)
+    entry_price = np.zeros(n_symbols, dtype=float)
+    entry_ts = np.zeros(n_symbols, dtype=np.int64)
+    last_price = np.full(n_symbols, np.nan)
+
+    equity = np.empty(n_bars + 1, dtype=float)
+    times = np.empty(n_bars + 1, dtype=np.int64)
+    trades: List[PortfolioTrade] = []
+    win_trades = 0
+
+    def close_positions(idx: np.ndarray, prices: np.ndarray, ts: int) -> float:
+        nonlocal win_trades
+        gross = qty[idx] * prices
+        fee = gross * commission_rate
+        net = gross - fee
+        pnl = net - qty[idx] * entry_price[idx]
+        for k, s in enumerate(idx.tolist()):
+            if pnl[k] > 0:
+                win_trades += 1
+            trades.append(
+                PortfolioTrade(
+                    symbol=panel.symbols[s],
+                    entryTime=int(entry_ts[s]),
+                    exitTime=int(ts),
+                    entryPrice=float(entry_price[s]),
+                    exitPrice=float(prices[k]),
+                    quantity=float(qty[s]),
+                    profit=float(pnl[k]),
+                    side="buy",  # close long
+                )
+            )
+        qty[idx] = 0.0
+        entry_price[idx] = 0.0
+        return float(net.sum())
+
+    ts_l = panel.ts.tolist()
+    next_checkpoint = CHECKPOINT_BARS if control is not None else -1
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for t in range(n_bars):
+            if t == next_checkpoint:
+                control.checkpoint(t, n_bars, float(equity[t - 1]))
+                next_checkpoint += CHECKPOINT_BARS
+
+            price = close[t]
+            tradable = ~np.isnan(price)
+            last_price = np.where(tradable, price, last_price)
+            active = tradable & valid[t]
+
+            # 1. Thoát lệnh: SL / TP / signal
+            held = qty > 0
+            closed_now = np.zeros(n_symbols, dtype=bool)
+            if held.any():
+                position_value = qty * price
+                entry_value = qty * entry_price
+                pnl_pct = (position_value - entry_value) / entry_value
+                to_close = held & active & (
+                    (pnl_pct <= -stop_loss_pct) | (pnl_pct >= take_profit_pct) | exit_[t]
+                )
+                if to_close.any():
+                    idx = np.flatnonzero(to_close)
+                    cash += close_positions(idx, price[idx], ts_l[t])
+                    closed_now = to_close
+
+            # 2. Vào lệnh: chia vốn theo slot trống (mã vừa đóng không mở lại trong cùng bar)
+            candidates = (qty == 0) & ~closed_now & active & entry[t]
+            if cash > 0 and candidates.any():
+                free_slots = max_positions - int(np.count_nonzero(qty > 0))
+                if free_slots > 0:
+                    idx = np.flatnonzero(candidates)[:free_slots]
+                    equity_now = cash + np.nansum(qty * last_price)
+                    budget = min(position_size_pct * equity_now, cash / len(idx))
+                    buy_price = price[idx]
+                    new_qty = budget / (buy_price * (1.0 + commission_rate))
+                    gross_cost = new_qty * buy_price
+                    fee = gross_cost * commission_rate
+                    cash -= float((gross_cost + fee).sum())
+                    # SAFETY: không cho cash âm do sai số float
+                    if cash < 0:
+                        cash = 0.0
+                    qty[idx] = new_qty
+                    entry_price[idx] = buy_price
+                    entry_ts[idx] = ts_l[t]
+
+            current_equity = cash + np.nansum(qty * last_price)
+            equity[t] = current_equity if current_equity > 0 else 0.0
+            times[t] = ts_l[t]
+
+    n_points = n_bars
+    # Đóng mọi vị thế còn lại ở giá gần nhất
+    held = qty > 0
+    if n_bars > 0 and held.any():
+        idx = np.flatnonzero(held)
+        cash += close_positions(idx, last_price[idx], ts_l[-1])
+        times[n_bars] = ts_l[-1]
+        equity[n_bars] = cash if cash > 0 else 0.0
+        n_points = n_bars + 1
+
+    equity = equity[:n_points]
+    return SimulationOutput(
+        times=times[:n_points],
+        equity=equity,
+        drawdown=compute_drawdown(equity, params.initial_capital),
+        trades=trades,
+        final_cash=cash,
+        win_trades=win_trades,
+    )
+
+
+def _per_symbol_summary(
+    symbols: List[str],
+    trades: List[PortfolioTrade],
+) -> List[PortfolioSymbolSummary]:
+    summary = []
+    for symbol in symbols:
+        profits = [t.profit for t in trades if t.symbol == symbol]
+        wins = sum(1 for p in profits if p > 0)
+        summary.append(
+            PortfolioSymbolSummary(
+                symbol=symbol,
+                totalTrades=len(profits),
+                netProfit=float(sum(profits)),
+                winRate=(wins / len(profits) * 100.0) if profits else 0.0,
+            )
+        )
+    return summary
+
+
+def _failed_portfolio(job: PortfolioJobMessage, error: str) -> PortfolioResultMessage:
+    return PortfolioResultMessage(
+        job_id=job.job_id,
+        status="FAILED",
+        netProfit=0.0,
+        winRate=0.0,
+        maxDrawdown=0.0,
+        profitFactor=0.0,
+        totalTrades=0,
+        equityCurve=[],
+        underwater=[],
+        trades=[],
+        symbols=list(job.symbols),
+        error=error,
+    )
+
+
+# ============================================================
+# 4) ENTRY POINT
+# ============================================================
+
+def run_portfolio_backtest(
+    job: PortfolioJobMessage,
+    control: Optional[JobControl] = None,
+) -> PortfolioResultMessage:
+    """
+    Backtest 1 strategy trên nhiều mã với vốn chung:
+    bulk load -> panel date x symbol -> signal 2D -> mô phỏng shared cash.
+    control: huỷ / quá timeout -> FAILED (error ghi lý do).
+    """
+    started = time.perf_counter()
+    if not job.symbols:
+        return _failed_portfolio(job, "symbols must not be empty")
+
+    try:
+        panel = load_price_panel(job)
+        if len(panel.ts) == 0:
+            print(f"[FastAPI] ⚠ No price data for portfolio job {job.job_id}")
+            return _failed_portfolio(job, "No price data for requested symbols")
+
+        entry, exit_, valid = build_panel_signals(job, panel)
+        if control is not None:
+            control.check()
+        output = simulate_portfolio(job, panel, entry, exit_, valid, control)
+    except Exception as e:
+        print(f"[FastAPI] ❌ Portfolio job {job.job_id} failed: {e}")
+        return _failed_portfolio(job, str(e))
+
+    print(
+        f"[FastAPI] 🏁 Portfolio job {job.job_id}: {len(panel.symbols)} symbols x "
+        f"{len(panel.ts)} bars in {time.perf_counter() - started:.2f}s"
+    )
+
+    return build_result_message(
+        job,
+        simulation_params_from_job(job),
+        output,
+        result_cls=PortfolioResultMessage,
+        symbols=panel.symbols,
+        perSymbol=_per_symbol_summary(panel.symbols, output.trades),
+    )
@@ -0,0 +1,326 @@
+# app/services/price_cache.py
+
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# Các cột giá được cache cho mỗi mã (theo đúng thứ tự trả về cho engine)
+PRICE_COLUMNS = ("ts", "trade_date", "open", "high", "low", "close", "volume")
+
+# fetch(symbol, start, end, start_exclusive) -> DataFrame có PRICE_COLUMNS, sắp xếp theo trade_date
+FetchFn = Callable[[str, datetime, datetime, bool], pd.DataFrame]
+# bulk_fetch(symbols, start, end) -> DataFrame dạng long có thêm cột stock_symbol
+BulkFetchFn = Callable[[List[str], datetime, datetime], pd.DataFrame]
+# warmup_start(symbols, start, bars) -> trade_date sớm nhất trong `bars` bar ngay trước start của mỗi mã
+WarmupStartFn = Callable[[List[str], datetime, int], datetime]
+
+
+@dataclass
+class _CachedSeries:
+    """Mảng OHLCV của 1 mã + khoảng thời gian đã query (covered_from..covered_to)."""
+    arrays: Dict[str, np.ndarray]
+    covered_from: datetime
+    covered_to: datetime
+    refreshed_at: float
+    # Đổi mỗi khi có dòng giá mới được thêm vào (dùng làm "data version" cho cache khác)
+    version: int = 0
+    # Giữ nguyên khi chỉ thêm dòng (refresh / backfill), đổi khi load lại từ đầu:
+    # trong cùng lineage, dòng đã có không bao giờ đổi giá trị (indicator cache dùng lại prefix)
+    lineage: int = 0
+    nbytes: int = field(default=0)
+
+    def __post_init__(self) -> None:
+        self.nbytes = sum(a.nbytes for a in self.arrays.values())
+
+    @property
+    def max_trade_date(self) -> Optional[np.datetime64]:
+        dates = self.arrays["trade_date"]
+        return dates[-1] if len(dates) else None
+
+
+def _frame_to_arrays(df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    arrays: Dict[str, np.ndarray] = {}
+    for col in PRICE_COLUMNS:
+        if col == "ts":
+            arrays[col] = df[col].to_numpy(dtype=np.int64)
+        elif col == "trade_date":
+            # cache=False: bỏ lượt dò giá trị trùng của pandas (chậm với cột đã là datetime)
+            arrays[col] = pd.to_datetime(df[col], cache=False).to_numpy(dtype="datetime64[ns]")
+        else:
+            # Nguồn dữ liệu không có volume -> coi như 0 (không làm rơi dòng khi dropna)
+            arrays[col] = df[col].to_numpy(dtype=float) if col in df else np.zeros(len(df))
+    return arrays
+
+
+def _concat_arrays(first: Dict[str, np.ndarray], second: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    return {col: np.concatenate([first[col], second[col]]) for col in PRICE_COLUMNS}
+
+
+class PriceSeriesCache:
+    """
+    LRU cache (giới hạn theo số byte) cho chuỗi giá OHLCV theo mã.
+
+    - Hit: cắt (slice) mảng đã cache theo [start, end], không truy cập DB.
+    - Refresh tăng dần: chỉ query các dòng có trade_date > trade_date lớn nhất đã cache.
+    - Backfill: request bắt đầu sớm hơn phần đã cache -> chỉ query phần còn thiếu phía trước.
+    - Dòng mới của ngày gần nhất được kiểm tra lại sau mỗi refresh_seconds.
+    - Warm-up theo số bar (get_warmup): ngày bắt đầu suy ra từ mảng đã cache nếu đủ bar,
+      chỉ hỏi DB (warmup_start_fn, 1 query nhỏ) khi phần đã cache không đủ.
+    """
+
+    def __init__(
+        self,
+        fetch_fn: FetchFn,
+        bulk_fetch_fn: Optional[BulkFetchFn] = None,
+        max_bytes: int = 256 * 1024 * 1024,
+        refresh_seconds: float = 60.0,
+        warmup_start_fn: Optional[WarmupStartFn] = None,
+    ) -> None:
+        self._fetch_fn = fetch_fn
+        self._bulk_fetch_fn = bulk_fetch_fn
+        self._warmup_start_fn = warmup_start_fn
+        self.max_bytes = max_bytes
+        self.refresh_seconds = refresh_seconds
+
+        self._entries: "OrderedDict[str, _CachedSeries]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._bytes = 0
+        # Version duy nhất trong process (kể cả khi 1 mã bị evict rồi load lại)
+        self._versions = itertools.count(1)
+
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.backfills = 0
+        self.evictions = 0
+
+    # ---------- Public API ----------
+
+    def get(self, symbol: str, start: datetime, end: datetime) -> pd.DataFrame:
+        """Trả về DataFrame giá của symbol trong [start, end] (sắp xếp theo trade_date)."""
+        with self._lock:
+            entry = self._entries.get(symbol)
+            if entry is not None:
+                self._entries.move_to_end(symbol)
+
+        if entry is None:
+            df = self._fetch_fn(symbol, start, end, False)
+            with self._lock:
+                self.misses += 1
+                entry = self._store(symbol, _frame_to_arrays(df), start, end)
+            return self._slice(entry, start, end)
+
+        if start < entry.covered_from:
+            before = self._fetch_fn(symbol, start, entry.covered_from, False)
+            with self._lock:
+                self.backfills += 1
+                arrays = _frame_to_arrays(before)
+                keep = arrays["trade_date"] < np.datetime64(entry.covered_from)
+                arrays = {col: a[keep] for col, a in arrays.items()}
+                entry = self._store(
+                    symbol,
+                    _concat_arrays(arrays, entry.arrays),
+                    start,
+                    entry.covered_to,
+                    version=entry.version,
+                    lineage=entry.lineage,
+                    refreshed_at=entry.refreshed_at,
+                )
+
+        if self._needs_refresh(entry, end):
+            entry = self._refresh(symbol, entry, end)
+        else:
+            with self._lock:
+                self.hits += 1
+
+        return self._slice(entry, start, end)
+
+    def get_many(self, symbols: List[str], start: datetime, end: datetime) -> Dict[str, pd.DataFrame]:
+        """
+        Như get() cho nhiều mã; các mã chưa có trong cache được load chung 1 query (bulk_fetch_fn).
+        """
+        symbols = list(dict.fromkeys(symbols))
+        frames: Dict[str, pd.DataFrame] = {}
+
+        if self._bulk_fetch_fn is not None:
+            with self._lock:
+                missing = [s for s in symbols if s not in self._entries]
+            if missing:
+                raw = self._bulk_fetch_fn(missing, start, end)
+                groups = dict(tuple(raw.groupby("stock_symbol", sort=False))) if not raw.empty else {}
+                with self._lock:
+                    for symbol in missing:
+                        self.misses += 1
+                        part = groups.get(symbol, raw.iloc[0:0])
+                        entry = self._store(symbol, _frame_to_arrays(part), start, end)
+                        frames[symbol] = self._slice(entry, start, end)
+
+        for symbol in symbols:
+            if symbol not in frames:
+                frames[symbol] = self.get(symbol, start, end)
+        return {symbol: frames[symbol] for symbol in symbols}
+
+    def warmup_start(self, symbols: List[str], start: datetime, bars: int) -> datetime:
+        """
+        Ngày bắt đầu load để mỗi mã có `bars` bar trước start (hoặc toàn bộ lịch sử nếu ít hơn).
+        Mã đã cache đủ bar trước start -> tính từ mảng, các mã còn lại hỏi warmup_start_fn 1 lần.
+        """
+        if bars <= 0:
+            return start
+        earliest = start
+        missing: List[str] = []
+        with self._lock:
+            for symbol in dict.fromkeys(symbols):
+                entry = self._entries.get(symbol)
+                if entry is None or entry.covered_from > start:
+                    missing.append(symbol)
+                    continue
+                dates = entry.arrays["trade_date"]
+                lo = int(np.searchsorted(dates, np.datetime64(start), side="left"))
+                if lo < bars:
+                    # Có thể là đầu lịch sử của mã, cũng có thể cache chưa phủ đủ -> hỏi DB
+                    missing.append(symbol)
+                    continue
+                earliest = min(earliest, pd.Timestamp(dates[lo - bars]).to_pydatetime())
+        if missing:
+            if self._warmup_start_fn is None:
+                raise RuntimeError("PriceSeriesCache has no warmup_start_fn")
+            earliest = min(earliest, self._warmup_start_fn(missing, start, bars))
+        return earliest
+
+    def get_warmup(self, symbol: str, start: datetime, end: datetime, bars: int) -> pd.DataFrame:
+        """Như get() nhưng kèm `bars` bar giao dịch ngay trước start (warm-up chỉ báo)."""
+        return self.get(symbol, self.warmup_start([symbol], start, bars), end)
+
+    def data_version(self, symbol: str) -> Optional[int]:
+        """Phiên bản dữ liệu của symbol (đổi khi có dòng giá mới), None nếu chưa cache."""
+        with self._lock:
+            entry = self._entries.get(symbol)
+            return entry.version if entry is not None else None
+
+    def lineage(self, symbol: str) -> Optional[int]:
+        """
+        Lineage của chuỗi giá symbol: không đổi khi chỉ có dòng mới được nối thêm,
+        None nếu chưa cache.
+        """
+        with self._lock:
+            entry = self._entries.get(symbol)
+            return entry.lineage if entry is not None else None
+
+    def invalidate(self, symbol: Optional[str] = None) -> None:
+        """Xoá cache của 1 mã (hoặc toàn bộ nếu symbol=None)."""
+        with self._lock:
+            if symbol is None:
+                self._entries.clear()
+                self._bytes = 0
+                return
+            entry = self._entries.pop(symbol, None)
+            if entry is not None:
+                self._bytes -= entry.nbytes
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses + self.refreshes
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "backfills": self.backfills,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+            }
+
+    # ---------- Internal ----------
+
+    def _needs_refresh(self, entry: _CachedSeries, end: datetime) -> bool:
+        if end > entry.covered_to:
+            return True
+        # Request phủ tới sau dòng cuối cùng đang có -> có thể đã có dòng mới trong DB
+        last = entry.max_trade_date
+        if last is None or np.datetime64(end) > last:
+            return time.monotonic() - entry.refreshed_at >= self.refresh_seconds
+        return False
+
+    def _refresh(self, symbol: str, entry: _CachedSeries, end: datetime) -> _CachedSeries:
+        last = entry.max_trade_date
+        if last is None:
+            after = entry.covered_from
+            new_rows = self._fetch_fn(symbol, after, max(end, entry.covered_to), False)
+        else:
+            after = pd.Timestamp(last).to_pydatetime()
+            new_rows = self._fetch_fn(symbol, after, max(end, entry.covered_to), True)
+
+        with self._lock:
+            self.refreshes += 1
+            arrays = _frame_to_arrays(new_rows)
+            if last is not None:
+                # Chống trùng khi 2 refresh chạy song song
+                current = self._entries.get(symbol, entry)
+                current_last = current.max_trade_date
+                keep = arrays["trade_date"] > current_last if current_last is not None else slice(None)
+                arrays = {col: a[keep] for col, a in arrays.items()}
+                entry = current
+
+            has_new_rows = len(arrays["ts"]) > 0
+            return self._store(
+                symbol,
+                _concat_arrays(entry.arrays, arrays) if has_new_rows else entry.arrays,
+                entry.covered_from,
+                max(end, entry.covered_to),
+                version=next(self._versions) if has_new_rows else entry.version,
+                lineage=entry.lineage,
+            )
+
+    def _store(
+        self,
+        symbol: str,
+        arrays: Dict[str, np.ndarray],
+        covered_from: datetime,
+        covered_to: datetime,
+        version: Optional[int] = None,
+        lineage: Optional[int] = None,
+        refreshed_at: Optional[float] = None,
+    ) -> _CachedSeries:
+        version = next(self._versions) if version is None else version
+        entry = _CachedSeries(
+            arrays=arrays,
+            covered_from=covered_from,
+            covered_to=covered_to,
+            refreshed_at=time.monotonic() if refreshed_at is None else refreshed_at,
+            version=version,
+            lineage=version if lineage is None else lineage,
+        )
+        old = self._entries.pop(symbol, None)
+        if old is not None:
+            self._bytes -= old.nbytes
+        self._entries[symbol] = entry
+        self._bytes += entry.nbytes
+        self._evict()
+        return entry
+
+    def _evict(self) -> None:
+        # Luôn giữ lại entry mới nhất, kể cả khi 1 mã lớn hơn max_bytes
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, old = self._entries.popitem(last=False)
+            self._bytes -= old.nbytes
+            self.evictions += 1
+
+    @staticmethod
+    def _slice(entry: _CachedSeries, start: datetime, end: datetime) -> pd.DataFrame:
+        dates = entry.arrays["trade_date"]
+        lo = np.searchsorted(dates, np.datetime64(start), side="left")
+        hi = np.searchsorted(dates, np.datetime64(end), side="right")
+        return pd.DataFrame(
+            {col: entry.arrays[col][lo:hi] for col in PRICE_COLUMNS},
+            copy=True,
+        )
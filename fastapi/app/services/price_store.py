@@ -0,0 +1,324 @@
+# app/services/price_store.py
+"""
+Kho giá cục bộ dạng cột: mỗi mã 1 file Arrow IPC (<PRICE_STORE_DIR>/<SYMBOL>.arrow),
+đọc bằng memory-map -> chỉ các trang được slice mới được đọc từ đĩa, không parse/decode.
+Đồng bộ tăng dần từ bảng "StockPrice":
+
+    cd fastapi && python -m app.services.price_store sync [--symbols FPT,VNM] [--full]
+    cd fastapi && python -m app.services.price_store info
+
+Engine dùng kho này khi BACKTEST_PRICE_SOURCE=local (chạy offline, không cần Postgres).
+"""
+
+import argparse
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+except ImportError:  # pragma: no cover - pyarrow là optional
+    pa = None
+    pa_ipc = None
+
+from app.services.price_cache import PRICE_COLUMNS
+
+PRICE_STORE_DIR = os.getenv("BACKTEST_PRICE_STORE_DIR", "data/prices")
+FILE_SUFFIX = ".arrow"
+
+# Khoảng thời gian "toàn bộ lịch sử" khi tải lại cả mã
+_HISTORY_START = datetime(1900, 1, 1)
+_HISTORY_END = datetime(9999, 12, 31)
+
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise RuntimeError("Local price store requires pyarrow (pip install pyarrow)")
+
+
+def _empty_frame() -> pd.DataFrame:
+    return pd.DataFrame({
+        "ts": np.array([], dtype=np.int64),
+        "trade_date": np.array([], dtype="datetime64[ns]"),
+        **{col: np.array([], dtype=float) for col in PRICE_COLUMNS[2:]},
+    })
+
+
+def _normalize(df: pd.DataFrame) -> pd.DataFrame:
+    """Ép về đúng PRICE_COLUMNS / dtype, sort theo trade_date, bỏ dòng trùng ngày (giữ dòng mới)."""
+    out = pd.DataFrame({
+        "ts": df["ts"].to_numpy(dtype=np.int64),
+        "trade_date": pd.to_datetime(df["trade_date"]).to_numpy(dtype="datetime64[ns]"),
+        **{
+            col: df[col].to_numpy(dtype=float) if col in df else np.zeros(len(df))
+            for col in PRICE_COLUMNS[2:]
+        },
+    })
+    out = out.drop_duplicates("trade_date", keep="last").sort_values("trade_date", kind="stable")
+    return out.reset_index(drop=True)
+
+
+class LocalPriceStore:
+    """
+    Kho giá theo mã trên đĩa. Bảng Arrow của mỗi file được giữ lại (memory-map, không tốn RAM
+    ngoài page cache của OS) và tự mở lại khi file bị sync ghi đè (so mtime/size).
+    Giao diện fetch / fetch_bulk / data_version / warm-up giống PriceSource của engine.
+    """
+
+    def __init__(self, root: str = PRICE_STORE_DIR) -> None:
+        self.root = root
+        self._tables: Dict[str, Tuple[Tuple[int, int], Any]] = {}
+        self._lock = threading.Lock()
+
+    # ---------- file ----------
+
+    def path(self, symbol: str) -> str:
+        return os.path.join(self.root, symbol.replace(os.sep, "_") + FILE_SUFFIX)
+
+    def symbols(self) -> List[str]:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            name[: -len(FILE_SUFFIX)] for name in os.listdir(self.root) if name.endswith(FILE_SUFFIX)
+        )
+
+    def _table(self, symbol: str) -> Optional[Any]:
+        _require_pyarrow()
+        path = self.path(symbol)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._tables.get(symbol)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+        # File được thay bằng os.replace -> mmap cũ vẫn trỏ tới inode cũ, đọc song song an toàn
+        table = pa_ipc.open_file(pa.memory_map(path, "r")).read_all()
+        with self._lock:
+            self._tables[symbol] = (key, table)
+        return table
+
+    def write(self, symbol: str, df: pd.DataFrame) -> int:
+        """Ghi toàn bộ chuỗi giá của mã (atomic: file tạm + os.replace). Trả về số dòng."""
+        _require_pyarrow()
+        os.makedirs(self.root, exist_ok=True)
+        table = pa.Table.from_pandas(_normalize(df), preserve_index=False)
+        path = self.path(symbol)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with pa.OSFile(tmp_path, "wb") as sink:
+            # 1 record batch / file -> cột liền mạch, slice không phải nối chunk
+            with pa_ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table, max_chunksize=max(1, table.num_rows))
+        os.replace(tmp_path, path)
+        return table.num_rows
+
+    # ---------- đọc ----------
+
+    def read(self, symbol: str) -> pd.DataFrame:
+        """Toàn bộ lịch sử của mã (rỗng nếu chưa có file)."""
+        table = self._table(symbol)
+        return _empty_frame() if table is None else table.to_pandas()
+
+    def fetch(
+        self,
+        symbol: str,
+        start: datetime,
+        end: datetime,
+        start_exclusive: bool = False,
+    ) -> pd.DataFrame:
+        table = self._table(symbol)
+        if table is None or table.num_rows == 0:
+            return _empty_frame()
+        # Chỉ phần slice được materialize
+        dates = self._dates(table)
+        lo = np.searchsorted(dates, np.datetime64(start, "ns"), side="right" if start_exclusive else "left")
+        hi = np.searchsorted(dates, np.datetime64(end, "ns"), side="right")
+        return table.slice(lo, max(0, hi - lo)).to_pandas()
+
+    def _dates(self, table: Any) -> np.ndarray:
+        # Cột trade_date đọc thẳng từ vùng nhớ đã map (zero-copy)
+        return table.column("trade_date").chunk(0).to_numpy(zero_copy_only=True)
+
+    def fetch_warmup(self, symbol: str, start: datetime, end: datetime, bars: int) -> pd.DataFrame:
+        """`bars` dòng ngay trước start + các dòng trong [start, end] (warm-up theo số bar)."""
+        table = self._table(symbol)
+        if table is None or table.num_rows == 0:
+            return _empty_frame()
+        dates = self._dates(table)
+        lo = np.searchsorted(dates, np.datetime64(start, "ns"), side="left")
+        hi = np.searchsorted(dates, np.datetime64(end, "ns"), side="right")
+        lo = max(0, lo - max(0, bars))
+        return table.slice(lo, max(0, hi - lo)).to_pandas()
+
+    def stream_warmup(
+        self,
+        symbol: str,
+        start: datetime,
+        end: datetime,
+        bars: int,
+        chunk_rows: int,
+    ) -> Iterator[pd.DataFrame]:
+        """Như fetch_warmup nhưng materialize từng slice <= chunk_rows dòng (streaming backtest)."""
+        table = self._table(symbol)
+        if table is None or table.num_rows == 0:
+            return
+        dates = self._dates(table)
+        lo = np.searchsorted(dates, np.datetime64(start, "ns"), side="left")
+        hi = np.searchsorted(dates, np.datetime64(end, "ns"), side="right")
+        for offset in range(max(0, lo - max(0, bars)), hi, max(1, chunk_rows)):
+            yield table.slice(offset, min(chunk_rows, hi - offset)).to_pandas()
+
+    def warmup_start(self, symbols: List[str], start: datetime, bars: int) -> datetime:
+        """trade_date sớm nhất trong `bars` dòng trước start của các mã (start nếu không có)."""
+        earliest = start
+        for symbol in symbols:
+            table = self._table(symbol)
+            if bars <= 0 or table is None or table.num_rows == 0:
+                continue
+            lo = np.searchsorted(self._dates(table), np.datetime64(start, "ns"), side="left")
+            if lo > 0:
+                first = table.column("trade_date")[max(0, lo - bars)].as_py()
+                earliest = min(earliest, pd.Timestamp(first).to_pydatetime())
+        return earliest
+
+    def fetch_bulk(self, symbols: List[str], start: datetime, end: datetime) -> pd.DataFrame:
+        parts = []
+        for symbol in symbols:
+            part = self.fetch(symbol, start, end)
+            if len(part):
+                part.insert(0, "stock_symbol", symbol)
+                parts.append(part)
+        if not parts:
+            return _empty_frame().assign(stock_symbol=pd.Series(dtype=object))[
+                ["stock_symbol", *PRICE_COLUMNS]
+            ]
+        out = pd.concat(parts, ignore_index=True)
+        return out.sort_values(["trade_date", "stock_symbol"], kind="stable").reset_index(drop=True)
+
+    def data_version(self, symbol: str) -> str:
+        """Cùng định dạng với version trên Postgres (số dòng:trade_date lớn nhất)."""
+        table = self._table(symbol)
+        if table is None or table.num_rows == 0:
+            return "0:None"
+        last = table.column("trade_date")[table.num_rows - 1].as_py()
+        return f"{table.num_rows}:{pd.Timestamp(last)}"
+
+    def info(self) -> List[Dict[str, Any]]:
+        rows = []
+        for symbol in self.symbols():
+            table = self._table(symbol)
+            rows.append({
+                "symbol": symbol,
+                "rows": table.num_rows,
+                "version": self.data_version(symbol),
+                "bytes": os.path.getsize(self.path(symbol)),
+            })
+        return rows
+
+
+# ============================================================
+# SYNC TỪ POSTGRES
+# ============================================================
+
+def _pg_list_symbols() -> List[str]:
+    from app.services.backtest_engine import db_engine
+
+    if not db_engine:
+        raise RuntimeError("DB Engine not initialized. Check DATABASE_URL in .env")
+    df = pd.read_sql('SELECT DISTINCT "symbol" FROM "Stock" ORDER BY "symbol"', db_engine)
+    return df["symbol"].tolist()
+
+
+def sync_symbol(
+    store: LocalPriceStore,
+    symbol: str,
+    full: bool = False,
+    fetch: Optional[Callable[..., pd.DataFrame]] = None,
+    data_version: Optional[Callable[[str], str]] = None,
+) -> Dict[str, Any]:
+    """
+    Đồng bộ 1 mã:
+      - version trên DB == version file -> không làm gì (1 query rẻ)
+      - ngược lại chỉ tải các dòng sau trade_date lớn nhất của file rồi nối vào
+      - số dòng sau khi nối != COUNT trên DB (điền bù ngày cũ / xoá dòng) -> tải lại cả mã
+    """
+    if fetch is None or data_version is None:
+        from app.services.backtest_engine import _pg_fetch_price_frame, _pg_fetch_symbol_data_version
+
+        fetch = fetch or _pg_fetch_price_frame
+        data_version = data_version or _pg_fetch_symbol_data_version
+
+    remote_version = data_version(symbol)
+    remote_rows = int(remote_version.split(":", 1)[0])
+    local = None if full else store.read(symbol)
+
+    if local is not None and len(local):
+        if store.data_version(symbol) == remote_version:
+            return {"symbol": symbol, "mode": "up-to-date", "new_rows": 0, "rows": len(local)}
+        last = pd.Timestamp(local["trade_date"].iat[-1]).to_pydatetime()
+        new_rows = fetch(symbol, last, _HISTORY_END, start_exclusive=True)
+        if len(local) + len(new_rows) == remote_rows:
+            rows = store.write(symbol, pd.concat([local, _normalize(new_rows)], ignore_index=True))
+            return {"symbol": symbol, "mode": "append", "new_rows": len(new_rows), "rows": rows}
+
+    df = fetch(symbol, _HISTORY_START, _HISTORY_END)
+    rows = store.write(symbol, df)
+    return {"symbol": symbol, "mode": "full", "new_rows": rows, "rows": rows}
+
+
+def sync_from_postgres(
+    store: LocalPriceStore,
+    symbols: Optional[List[str]] = None,
+    full: bool = False,
+) -> List[Dict[str, Any]]:
+    """Đồng bộ các mã (mặc định: mọi mã trong bảng "Stock"); lỗi của 1 mã không dừng cả lượt."""
+    if symbols is None:
+        symbols = _pg_list_symbols()
+    report = []
+    for symbol in symbols:
+        try:
+            item = sync_symbol(store, symbol, full=full)
+        except Exception as e:
+            item = {"symbol": symbol, "mode": "error", "error": str(e)}
+            print(f"[FastAPI] ❌ Price store sync failed for {symbol}: {e}")
+        else:
+            print(
+                f"[FastAPI] 💾 {symbol}: {item['mode']} (+{item['new_rows']} rows, total {item['rows']})"
+            )
+        report.append(item)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["sync", "info"])
+    parser.add_argument("--dir", default=PRICE_STORE_DIR, help="thư mục kho giá")
+    parser.add_argument("--symbols", default=None, help="danh sách mã, phân cách bằng dấu phẩy")
+    parser.add_argument("--full", action="store_true", help="tải lại toàn bộ lịch sử")
+    args = parser.parse_args()
+
+    store = LocalPriceStore(args.dir)
+    if args.command == "info":
+        for row in store.info():
+            print(f"{row['symbol']:>10} {row['rows']:>9,} rows {row['bytes']:>12,} B  {row['version']}")
+        return
+
+    # Giống app.main: đọc .env trước khi backtest_engine tạo kết nối DB
+    load_dotenv(dotenv_path=Path(__file__).resolve().parents[2] / ".env")
+    symbols = [s.strip() for s in args.symbols.split(",") if s.strip()] if args.symbols else None
+    report = sync_from_postgres(store, symbols, full=args.full)
+    errors = sum(1 for item in report if item["mode"] == "error")
+    print(f"[FastAPI] Price store sync done: {len(report)} symbol(s), {errors} error(s) -> {args.dir}")
+
+
+if __name__ == "__main__":
+    main()
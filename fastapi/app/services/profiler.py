@@ -0,0 +1,97 @@
+# app/services/profiler.py
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from app.services.metrics import count_metric
+
+# Bật bằng BACKTEST_PROFILE_SLOW_MS > 0: job chạy lâu hơn ngưỡng này (ms) được ghi profile
+PROFILE_SLOW_MS = float(os.getenv("BACKTEST_PROFILE_SLOW_MS", "0") or 0)
+PROFILE_INTERVAL_MS = float(os.getenv("BACKTEST_PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("BACKTEST_PROFILE_DIR", "profiles")
+
+# Giới hạn độ sâu stack mỗi mẫu (đệ quy sâu / stack của thư viện)
+_MAX_DEPTH = 64
+
+
+class SamplingProfiler:
+    """
+    Sampling profiler 1 thread: thread nền đọc stack của thread mục tiêu (sys._current_frames)
+    mỗi interval, gộp thành "collapsed stacks" (định dạng của flamegraph.pl / speedscope).
+    Chi phí cố định theo interval, không phụ thuộc số lời gọi hàm như cProfile.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL_MS / 1000.0) -> None:
+        self.interval = max(0.001, interval)
+        self.samples: Counter = Counter()
+        self._target: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, thread_id: Optional[int] = None) -> None:
+        self._target = thread_id if thread_id is not None else threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="backtest-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < _MAX_DEPTH:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+@contextmanager
+def profile_if_slow(label: str, threshold_ms: float = PROFILE_SLOW_MS) -> Iterator[None]:
+    """
+    Chạy profiler quanh 1 job (threshold_ms <= 0 -> tắt, không tốn gì).
+    Job chạy lâu hơn ngưỡng -> ghi PROFILE_DIR/<label>_<thời gian>.folded.
+    """
+    if threshold_ms <= 0:
+        yield
+        return
+
+    profiler = SamplingProfiler()
+    profiler.start()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        if elapsed_ms >= threshold_ms and profiler.samples:
+            _write_profile(label, elapsed_ms, profiler)
+
+
+def _write_profile(label: str, elapsed_ms: float, profiler: SamplingProfiler) -> None:
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{label}_{time.strftime('%Y%m%d-%H%M%S')}_{os.getpid()}.folded")
+        with open(path, "w") as f:
+            f.write(profiler.collapsed())
+    except OSError as e:
+        print(f"[FastAPI] ⚠ Cannot write profile for {label}: {e}")
+        return
+    # Chạy trong worker -> đếm qua JobMetrics, consumer cộng vào backtest_slow_job_profiles_total
+    count_metric("slow_job_profiles")
+    print(f"[FastAPI] 🐢 Slow job {label} ({elapsed_ms:.0f}ms) - profile saved to {path}")
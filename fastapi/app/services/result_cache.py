@@ -0,0 +1,146 @@
+# app/services/result_cache.py
+
+import asyncio
+import hashlib
+import json
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from app.models.backtest_models import BacktestJobMessage
+
+# Kết quả bị lỗi không được cache / chia cho job chờ (lần chạy sau có thể thành công)
+CACHEABLE_STATUSES = ("COMPLETED",)
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def canonical_job_key(job: BacktestJobMessage, data_version: str) -> str:
+    """
+    Hash chuẩn hoá của những gì quyết định kết quả backtest:
+    symbol, khoảng ngày, rules, job_config, phí, vốn ban đầu và data version của mã.
+    job_id / strategy_id / session_id không ảnh hưởng kết quả nên không nằm trong key.
+    """
+    strategy = job.strategy or {}
+    payload = {
+        "symbol": job.symbol,
+        "data_from": job.data_from,
+        "data_to": job.data_to,
+        "price_source": job.price_source,
+        "rules": strategy.get("rules") or [],
+        "job_config": job.job_config or {},
+        "commission_rate": float(job.commission_rate),
+        "initial_capital": float(job.initial_capital),
+        "data_version": data_version,
+    }
+    raw = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=_json_default)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Cache kết quả backtest (dict đã serialize) + gộp các job giống hệt đang chạy cùng lúc.
+    Chạy trong event loop của consumer (không thread-safe, không cần lock).
+    """
+
+    def __init__(self, max_entries: int = 256) -> None:
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._symbols: Dict[str, str] = {}  # key -> symbol (để invalidate theo mã)
+        self._versions: Dict[str, str] = {}  # symbol -> data version lần gần nhất
+        self._in_flight: Dict[str, "asyncio.Future[Optional[Dict[str, Any]]]"] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    async def get_or_compute(
+        self,
+        job: BacktestJobMessage,
+        data_version: str,
+        compute: Callable[[], Awaitable[Dict[str, Any]]],
+    ) -> Dict[str, Any]:
+        """
+        Trả về kết quả cho job (job_id của chính job đó):
+          - có trong cache -> trả ngay
+          - job giống hệt đang chạy -> chờ kết quả của job đó
+          - ngược lại -> compute() rồi lưu cache
+        Job đang chạy bị huỷ / timeout / lỗi / trả FAILED -> job chờ không nhận lỗi hay kết quả
+        của job đó mà tự chạy lại (CancelledError không bao giờ lan sang job khác).
+        """
+        self._observe_version(job.symbol, data_version)
+        key = canonical_job_key(job, data_version)
+
+        while True:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return {**cached, "job_id": job.job_id}
+
+            pending = self._in_flight.get(key)
+            if pending is None:
+                break
+            # shield: huỷ job chờ (timeout của chính nó) không huỷ job đang chạy
+            shared = await asyncio.shield(pending)
+            if shared is not None:
+                self.coalesced += 1
+                return {**shared, "job_id": job.job_id}
+            # Không có kết quả dùng chung -> vòng lại: job chờ đầu tiên chạy lại, các job sau gộp vào nó
+
+        self.misses += 1
+        # Future nhận kết quả dùng chung được, hoặc None (bị huỷ, lỗi, không COMPLETED)
+        future: "asyncio.Future[Optional[Dict[str, Any]]]" = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        result: Optional[Dict[str, Any]] = None
+        try:
+            result = await compute()
+        finally:
+            self._in_flight.pop(key, None)
+            shareable = result is not None and result.get("status") in CACHEABLE_STATUSES
+            future.set_result(result if shareable else None)
+
+        if shareable:
+            self._store(key, job.symbol, result)
+        return result
+
+    def invalidate(self, symbol: Optional[str] = None) -> None:
+        """Xoá kết quả của 1 mã (hoặc toàn bộ nếu symbol=None)."""
+        if symbol is None:
+            self._entries.clear()
+            self._symbols.clear()
+            return
+        for key in [k for k, s in self._symbols.items() if s == symbol]:
+            self._entries.pop(key, None)
+            self._symbols.pop(key, None)
+        self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "in_flight": len(self._in_flight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+        }
+
+    def _observe_version(self, symbol: str, data_version: str) -> None:
+        # Có StockPrice mới cho mã -> kết quả cũ không bao giờ hit nữa, xoá luôn cho nhẹ bộ nhớ
+        previous = self._versions.get(symbol)
+        self._versions[symbol] = data_version
+        if previous is not None and previous != data_version:
+            self.invalidate(symbol)
+
+    def _store(self, key: str, symbol: str, result: Dict[str, Any]) -> None:
+        self._entries[key] = result
+        self._symbols[key] = symbol
+        while len(self._entries) > self.max_entries:
+            old_key, _ = self._entries.popitem(last=False)
+            self._symbols.pop(old_key, None)
@@ -0,0 +1,177 @@
+# app/services/result_encoding.py
+
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.models.backtest_models import CompactSeries, EquityPoint
+
+# Mặc định cho mọi job (job_config có thể override):
+#   BACKTEST_RESULT_FORMAT: "points" (List[EquityPoint], như cũ) | "compact" (CompactSeries)
+#   BACKTEST_RESULT_MAX_POINTS: số điểm tối đa mỗi đường cong, 0 = giữ nguyên độ phân giải
+RESULT_FORMAT_POINTS = "points"
+RESULT_FORMAT_COMPACT = "compact"
+DEFAULT_RESULT_FORMAT = os.getenv("BACKTEST_RESULT_FORMAT", RESULT_FORMAT_POINTS).lower()
+DEFAULT_MAX_POINTS = int(os.getenv("BACKTEST_RESULT_MAX_POINTS", "0") or 0)
+
+# LTTB cần ít nhất điểm đầu, điểm cuối và 1 bucket ở giữa
+_MIN_LTTB_POINTS = 3
+
+
+# ============================================================
+# 1) LTTB DOWNSAMPLING
+# ============================================================
+
+# read(start, stop) -> (x[start:stop], y[start:stop]) dạng float64
+SliceReader = Callable[[int, int], Tuple[np.ndarray, np.ndarray]]
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: chọn n_out chỉ số giữ hình dạng đường cong
+    (luôn giữ điểm đầu & cuối). n_out >= len(x) -> trả về mọi chỉ số.
+    """
+    n = len(x)
+    if n_out >= n or n_out < _MIN_LTTB_POINTS:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    return lttb_indices_from(lambda start, stop: (x[start:stop], y[start:stop]), n, n_out)
+
+
+def lttb_indices_from(read: SliceReader, n: int, n_out: int) -> np.ndarray:
+    """
+    LTTB trên dữ liệu chỉ đọc được theo đoạn (vd file spool của streaming_engine):
+    mỗi bucket chỉ đọc bucket đó + bucket kế tiếp -> bộ nhớ O(kích thước bucket), kết quả như lttb_indices.
+    """
+    if n_out >= n or n_out < _MIN_LTTB_POINTS:
+        return np.arange(n)
+
+    # n - 2 điểm ở giữa chia thành n_out - 2 bucket
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    first_x, first_y = read(0, 1)
+    px, py = float(first_x[0]), float(first_y[0])
+    for b in range(n_out - 2):
+        start, stop = edges[b], edges[b + 1]
+        if stop <= start:
+            stop = start + 1
+
+        # Điểm trung bình của bucket kế tiếp (bucket cuối -> điểm cuối)
+        next_start, next_stop = stop, (edges[b + 2] if b + 2 < len(edges) else n)
+        if next_stop <= next_start:
+            next_stop = next_start + 1
+        next_x, next_y = read(next_start, next_stop)
+        avg_x = next_x.mean()
+        avg_y = next_y.mean()
+
+        # Diện tích tam giác (prev, candidate, avg) -> chọn candidate lớn nhất
+        xs, ys = read(start, stop)
+        area = np.abs(
+            (px - avg_x) * (ys - py) - (px - xs) * (avg_y - py)
+        )
+        best = int(np.argmax(area))
+        px, py = float(xs[best]), float(ys[best])
+        selected[b + 1] = start + best
+
+    return selected
+
+
+# ============================================================
+# 2) ENCODE / DECODE
+# ============================================================
+
+def resolve_result_options(job_config: Optional[Dict[str, Any]]) -> Tuple[str, int]:
+    """
+    (format, max_points) cho 1 job:
+      result_format: "points" | "compact"
+      max_points: số điểm tối đa (LTTB); full_resolution=True -> bỏ qua downsampling
+    """
+    cfg = job_config or {}
+    fmt = str(cfg.get("result_format", DEFAULT_RESULT_FORMAT)).lower()
+    if fmt not in (RESULT_FORMAT_POINTS, RESULT_FORMAT_COMPACT):
+        fmt = RESULT_FORMAT_POINTS
+
+    if cfg.get("full_resolution"):
+        return fmt, 0
+    try:
+        max_points = int(cfg.get("max_points", DEFAULT_MAX_POINTS) or 0)
+    except (TypeError, ValueError):
+        max_points = DEFAULT_MAX_POINTS
+    return fmt, max(0, max_points)
+
+
+def downsample(times: np.ndarray, values: np.ndarray, max_points: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Giảm số điểm bằng LTTB (max_points = 0 -> giữ nguyên)."""
+    if max_points <= 0 or len(times) <= max_points:
+        return times, values
+    idx = lttb_indices(times, values, max_points)
+    return times[idx], values[idx]
+
+
+def encode_compact(times: np.ndarray, values: np.ndarray, source_points: int) -> CompactSeries:
+    times = np.asarray(times, dtype=np.int64)
+    deltas = np.diff(times, prepend=0) if len(times) else times
+    return CompactSeries(
+        times=deltas.tolist(),
+        values=np.asarray(values, dtype=float).tolist(),
+        sourcePoints=source_points,
+    )
+
+
+def decode_compact(series: CompactSeries) -> List[EquityPoint]:
+    """Giải CompactSeries về List[EquityPoint] (tham chiếu cho phía NestJS / kiểm tra)."""
+    times = np.cumsum(np.asarray(series.times, dtype=np.int64)).tolist()
+    return [EquityPoint(time=t, value=v) for t, v in zip(times, series.values)]
+
+
+def encode_point_series(times: np.ndarray, values: np.ndarray) -> List[EquityPoint]:
+    return [EquityPoint(time=t, value=v) for t, v in zip(times.tolist(), values.tolist())]
+
+
+def encode_curves(
+    times: np.ndarray,
+    equity: np.ndarray,
+    drawdown: np.ndarray,
+    job_config: Optional[Dict[str, Any]],
+) -> Dict[str, Any]:
+    """
+    Field equity/underwater cho BacktestResultMessage theo result_format/max_points của job.
+    Mỗi đường cong được downsample riêng (LTTB giữ đỉnh/đáy của chính đường đó).
+    """
+    fmt, max_points = resolve_result_options(job_config)
+    eq_t, eq_v = downsample(times, equity, max_points)
+    dd_t, dd_v = downsample(times, drawdown, max_points)
+    return curves_payload(fmt, len(times), (eq_t, eq_v), (dd_t, dd_v))
+
+
+def curves_payload(
+    fmt: str,
+    source_points: int,
+    equity: Tuple[np.ndarray, np.ndarray],
+    underwater: Tuple[np.ndarray, np.ndarray],
+) -> Dict[str, Any]:
+    """Field của result message từ 2 đường cong (times, values) đã downsample."""
+    n = source_points
+    eq_t, eq_v = equity
+    dd_t, dd_v = underwater
+
+    if fmt == RESULT_FORMAT_COMPACT:
+        return {
+            "resultFormat": RESULT_FORMAT_COMPACT,
+            "equityCurve": [],
+            "underwater": [],
+            "equityCurveCompact": encode_compact(eq_t, eq_v, n),
+            "underwaterCompact": encode_compact(dd_t, dd_v, n),
+        }
+
+    return {
+        "resultFormat": RESULT_FORMAT_POINTS,
+        "equityCurve": encode_point_series(eq_t, eq_v),
+        "underwater": encode_point_series(dd_t, dd_v),
+    }
@@ -0,0 +1,303 @@
+# app/services/screener.py
+"""
+Screener cả universe: chạy 1 strategy trên mọi mã của bảng "Stock" (hoặc danh sách / bộ lọc
+của job), trả về bảng metric đã xếp hạng theo mã - không equity curve, không danh sách lệnh.
+  - Universe chia thành shard; mỗi shard load giá bằng 1 query bulk (mỗi mã đúng 1 lần,
+    không đi qua price cache để 1 lượt quét cả thị trường không đẩy các mã "nóng" ra khỏi cache).
+  - Shard được gửi sang process pool ngay khi load xong -> query shard sau chồng lên phần tính
+    chỉ báo / mô phỏng của shard trước; số shard đang chờ bị chặn để RAM của process cha có trần.
+  - Worker chạy từng mã đúng như run_backtest (cùng warm-up, chỉ báo, state machine),
+    chỉ giữ metric tổng hợp.
+"""
+
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import pandas as pd
+
+from app.models.backtest_models import (
+    BacktestJobMessage,
+    ScreenerJobMessage,
+    ScreenerResultMessage,
+    ScreenerResultRow,
+)
+from app.services.backtest_engine import (
+    fetch_price_frame_bulk,
+    fetch_warmup_start,
+    job_datetime_range,
+    job_warmup_bars,
+    list_universe_symbols,
+    load_data_as_dataframe,
+    required_indicators_for_job,
+)
+from app.services.job_control import JobControl
+from app.services.metrics import count_metric, stage_timer
+from app.services.optimizer import RANKABLE_METRICS, evaluate_on_frame, rank_results
+from app.services.worker_pool import make_process_pool, resolve_max_workers, split_chunks
+
+# Số mã tối đa mỗi shard (= 1 query bulk + 1 task của pool)
+SCREENER_SHARD_SYMBOLS = int(os.getenv("BACKTEST_SCREENER_SHARD_SYMBOLS", "100") or 100)
+
+# Dưới ngưỡng này chạy tuần tự trong process hiện tại (không đáng để spawn pool)
+MIN_SYMBOLS_FOR_POOL = int(os.getenv("BACKTEST_SCREENER_MIN_POOL_SIZE", "16") or 16)
+
+# Giới hạn số mã của 1 job screener
+MAX_SCREENER_SYMBOLS = int(os.getenv("BACKTEST_SCREENER_MAX_SYMBOLS", "5000") or 5000)
+
+# Mỗi worker nhận vài shard để cân tải khi các mã dài/ngắn khác nhau
+SHARDS_PER_WORKER = 4
+
+# Số shard đã load (đang chờ / đang chạy) tối đa trên mỗi worker
+MAX_SHARDS_IN_FLIGHT_PER_WORKER = 2
+
+
+# ============================================================
+# 1) UNIVERSE
+# ============================================================
+
+def resolve_universe(job: ScreenerJobMessage) -> List[str]:
+    """Danh sách mã của job (giữ thứ tự, bỏ trùng); không có -> bảng "Stock" theo bộ lọc."""
+    if job.symbols:
+        symbols = list(dict.fromkeys(job.symbols))
+    else:
+        symbols = list_universe_symbols(job.exchanges, job.sectors, job.active_only)
+
+    if not symbols:
+        raise ValueError("Screener universe is empty")
+    if len(symbols) > MAX_SCREENER_SYMBOLS:
+        raise ValueError(f"Screener universe has {len(symbols)} symbols, limit is {MAX_SCREENER_SYMBOLS}")
+    return symbols
+
+
+# ============================================================
+# 2) BULK LOADING
+# ============================================================
+
+def load_shard_prices(
+    symbols: List[str],
+    start: datetime,
+    end: datetime,
+    bars: int,
+) -> Dict[str, pd.DataFrame]:
+    """
+    Giá của 1 shard trong 1 query bulk: symbol -> DataFrame (ts, trade_date, OHLCV) gồm
+    ít nhất `bars` bar trước start (warm-up), như fetch_price_frame_warmup của từng mã.
+    Mã không có dữ liệu không có trong kết quả.
+    """
+    with stage_timer("load"):
+        warmup_from = fetch_warmup_start(symbols, start, bars)
+        raw = fetch_price_frame_bulk(symbols, warmup_from, end)
+    count_metric("rows_loaded", len(raw))
+    if raw.empty:
+        return {}
+
+    # fetch_bulk sort theo trade_date -> mỗi nhóm vẫn đúng thứ tự thời gian
+    return {
+        symbol: part.drop(columns="stock_symbol").reset_index(drop=True)
+        for symbol, part in raw.groupby("stock_symbol", sort=False)
+    }
+
+
+# ============================================================
+# 3) EVALUATION
+# ============================================================
+
+def screen_symbol(
+    job_payload: Dict[str, Any],
+    symbol: str,
+    prices: Optional[pd.DataFrame],
+    required: Dict[str, set],
+) -> Dict[str, Any]:
+    """
+    Metric của 1 mã (giống run_backtest của mã đó); bars = 0 -> không có dữ liệu.
+    job_payload: các field BacktestJobMessage của job screener (không gồm symbol).
+    """
+    if prices is None or prices.empty:
+        return {"symbol": symbol, "bars": 0}
+    job = BacktestJobMessage(**job_payload, symbol=symbol)
+    df = load_data_as_dataframe(job, required=required, prices=prices)
+    if df.empty:
+        return {"symbol": symbol, "bars": 0}
+    return {"symbol": symbol, "bars": len(df), **evaluate_on_frame(job, df)}
+
+
+def screen_shard(
+    job_payload: Dict[str, Any],
+    symbols: List[str],
+    frames: Dict[str, pd.DataFrame],
+    required: Dict[str, set],
+    control: Optional[JobControl] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Chạy mọi mã của 1 shard; lỗi của 1 mã -> {"symbol", "error"}, không dừng cả shard.
+    control: kiểm tra cancel/timeout giữa các mã (JobCancelled dừng cả shard).
+    """
+    rows = []
+    for symbol in symbols:
+        if control is not None:
+            control.checkpoint(len(rows), len(symbols), stage="screen")
+        try:
+            rows.append(screen_symbol(job_payload, symbol, frames.get(symbol), required))
+        except Exception as e:
+            print(f"[FastAPI] ❌ Screener failed for {symbol}: {e}")
+            rows.append({"symbol": symbol, "error": str(e)})
+    return rows
+
+
+# --- Worker process state (được set 1 lần bởi initializer) ---
+_WORKER_JOB_PAYLOAD: Optional[Dict[str, Any]] = None
+_WORKER_REQUIRED: Optional[Dict[str, set]] = None
+_WORKER_CONTROL: Optional[JobControl] = None
+
+
+def _init_screener_worker(
+    job_payload: Dict[str, Any],
+    required: Dict[str, set],
+    control: Optional[JobControl] = None,
+) -> None:
+    global _WORKER_JOB_PAYLOAD, _WORKER_REQUIRED, _WORKER_CONTROL
+    _WORKER_JOB_PAYLOAD = job_payload
+    _WORKER_REQUIRED = required
+    _WORKER_CONTROL = control
+
+
+def _screen_shard_in_worker(symbols: List[str], frames: Dict[str, pd.DataFrame]) -> List[Dict[str, Any]]:
+    return screen_shard(_WORKER_JOB_PAYLOAD, symbols, frames, _WORKER_REQUIRED, _WORKER_CONTROL)
+
+
+def screen_universe(
+    job: ScreenerJobMessage,
+    symbols: List[str],
+    max_workers: Optional[int] = None,
+    control: Optional[JobControl] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Chạy strategy của job trên mọi mã -> 1 dict / mã (thứ tự tuỳ shard xong trước).
+    control: kiểm tra cancel/timeout + progress (đơn vị: số mã) sau mỗi shard; trong shard
+    (cả ở worker của pool) kiểm tra cancel/timeout giữa các mã.
+    """
+    start, end = job_datetime_range(job)
+    required = required_indicators_for_job(job)
+    bars = job_warmup_bars(job, required)
+    # Chỉ gửi các field của BacktestJobMessage (bỏ symbols, bộ lọc...) sang worker
+    job_payload = job.model_dump(include=set(BacktestJobMessage.model_fields) - {"symbol"})
+
+    workers = resolve_max_workers(max_workers)
+    use_pool = workers > 1 and len(symbols) >= MIN_SYMBOLS_FOR_POOL
+    n_shards = -(-len(symbols) // SCREENER_SHARD_SYMBOLS)
+    if use_pool:
+        n_shards = max(n_shards, workers * SHARDS_PER_WORKER)
+    shards = split_chunks(symbols, n_shards)
+    print(
+        f"[FastAPI] 🔎 Screener job {job.job_id}: {len(symbols)} symbols in {len(shards)} shard(s), "
+        f"{workers if use_pool else 1} worker(s)"
+    )
+
+    rows: List[Dict[str, Any]] = []
+    shard_control = control.subtask() if control is not None else None
+
+    def collect(results: Iterable[List[Dict[str, Any]]]) -> None:
+        for shard_rows in results:
+            rows.extend(shard_rows)
+        if control is not None:
+            control.checkpoint(len(rows), len(symbols), stage="screen")
+
+    if not use_pool:
+        for shard in shards:
+            frames = load_shard_prices(shard, start, end, bars)
+            collect([screen_shard(job_payload, shard, frames, required, shard_control)])
+        return rows
+
+    pool = make_process_pool(
+        workers,
+        initializer=_init_screener_worker,
+        initargs=(job_payload, required, shard_control),
+    )
+    pending: Set[Future] = set()
+    try:
+        for shard in shards:
+            frames = load_shard_prices(shard, start, end, bars)
+            pending.add(pool.submit(_screen_shard_in_worker, shard, frames))
+            # Chặn số shard đã load nhưng chưa chạy xong -> không giữ giá của cả universe trong RAM
+            while len(pending) >= workers * MAX_SHARDS_IN_FLIGHT_PER_WORKER:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(future.result() for future in done)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            collect(future.result() for future in done)
+    except BaseException:
+        # Huỷ / timeout / lỗi -> bỏ các shard chưa chạy, không chờ pool chạy hết
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown(wait=True)
+    return rows
+
+
+# ============================================================
+# 4) ENTRY POINT
+# ============================================================
+
+def _failed_screener(job: ScreenerJobMessage, error: str, total_symbols: int = 0) -> ScreenerResultMessage:
+    return ScreenerResultMessage(
+        job_id=job.job_id,
+        status="FAILED",
+        rankBy=job.rank_by,
+        totalSymbols=total_symbols,
+        screenedSymbols=0,
+        results=[],
+        error=error,
+    )
+
+
+def run_screener(
+    job: ScreenerJobMessage,
+    control: Optional[JobControl] = None,
+) -> ScreenerResultMessage:
+    """
+    Universe screener:
+    1. Universe = job.symbols hoặc bảng "Stock" (exchanges / sectors / active_only).
+    2. Load giá theo shard (1 query bulk / shard), chạy shard trên process pool.
+    3. Xếp hạng theo rank_by (bỏ mã có < min_trades lệnh), cắt top_n.
+    control: huỷ / quá timeout -> FAILED (error ghi lý do).
+    """
+    started = time.perf_counter()
+    symbols: List[str] = []
+    try:
+        if job.rank_by not in RANKABLE_METRICS:
+            raise ValueError(f"Unsupported rank_by: {job.rank_by}")
+        symbols = resolve_universe(job)
+        if control is not None:
+            control.check()
+        rows = screen_universe(job, symbols, job.max_workers, control)
+    except Exception as e:
+        print(f"[FastAPI] ❌ Screener job {job.job_id} failed: {e}")
+        return _failed_screener(job, str(e), len(symbols))
+
+    failed = {row["symbol"]: row["error"] for row in rows if "error" in row}
+    no_data = [row["symbol"] for row in rows if "error" not in row and row["bars"] == 0]
+    screened = [row for row in rows if "error" not in row and row["bars"] > 0]
+    eligible = [row for row in screened if row["totalTrades"] >= job.min_trades]
+    # Thứ tự ổn định cho các mã bằng điểm: theo thứ tự trong universe
+    order = {symbol: i for i, symbol in enumerate(symbols)}
+    eligible.sort(key=lambda row: order[row["symbol"]])
+    ranked = rank_results(eligible, job.rank_by, job.top_n)
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"[FastAPI] 🏁 Screener job {job.job_id}: {len(screened)}/{len(symbols)} symbols screened "
+        f"({len(no_data)} without data, {len(failed)} failed) in {elapsed:.2f}s"
+    )
+
+    return ScreenerResultMessage(
+        job_id=job.job_id,
+        status="COMPLETED",
+        rankBy=job.rank_by,
+        totalSymbols=len(symbols),
+        screenedSymbols=len(screened),
+        results=[ScreenerResultRow(rank=i + 1, **row) for i, row in enumerate(ranked)],
+        noData=sorted(no_data, key=order.__getitem__),
+        failedSymbols=failed,
+    )
@@ -0,0 +1,421 @@
+# app/services/streaming_engine.py
+"""
+Backtest streaming cho lịch sử rất dài (tick / nhiều thập kỷ nến phút): giá được đọc theo chunk
+cố định qua server-side cursor (PriceSource.stream), chỉ báo mang state qua ranh giới chunk,
+mô phỏng chạy tiếp từng chunk trên cùng SimulationState, equity/drawdown được gom dần.
+Bộ nhớ đỉnh ~ O(chunk + cửa sổ chỉ báo dài nhất + số lệnh), không phụ thuộc độ dài lịch sử.
+
+Kernel streaming tái hiện đúng thuật toán của pandas (rolling mean có bù Kahan, ewm adjust=False,
+std trên cửa sổ) -> kết quả trùng từng bit với engine in-memory (load_data_as_dataframe + simulate).
+
+Bật bằng job_config.streaming=True hoặc BACKTEST_STREAMING=1; cấu hình:
+  BACKTEST_STREAM_CHUNK_ROWS : số dòng mỗi chunk đọc từ DB
+  BACKTEST_STREAM_SPOOL_DIR  : thư mục file tạm chứa equity/drawdown theo bar (mặc định: tempdir)
+Số điểm đường cong theo resolve_result_options như engine in-memory (mặc định giữ mọi điểm);
+lịch sử rất dài nên đặt job_config.max_points / BACKTEST_RESULT_MAX_POINTS để result message
+không phải chứa O(n) điểm (LTTB chạy trên file spool, chỉ điểm được chọn vào RAM).
+"""
+
+import os
+import shutil
+import tempfile
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.models.backtest_models import BacktestJobMessage, BacktestResultMessage
+from app.services.backtest_engine import (
+    DEFAULT_INDICATOR_NODES,
+    SimulationOutput,
+    SimulationState,
+    StrategySignals,
+    _create_empty_result,
+    build_result_message,
+    build_strategy_signals,
+    compute_drawdown,
+    get_user_rules,
+    indicator_warmup_bars,
+    job_datetime_range,
+    required_indicators_for_job,
+    simulation_params_from_job,
+    stream_price_frames,
+)
+from app.services.indicator_registry import (
+    SOURCE_COLUMNS,
+    Node,
+    column_name,
+    indicator_spec,
+    params_tuple,
+    required_nodes,
+    resolve_plan,
+    seed_start,
+)
+from app.services.job_control import JobControl
+from app.services.metrics import count_metric, stage_timer
+from app.services.monte_carlo import (
+    DailyCloseAccumulator,
+    monte_carlo_options,
+    run_monte_carlo,
+    trade_returns,
+)
+from app.services.result_encoding import curves_payload, lttb_indices_from, resolve_result_options
+from app.services.streaming_indicators import EMA, SMA, SmaRSI, StdDev
+
+STREAM_CHUNK_ROWS = int(os.getenv("BACKTEST_STREAM_CHUNK_ROWS", "50000") or 50000)
+STREAM_SPOOL_DIR = os.getenv("BACKTEST_STREAM_SPOOL_DIR") or None
+
+# Cột chỉ báo mặc định (calculate_indicators) -> node tương ứng
+_DEFAULT_COLUMNS: Dict[str, Node] = dict(zip(("sma_fast", "sma_slow", "rsi"), DEFAULT_INDICATOR_NODES))
+
+
+# ============================================================
+# 1) STREAMING KERNELS (streaming_indicators, khớp từng bit với pandas)
+# ============================================================
+
+class _Elementwise:
+    """Indicator không có lookback (MACD, MACD_HIST, BB_*): kernel của registry chạy thẳng trên chunk."""
+
+    def __init__(self, kernel: Callable[..., np.ndarray], params: Tuple[Any, ...]) -> None:
+        self._kernel = kernel
+        self._params = params
+
+    def update_many(self, *inputs: np.ndarray) -> np.ndarray:
+        return np.asarray(self._kernel(*inputs, *self._params), dtype=float)
+
+
+# indicator -> factory(*params) của kernel streaming có state (streaming_indicators, bản pandas-exact)
+_STREAM_KERNELS: Dict[str, Callable[..., Any]] = {
+    "SMA": lambda period: SMA(int(period)),
+    "RSI": lambda period: SmaRSI(int(period)),
+    "EMA": lambda period: EMA(int(period)),
+    "STDDEV": lambda period: StdDev(int(period)),
+    "MACD_SIGNAL": lambda fast, slow, signal: EMA(int(signal)),
+}
+
+
+def make_stream_kernel(node: Node) -> Any:
+    """Kernel streaming cho 1 node; ValueError nếu indicator cần lookback mà chưa có bản streaming."""
+    name, key = node
+    params = params_tuple(key)
+    factory = _STREAM_KERNELS.get(name)
+    if factory is not None:
+        return factory(*params)
+    spec = indicator_spec(name)
+    if int(spec.lookback(*params)) == 0:
+        return _Elementwise(spec.kernel, params)
+    raise ValueError(f"Indicator {name} has no streaming kernel")
+
+
+class IndicatorStream:
+    """
+    Tập node chỉ báo (theo DAG của registry) tính dần qua các chunk.
+    Cột đã có trong chunk (cột giá) được dùng lại như compute_indicator_columns.
+    origin: chỉ số dòng (tính từ chunk đầu tiên) của bar đầu tiên >= data_from -> node seeded
+            (EMA...) bỏ input trước seed_start() như compute_indicator_columns.
+    """
+
+    def __init__(self, nodes: List[Node], origin: Optional[int] = None) -> None:
+        self.plan = resolve_plan(nodes)
+        self._kernels = {node: make_stream_kernel(node) for node in self.plan}
+        # node seeded -> số dòng đầu còn phải bỏ
+        self._skip: Dict[Node, int] = {}
+        if origin is not None:
+            memo: Dict[Node, int] = {}
+            for node in self.plan:
+                if node[0] not in SOURCE_COLUMNS and indicator_spec(node[0]).seeded:
+                    self._skip[node] = max(0, seed_start(node, origin, memo))
+
+    def update(self, chunk: pd.DataFrame) -> Dict[str, np.ndarray]:
+        values: Dict[Node, np.ndarray] = {}
+        computed: Dict[str, np.ndarray] = {}
+        for node in self.plan:
+            name = column_name(node)
+            if name in chunk.columns:
+                values[node] = chunk[name].to_numpy(dtype=float)
+                continue
+            spec = indicator_spec(node[0])
+            inputs = []
+            for dep in spec.inputs(*params_tuple(node[1])):
+                if dep not in values:
+                    values[dep] = chunk[column_name(dep)].to_numpy(dtype=float)
+                inputs.append(values[dep])
+            skip = min(self._skip.get(node, 0), len(chunk))
+            if skip:
+                self._skip[node] -= skip
+                inputs = [np.concatenate([np.full(skip, np.nan), array[skip:]]) for array in inputs]
+            values[node] = self._kernels[node].update_many(*inputs)
+            computed[name] = values[node]
+        return computed
+
+
+# ============================================================
+# 2) SIGNAL & CURVE ACCUMULATION
+# ============================================================
+
+class _SignalStream:
+    """
+    build_strategy_signals theo chunk. Rule cross_over/cross_under đọc bar trước ->
+    chunk được nối thêm dòng cuối của chunk trước (rồi bỏ kết quả của dòng đó).
+    """
+
+    def __init__(self, user_rules: List[Dict[str, Any]], cfg: Optional[Dict[str, Any]]) -> None:
+        self.user_rules = user_rules
+        self.cfg = cfg
+        self._carry: Optional[pd.DataFrame] = None
+
+    def update(self, chunk: pd.DataFrame) -> StrategySignals:
+        if not self.user_rules:
+            return build_strategy_signals(self.user_rules, chunk, self.cfg)
+        frame = chunk if self._carry is None else pd.concat([self._carry, chunk], ignore_index=True)
+        signals = build_strategy_signals(self.user_rules, frame, self.cfg)
+        if self._carry is not None:
+            signals = StrategySignals(
+                entry=signals.entry[1:],
+                exit=signals.exit[1:],
+                valid=signals.valid[1:],
+                has_user_rules=signals.has_user_rules,
+            )
+        self._carry = chunk.iloc[-1:]
+        return signals
+
+
+class _CurveSpool:
+    """
+    Equity / drawdown theo bar ghi nối tiếp ra file tạm (không giữ trong RAM);
+    đỉnh equity và đáy drawdown được gom dần để tính drawdown / maxDrawdown.
+    """
+
+    _COLUMNS = (("times", np.int64), ("equity", np.float64), ("drawdown", np.float64))
+
+    def __init__(self, initial_capital: float, spool_dir: Optional[str] = STREAM_SPOOL_DIR) -> None:
+        self.initial_capital = initial_capital
+        self.dir = tempfile.mkdtemp(prefix="backtest-stream-", dir=spool_dir)
+        self._files = {name: open(os.path.join(self.dir, name), "wb") for name, _ in self._COLUMNS}
+        self.n_points = 0
+        self.peak: Optional[float] = None
+        self.min_drawdown: Optional[float] = None
+        self.last_equity: Optional[float] = None
+
+    def append(self, times: np.ndarray, equity: np.ndarray) -> None:
+        if len(equity) == 0:
+            return
+        drawdown = compute_drawdown(equity, self.initial_capital, self.peak)
+        chunk_peak = float(equity.max())
+        self.peak = chunk_peak if self.peak is None else max(self.peak, chunk_peak)
+        chunk_min = float(drawdown.min())
+        self.min_drawdown = chunk_min if self.min_drawdown is None else min(self.min_drawdown, chunk_min)
+        self.last_equity = float(equity[-1])
+        for (name, dtype), values in zip(self._COLUMNS, (times, equity, drawdown)):
+            self._files[name].write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+        self.n_points += len(equity)
+
+    def _read(self) -> Dict[str, np.ndarray]:
+        for handle in self._files.values():
+            handle.close()
+        if self.n_points == 0:
+            return {name: np.empty(0, dtype=dtype) for name, dtype in self._COLUMNS}
+        return {
+            name: np.memmap(os.path.join(self.dir, name), dtype=dtype, mode="r", shape=(self.n_points,))
+            for name, dtype in self._COLUMNS
+        }
+
+    def encode(self, job_config: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Field equity/underwater của result message, giống encode_curves trên cả đường cong."""
+        fmt, max_points = resolve_result_options(job_config)
+        spool = self._read()
+        times = spool["times"]
+        return curves_payload(
+            fmt,
+            self.n_points,
+            _downsample_spool(times, spool["equity"], max_points),
+            _downsample_spool(times, spool["drawdown"], max_points),
+        )
+
+    def close(self) -> None:
+        for handle in self._files.values():
+            handle.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+def _downsample_spool(
+    times: np.ndarray,
+    values: np.ndarray,
+    max_points: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """downsample() trên mảng memory-map: LTTB đọc từng bucket, chỉ các điểm được chọn vào RAM."""
+    n = len(times)
+    if max_points <= 0 or n <= max_points:
+        return np.array(times), np.array(values)
+
+    def read(start: int, stop: int) -> Tuple[np.ndarray, np.ndarray]:
+        return np.asarray(times[start:stop], dtype=float), np.asarray(values[start:stop])
+
+    idx = lttb_indices_from(read, n, max_points)
+    return np.asarray(times[idx]), np.asarray(values[idx])
+
+
+# ============================================================
+# 3) ENTRY POINT
+# ============================================================
+
+def run_backtest_streaming(
+    job: BacktestJobMessage,
+    control: Optional[JobControl] = None,
+    chunk_rows: Optional[int] = None,
+) -> BacktestResultMessage:
+    """
+    Backtest 1 job theo chunk (core "array"), cùng kết quả với run_backtest in-memory.
+    Mỗi chunk: chỉ báo mặc định -> dropna -> chỉ báo của strategy -> cắt warm-up -> signal -> mô phỏng.
+    JobCancelled được raise lên cho caller xử lý (như run_backtest_on_frame).
+    """
+    chunk_rows = max(1, int(chunk_rows or (job.job_config or {}).get("stream_chunk_rows") or STREAM_CHUNK_ROWS))
+    print(f"[FastAPI] Loading data for {job.symbol}... (streaming, {chunk_rows} rows/chunk)")
+    if control is not None:
+        control.check()
+
+    dt_from_req, dt_to_req = job_datetime_range(job)
+    dt_from_ts = pd.to_datetime(dt_from_req)
+    required = required_indicators_for_job(job)
+    warmup_bars = indicator_warmup_bars(required)
+
+    user_rules = get_user_rules(job)
+    if user_rules:
+        print(
+            f"[FastAPI] ▶ Using USER STRATEGY for job {job.job_id} "
+            f"with {len(user_rules)} rule(s)."
+        )
+    else:
+        print(
+            f"[FastAPI] ▶ Using DEFAULT SMA/RSI STRATEGY for job {job.job_id} "
+            f"(no user rules provided)."
+        )
+
+    defaults = {col: make_stream_kernel(node) for col, node in _DEFAULT_COLUMNS.items()}
+    extra_nodes = required_nodes(required) if required else []
+    # Tạo khi đã biết origin (chunk đầu tiên chạm data_from); held = dòng warm-up chờ tới lúc đó
+    extras: Optional[IndicatorStream] = None
+    held: List[pd.DataFrame] = []
+    signal_stream = _SignalStream(user_rules, job.job_config)
+    params = simulation_params_from_job(job)
+    state = SimulationState(params, control)
+    spool = _CurveSpool(params.initial_capital)
+    # Monte Carlo cần equity cuối ngày -> gom dần (1 giá trị / ngày) thay cho cả đường equity
+    mc_options = monte_carlo_options(job.job_config, job.job_id)
+    daily = DailyCloseAccumulator() if mc_options is not None else None
+
+    rows_loaded = 0
+    n_chunks = 0
+    try:
+        chunks = iter(stream_price_frames(job.symbol, dt_from_req, dt_to_req, warmup_bars, chunk_rows))
+        while True:
+            with stage_timer("load"):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            rows_loaded += len(chunk)
+            n_chunks += 1
+
+            with stage_timer("indicators"):
+                for col in ["close", "open", "high", "low"]:
+                    if col in chunk.columns:
+                        chunk[col] = chunk[col].astype(float)
+                close = chunk["close"].to_numpy(dtype=float)
+                for col, kernel in defaults.items():
+                    chunk[col] = kernel.update_many(close)
+                # Giống calculate_indicators: chỉ giữ dòng đã đủ chỉ báo mặc định
+                chunk = chunk.dropna().reset_index(drop=True)
+                chunk["trade_date"] = pd.to_datetime(chunk["trade_date"])
+                if extra_nodes:
+                    if extras is None:
+                        # Giữ các dòng warm-up tới khi gặp data_from -> biết origin (như
+                        # load_data_as_dataframe) trước khi tính node seeded (EMA...)
+                        held.append(chunk)
+                        in_range = (chunk["trade_date"] >= dt_from_ts).to_numpy()
+                        if not in_range.any():
+                            continue
+                        chunk = pd.concat(held, ignore_index=True)
+                        held = []
+                        extras = IndicatorStream(
+                            extra_nodes, int(np.count_nonzero(chunk["trade_date"] < dt_from_ts))
+                        )
+                    for col, values in extras.update(chunk).items():
+                        chunk[col] = values
+
+                chunk = chunk[chunk["trade_date"] >= dt_from_ts].reset_index(drop=True)
+            if chunk.empty:
+                continue
+
+            with stage_timer("rules"):
+                signals = signal_stream.update(chunk)
+
+            with stage_timer("simulate"):
+                n = len(chunk)
+                equity = np.empty(n, dtype=float)
+                times = np.empty(n, dtype=np.int64)
+                # Tổng số bar chưa biết trước -> progress chỉ báo số bar đã chạy
+                state.run(
+                    chunk["ts"].to_numpy(dtype=np.int64),
+                    chunk["close"].to_numpy(dtype=float),
+                    signals,
+                    equity,
+                    times,
+                    0,
+                )
+                spool.append(times, equity)
+                if daily is not None:
+                    daily.append(times, equity)
+
+        count_metric("rows_loaded", rows_loaded)
+        print(
+            f"[FastAPI] ✅ Streamed {rows_loaded} rows in {n_chunks} chunk(s). "
+            f"After warm-up trimming: {state.bars_done} rows."
+        )
+        if state.bars_done == 0:
+            print(f"[FastAPI] ⚠ No data found for job {job.job_id}. Returning empty result.")
+            return _create_empty_result(job)
+
+        final_point = state.close_position()
+        if final_point is not None:
+            final_times = np.array([final_point[0]], dtype=np.int64)
+            final_equity = np.array([final_point[1]])
+            spool.append(final_times, final_equity)
+            if daily is not None:
+                daily.append(final_times, final_equity)
+        if control is not None:
+            control.check()
+            control.finish(state.bars_done, spool.last_equity)
+
+        extra_fields: Dict[str, Any] = {}
+        if mc_options is not None:
+            with stage_timer("monte_carlo"):
+                extra_fields["monteCarlo"] = run_monte_carlo(
+                    trade_returns(
+                        [qty * entry_price for _, entry_price, _, qty, _ in state.trade_rows],
+                        [profit for *_, profit in state.trade_rows],
+                        params.commission_rate,
+                    ),
+                    daily.values(),
+                    params.initial_capital,
+                    mc_options,
+                )
+
+        with stage_timer("serialize"):
+            output = SimulationOutput(
+                times=np.empty(0, dtype=np.int64),
+                equity=np.empty(0, dtype=float),
+                drawdown=np.empty(0, dtype=float),
+                trades=state.trades(),
+                final_cash=state.cash,
+                win_trades=state.win_trades,
+            )
+            return build_result_message(
+                job,
+                params,
+                output,
+                curves=spool.encode(job.job_config),
+                min_drawdown=spool.min_drawdown,
+                **extra_fields,
+            )
+    finally:
+        spool.close()
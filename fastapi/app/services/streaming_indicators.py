@@ -0,0 +1,545 @@
+# app/services/streaming_indicators.py
+
+import math
+from collections import deque
+from typing import Deque, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+_NAN = float("nan")
+
+
+# ============================================================
+# 1) ROLLING WINDOW (ring buffer kích thước cố định)
+# ============================================================
+
+class _RollingWindow:
+    """Cửa sổ trượt N giá trị gần nhất, giữ sẵn tổng và tổng bình phương."""
+
+    __slots__ = ("period", "_buf", "_pos", "count", "total", "total_sq")
+
+    def __init__(self, period: int) -> None:
+        if period < 1:
+            raise ValueError(f"period must be >= 1, got {period}")
+        self.period = period
+        self._buf: List[float] = [0.0] * period
+        self._pos = 0
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    @property
+    def full(self) -> bool:
+        return self.count >= self.period
+
+    def push(self, x: float) -> None:
+        old = self._buf[self._pos]
+        self._buf[self._pos] = x
+        self._pos += 1
+
+        if self.count < self.period:
+            self.count += 1
+            self.total += x
+            self.total_sq += x * x
+        else:
+            self.total += x - old
+            self.total_sq += x * x - old * old
+
+        # Sau mỗi vòng ring buffer, tính lại tổng từ đầu để chặn sai số cộng/trừ tích lũy
+        # (chi phí O(period) mỗi `period` lần update -> vẫn O(1) trung bình)
+        if self._pos == self.period:
+            self._pos = 0
+            if self.count == self.period:
+                self.total = math.fsum(self._buf)
+                self.total_sq = math.fsum(v * v for v in self._buf)
+
+    def mean(self) -> float:
+        return self.total / self.count
+
+    def variance(self, ddof: int = 0) -> float:
+        n = self.count
+        mean = self.total / n
+        var = (self.total_sq - n * mean * mean) / (n - ddof)
+        # Sai số làm tròn có thể cho giá trị âm rất nhỏ khi chuỗi gần như phẳng
+        return var if var > 0.0 else 0.0
+
+    def reset(self) -> None:
+        self._buf = [0.0] * self.period
+        self._pos = 0
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+
+
+# ============================================================
+# 2) STREAMING INDICATORS (state cố định, update O(1) trừ StdDev / Bollinger: O(period))
+# ============================================================
+
+class StreamingIndicator:
+    """
+    Base class: update(price, volume) trả về giá trị mới (None khi chưa đủ dữ liệu warm-up).
+    Indicator có cột tương ứng trong backtest (SMA, EMA, StdDev, SmaRSI, Bollinger) còn có
+    update_many(chunk) -> mảng (NaN khi chưa warm-up), dùng chung state với update().
+    """
+
+    # Số cột trả về của run_batch (Bollinger = 3)
+    width = 1
+
+    def update(self, price: float, volume: float = 0.0):
+        raise NotImplementedError
+
+    @property
+    def value(self):
+        raise NotImplementedError
+
+    @property
+    def ready(self) -> bool:
+        return self.value is not None
+
+    def reset(self) -> None:
+        raise NotImplementedError
+
+
+# --- Bản khớp từng bit với kernel của indicator_registry (pandas) ---
+# Cùng 1 implementation cho backtest streaming (update_many theo chunk) và cho từng tick
+# (update); state mang qua mọi lần gọi nên chia chunk thế nào kết quả cũng như chạy 1 lần.
+
+def _finite_or_nan(values: Union[Sequence[float], np.ndarray]) -> List[float]:
+    # rolling / ewm của pandas coi ±inf như NaN
+    values = np.asarray(values, dtype=float)
+    return np.where(np.isinf(values), np.nan, values).tolist()
+
+
+def _optional(value: float) -> Optional[float]:
+    return None if value != value else float(value)
+
+
+class SMA(StreamingIndicator):
+    """
+    rolling(period, min_periods=period).mean() của pandas: giữ `period` giá trị cuối + toàn bộ
+    state của roll_mean (tổng có bù Kahan riêng cho cộng/trừ, số quan sát, số giá trị âm,
+    chuỗi giá trị trùng liên tiếp).
+    """
+
+    def __init__(self, period: int) -> None:
+        if period < 1:
+            raise ValueError(f"period must be >= 1, got {period}")
+        self.period = period
+        self.reset()
+
+    def update(self, price: float, volume: float = 0.0) -> Optional[float]:
+        return _optional(self.update_many((price,))[0])
+
+    def update_many(self, values: Union[Sequence[float], np.ndarray]) -> np.ndarray:
+        """Cả 1 chunk giá -> mảng cùng độ dài, NaN khi chưa đủ cửa sổ."""
+        vals = _finite_or_nan(values)
+        out = np.empty(len(vals), dtype=float)
+        w = self.period
+        tail = self._tail
+        seen = self._seen
+        sum_x, comp_add, comp_remove = self._sum, self._comp_add, self._comp_remove
+        nobs, neg, same, prev = self._nobs, self._neg, self._same, self._prev
+
+        for k, v in enumerate(vals):
+            if seen == 0 or w == 1:
+                # Cửa sổ mới (bar đầu / cửa sổ 1 phần tử): reset như pandas
+                sum_x = comp_add = comp_remove = 0.0
+                nobs = neg = same = 0
+                prev = v
+            elif seen >= w:
+                old = tail[0]
+                if old == old:
+                    nobs -= 1
+                    y = -old - comp_remove
+                    t = sum_x + y
+                    comp_remove = t - sum_x - y
+                    sum_x = t
+                    if math.copysign(1.0, old) < 0:
+                        neg -= 1
+            tail.append(v)
+            if v == v:
+                nobs += 1
+                y = v - comp_add
+                t = sum_x + y
+                comp_add = t - sum_x - y
+                sum_x = t
+                if math.copysign(1.0, v) < 0:
+                    neg += 1
+                same = same + 1 if v == prev else 1
+                prev = v
+            seen += 1
+
+            if nobs >= w:
+                result = sum_x / nobs
+                if same >= nobs:
+                    result = prev
+                elif neg == 0 and result < 0:
+                    result = 0.0
+                elif neg == nobs and result > 0:
+                    result = 0.0
+                out[k] = result
+            else:
+                out[k] = _NAN
+
+        self._seen = seen
+        self._sum, self._comp_add, self._comp_remove = sum_x, comp_add, comp_remove
+        self._nobs, self._neg, self._same, self._prev = nobs, neg, same, prev
+        self._value = out[-1] if len(out) else self._value
+        return out
+
+    @property
+    def value(self) -> Optional[float]:
+        return _optional(self._value)
+
+    def reset(self) -> None:
+        self._tail: Deque[float] = deque(maxlen=self.period)
+        self._seen = 0
+        self._sum = 0.0
+        self._comp_add = 0.0
+        self._comp_remove = 0.0
+        self._nobs = 0
+        self._neg = 0
+        self._same = 0
+        self._prev = _NAN
+        self._value = _NAN
+
+
+class EMA(StreamingIndicator):
+    """
+    ewm(span=period, adjust=False, min_periods=min_periods).mean() của pandas: alpha = 2 / (period + 1),
+    khởi tạo bằng giá đầu tiên, trả giá trị từ mẫu thứ min_periods (mặc định = period).
+    NaN đầu chuỗi (vd đường MACD trước khi EMA chậm đủ dữ liệu) được bỏ qua khi seed như pandas.
+    """
+
+    def __init__(self, period: int, min_periods: Optional[int] = None) -> None:
+        if period < 1:
+            raise ValueError(f"period must be >= 1, got {period}")
+        self.period = period
+        self.alpha = 2.0 / (period + 1.0)
+        self.min_periods = max(int(period if min_periods is None else min_periods), 1)
+        self.reset()
+
+    def update(self, price: float, volume: float = 0.0) -> Optional[float]:
+        return _optional(self.update_many((price,))[0])
+
+    def update_many(self, values: Union[Sequence[float], np.ndarray]) -> np.ndarray:
+        """Cả 1 chunk giá -> mảng cùng độ dài, NaN khi chưa đủ min_periods quan sát."""
+        vals = _finite_or_nan(values)
+        out = np.empty(len(vals), dtype=float)
+        # Cùng công thức với ewma của pandas (com = (span - 1) / 2)
+        new_wt = 1.0 / (1.0 + (self.period - 1) / 2.0)
+        factor = 1.0 - new_wt
+        minp = self.min_periods
+        started, weighted, old_wt, nobs = self._started, self._weighted, self._old_wt, self._nobs
+
+        for k, cur in enumerate(vals):
+            is_obs = cur == cur
+            if not started:
+                started = True
+                weighted = cur
+                nobs = int(is_obs)
+                old_wt = 1.0
+            else:
+                nobs += is_obs
+                if weighted == weighted:
+                    old_wt *= factor
+                    if is_obs:
+                        if weighted != cur:
+                            weighted = old_wt * weighted + new_wt * cur
+                            weighted /= old_wt + new_wt
+                        old_wt = 1.0
+                elif is_obs:
+                    weighted = cur
+            out[k] = weighted if nobs >= minp else _NAN
+
+        self._started, self._weighted, self._old_wt, self._nobs = started, weighted, old_wt, nobs
+        return out
+
+    @property
+    def value(self) -> Optional[float]:
+        return _optional(self._weighted) if self._nobs >= self.min_periods else None
+
+    def reset(self) -> None:
+        self._started = False
+        self._weighted = _NAN
+        self._old_wt = 1.0
+        self._nobs = 0
+
+
+class StdDev(StreamingIndicator):
+    """
+    Độ lệch chuẩn tổng thể (ddof=0) trên cửa sổ `period` - như stddev_kernel của registry
+    (numpy std trên từng cửa sổ, 2 lượt -> O(period) mỗi giá trị, đổi lại khớp từng bit).
+    Chỉ giữ period - 1 giá trị cuối giữa các lần gọi.
+    """
+
+    def __init__(self, period: int) -> None:
+        if period < 1:
+            raise ValueError(f"period must be >= 1, got {period}")
+        self.period = period
+        self.reset()
+
+    def update(self, price: float, volume: float = 0.0) -> Optional[float]:
+        return _optional(self.update_many((price,))[0])
+
+    def update_many(self, values: Union[Sequence[float], np.ndarray]) -> np.ndarray:
+        w = self.period
+        values = np.asarray(values, dtype=float)
+        out = np.full(len(values), np.nan)
+        full = np.concatenate([self._tail, values])
+        carried = len(self._tail)
+        if len(full) >= w:
+            std = sliding_window_view(full, w).std(axis=1)
+            first = max(0, w - 1 - carried)
+            out[first:] = std[carried + first - (w - 1):]
+        self._tail = full[max(0, len(full) - (w - 1)):] if w > 1 else full[:0]
+        if len(out):
+            self._value = out[-1]
+        return out
+
+    @property
+    def value(self) -> Optional[float]:
+        return _optional(self._value)
+
+    def reset(self) -> None:
+        self._tail = np.empty(0, dtype=float)
+        self._value = _NAN
+
+
+class SmaRSI(StreamingIndicator):
+    """
+    RSI của engine backtest (compute_rsi_series): gain/loss trung bình bằng rolling mean
+    `period` bar (không phải Wilder), diff() nối tiếp qua giá cuối của lần gọi trước.
+    """
+
+    def __init__(self, period: int = 14) -> None:
+        if period < 1:
+            raise ValueError(f"period must be >= 1, got {period}")
+        self.period = period
+        self.reset()
+
+    def update(self, price: float, volume: float = 0.0) -> Optional[float]:
+        return _optional(self.update_many((price,))[0])
+
+    def update_many(self, values: Union[Sequence[float], np.ndarray]) -> np.ndarray:
+        close = np.asarray(values, dtype=float)
+        if len(close) == 0:
+            return np.empty(0, dtype=float)
+        delta = np.diff(np.concatenate([self._prev_close, close]))
+        self._prev_close = close[-1:]
+        gain = np.where(delta > 0, delta, 0.0)
+        loss = -np.where(delta < 0, delta, 0.0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rs = self._gain.update_many(gain) / self._loss.update_many(loss)
+            out = 100.0 - (100.0 / (1.0 + rs))
+        self._value = out[-1]
+        return out
+
+    @property
+    def value(self) -> Optional[float]:
+        return _optional(self._value)
+
+    def reset(self) -> None:
+        self._prev_close = np.array([np.nan])
+        self._gain = SMA(self.period)
+        self._loss = SMA(self.period)
+        self._value = _NAN
+
+
+class Bollinger(StreamingIndicator):
+    """
+    Bollinger Bands (middle, upper, lower) = SMA ± num_std * StdDev (ddof=0),
+    giống BB_UPPER / BB_LOWER của registry.
+    """
+
+    width = 3
+
+    def __init__(self, period: int = 20, num_std: float = 2.0) -> None:
+        self.period = period
+        self.num_std = float(num_std)
+        self._mid = SMA(period)
+        self._std = StdDev(period)
+
+    def update(self, price: float, volume: float = 0.0) -> Optional[Tuple[float, float, float]]:
+        self.update_many((price,))
+        return self.value
+
+    def update_many(self, values: Union[Sequence[float], np.ndarray]) -> np.ndarray:
+        """Cả 1 chunk giá -> mảng (n, 3) các cột middle, upper, lower."""
+        mid = self._mid.update_many(values)
+        band = self.num_std * self._std.update_many(values)
+        return np.column_stack([mid, mid + band, mid - band])
+
+    @property
+    def value(self) -> Optional[Tuple[float, float, float]]:
+        mid, std = self._mid.value, self._std.value
+        if mid is None or std is None:
+            return None
+        band = self.num_std * std
+        return mid, mid + band, mid - band
+
+    def reset(self) -> None:
+        self._mid.reset()
+        self._std.reset()
+
+
+# --- Bản O(1) riêng cho mô phỏng thị trường (không có cột tương ứng trong backtest) ---
+
+class WilderRSI(StreamingIndicator):
+    """
+    RSI theo Wilder: trung bình gain/loss ban đầu = SMA của `period` thay đổi đầu tiên,
+    sau đó avg = (avg * (period - 1) + x) / period.
+    Không có loss -> 100 (hoặc 50 nếu cũng không có gain, tức giá đứng yên).
+    """
+
+    def __init__(self, period: int = 14) -> None:
+        if period < 1:
+            raise ValueError(f"period must be >= 1, got {period}")
+        self.period = period
+        self._prev: Optional[float] = None
+        self._count = 0
+        self._avg_gain = 0.0
+        self._avg_loss = 0.0
+
+    def update(self, price: float, volume: float = 0.0) -> Optional[float]:
+        price = float(price)
+        if self._prev is None:
+            self._prev = price
+            return None
+
+        change = price - self._prev
+        self._prev = price
+        gain = change if change > 0.0 else 0.0
+        loss = -change if change < 0.0 else 0.0
+
+        self._count += 1
+        p = self.period
+        if self._count <= p:
+            # Giai đoạn seed: cộng dồn rồi chia ở mẫu thứ p
+            self._avg_gain += gain
+            self._avg_loss += loss
+            if self._count == p:
+                self._avg_gain /= p
+                self._avg_loss /= p
+        else:
+            self._avg_gain = (self._avg_gain * (p - 1) + gain) / p
+            self._avg_loss = (self._avg_loss * (p - 1) + loss) / p
+        return self.value
+
+    @property
+    def value(self) -> Optional[float]:
+        if self._count < self.period:
+            return None
+        if self._avg_loss == 0.0:
+            return 100.0 if self._avg_gain > 0.0 else 50.0
+        rs = self._avg_gain / self._avg_loss
+        return 100.0 - 100.0 / (1.0 + rs)
+
+    def reset(self) -> None:
+        self._prev = None
+        self._count = 0
+        self._avg_gain = 0.0
+        self._avg_loss = 0.0
+
+
+class VWAP(StreamingIndicator):
+    """VWAP tích lũy từ lần reset gần nhất (ví dụ đầu phiên)."""
+
+    def __init__(self) -> None:
+        self._pv = 0.0
+        self._v = 0.0
+
+    def update(self, price: float, volume: float = 0.0) -> Optional[float]:
+        volume = float(volume)
+        self._pv += float(price) * volume
+        self._v += volume
+        return self.value
+
+    @property
+    def value(self) -> Optional[float]:
+        return self._pv / self._v if self._v > 0.0 else None
+
+    def reset(self) -> None:
+        self._pv = 0.0
+        self._v = 0.0
+
+
+class RollingVolatility(StreamingIndicator):
+    """Độ lệch chuẩn mẫu (ddof=1) của log-return trong `period` bước gần nhất."""
+
+    def __init__(self, period: int = 20) -> None:
+        if period < 2:
+            raise ValueError(f"period must be >= 2, got {period}")
+        self.period = period
+        self._prev: Optional[float] = None
+        self._window = _RollingWindow(period)
+
+    def update(self, price: float, volume: float = 0.0) -> Optional[float]:
+        price = float(price)
+        if self._prev is not None and self._prev > 0.0 and price > 0.0:
+            self._window.push(math.log(price / self._prev))
+        self._prev = price
+        return self.value
+
+    @property
+    def value(self) -> Optional[float]:
+        if not self._window.full:
+            return None
+        return math.sqrt(self._window.variance(ddof=1))
+
+    def reset(self) -> None:
+        self._prev = None
+        self._window.reset()
+
+
+# ============================================================
+# 3) BATCH PATH (cùng code với streaming -> khớp từng bit)
+# ============================================================
+
+def run_batch(
+    indicator: StreamingIndicator,
+    prices: Union[Sequence[float], np.ndarray],
+    volumes: Optional[Union[Sequence[float], np.ndarray]] = None,
+) -> np.ndarray:
+    """
+    Chạy indicator trên cả mảng giá, trả về mảng (n,) hoặc (n, width); NaN khi chưa warm-up.
+    Dùng đúng hàm update() của bản streaming nên kết quả giống hệt khi feed từng tick,
+    kể cả khi chia thành nhiều lần gọi liên tiếp trên cùng 1 object (state được giữ lại).
+    """
+    price_list = np.asarray(prices, dtype=float).tolist()
+    n = len(price_list)
+    volume_list = (
+        np.asarray(volumes, dtype=float).tolist() if volumes is not None else [0.0] * n
+    )
+    if len(volume_list) != n:
+        raise ValueError("prices and volumes must have the same length")
+
+    width = indicator.width
+    out = np.full((n, width) if width > 1 else n, np.nan)
+    update = indicator.update
+    for i in range(n):
+        value = update(price_list[i], volume_list[i])
+        if value is not None:
+            out[i] = value
+    return out
+
+
+_INDICATOR_TYPES: Dict[str, type] = {
+    "SMA": SMA,
+    "EMA": EMA,
+    "STDDEV": StdDev,
+    "RSI": WilderRSI,
+    "RSI_SMA": SmaRSI,
+    "VWAP": VWAP,
+    "VOLATILITY": RollingVolatility,
+    "BOLLINGER": Bollinger,
+}
+
+
+def make_indicator(name: str, **params) -> StreamingIndicator:
+    """Tạo indicator theo tên (SMA, EMA, STDDEV, RSI, RSI_SMA, VWAP, VOLATILITY, BOLLINGER)."""
+    indicator_cls = _INDICATOR_TYPES.get(name.upper())
+    if indicator_cls is None:
+        raise ValueError(f"Unknown streaming indicator: {name}")
+    return indicator_cls(**params)
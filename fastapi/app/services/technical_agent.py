@@ -1,10 +1,9 @@
 import json
 import pandas as pd
 import psycopg2
-import pandas_ta as ta
-from xgboost import XGBClassifier
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score
+
+# pandas_ta / xgboost / sklearn import rất chậm và tốn RAM -> chỉ load khi route technical
+# được gọi lần đầu (process API & worker backtest không phải trả chi phí này)
 
 
 def fetch_data(symbol: str):
@@ -27,6 +26,11 @@ def fetch_data(symbol: str):
 
 
 def run_and_save_prediction(symbol: str, horizon: int = 5, model_id: int = 1):
+    import pandas_ta as ta
+    from xgboost import XGBClassifier
+    from sklearn.model_selection import train_test_split
+    from sklearn.metrics import accuracy_score
+
     df = fetch_data(symbol)
 
     # Indicators
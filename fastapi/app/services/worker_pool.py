@@ -0,0 +1,109 @@
+# app/services/worker_pool.py
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing.managers import SyncManager
+from typing import Any, Callable, List, Optional, Sequence
+
+# "spawn" an toàn hơn "fork" khi process cha đang chạy thread (aio-pika, SQLAlchemy pool)
+MP_START_METHOD = os.getenv("BACKTEST_MP_START_METHOD", "spawn")
+
+# Số worker tối đa cho các job CPU-bound (sweep, walk-forward...). 0 / trống -> số core.
+MAX_WORKERS = int(os.getenv("BACKTEST_MAX_WORKERS", "0") or 0)
+
+# Executor chạy job từ RabbitMQ: "process" (mặc định) hoặc "thread" (chung process với FastAPI)
+JOB_EXECUTOR = os.getenv("BACKTEST_JOB_EXECUTOR", "process").lower()
+
+# Số job chạy song song (= số worker của executor). 0 / trống -> số core.
+JOB_WORKERS = int(os.getenv("BACKTEST_JOB_WORKERS", "0") or 0)
+
+
+# Worker của job executor (process hoặc thread) ghi số job chạy song song vào đây (initializer)
+_job_context = threading.local()
+
+
+def _init_job_worker(job_workers: int) -> None:
+    _job_context.job_workers = job_workers
+
+
+def resolve_max_workers(requested: Optional[int] = None) -> int:
+    """
+    Số worker thực tế: ưu tiên giá trị job yêu cầu, không vượt quá cấu hình / số core.
+    Đang chạy trong job executor -> tối đa cpu_count // job_workers: các job chạy song song
+    cùng tạo pool con thì tổng số process vẫn ~ số core, không phải cpu_count x cpu_count.
+    """
+    cpu_count = os.cpu_count() or 1
+    limit = MAX_WORKERS if MAX_WORKERS > 0 else cpu_count
+    job_workers = getattr(_job_context, "job_workers", 0)
+    if job_workers > 1:
+        limit = min(limit, max(1, cpu_count // job_workers))
+    if requested is not None and requested > 0:
+        return max(1, min(int(requested), limit))
+    return max(1, limit)
+
+
+def make_process_pool(
+    max_workers: int,
+    initializer: Optional[Callable[..., Any]] = None,
+    initargs: Sequence[Any] = (),
+) -> ProcessPoolExecutor:
+    """
+    Tạo ProcessPoolExecutor với start method cấu hình sẵn.
+    initializer/initargs chỉ được pickle 1 lần cho mỗi worker
+    -> dùng để gửi dữ liệu dùng chung (DataFrame giá) thay vì gửi kèm từng task.
+    """
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context(MP_START_METHOD),
+        initializer=initializer,
+        initargs=tuple(initargs),
+    )
+
+
+def resolve_job_workers() -> int:
+    """Số job chạy song song của consumer (cũng là prefetch_count của channel)."""
+    if JOB_WORKERS > 0:
+        return JOB_WORKERS
+    return max(1, os.cpu_count() or 1)
+
+
+def make_job_executor(max_workers: int) -> Executor:
+    """
+    Executor cho job của consumer. "process" -> job CPU-bound không giữ GIL của event loop;
+    "thread" -> nhẹ hơn, dùng chung price/indicator cache với process FastAPI.
+    """
+    if JOB_EXECUTOR == "thread":
+        return ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="backtest-job",
+            initializer=_init_job_worker,
+            initargs=(max_workers,),
+        )
+    if JOB_EXECUTOR != "process":
+        print(f"[FastAPI] ⚠ Unknown BACKTEST_JOB_EXECUTOR={JOB_EXECUTOR!r}, using process pool")
+    return make_process_pool(max_workers, initializer=_init_job_worker, initargs=(max_workers,))
+
+
+def make_shared_manager() -> SyncManager:
+    """
+    Manager process giữ state dùng chung giữa consumer và worker (dict cờ cancel, queue progress).
+    Proxy của Manager picklable -> gửi kèm job sang process pool được.
+    """
+    return multiprocessing.get_context(MP_START_METHOD).Manager()
+
+
+def split_chunks(items: Sequence[Any], n_chunks: int) -> List[List[Any]]:
+    """Chia đều items thành tối đa n_chunks phần (giữ thứ tự)."""
+    items = list(items)
+    if not items:
+        return []
+    n_chunks = max(1, min(n_chunks, len(items)))
+    size, extra = divmod(len(items), n_chunks)
+    chunks: List[List[Any]] = []
+    start = 0
+    for i in range(n_chunks):
+        end = start + size + (1 if i < extra else 0)
+        chunks.append(items[start:end])
+        start = end
+    return chunks
@@ -0,0 +1 @@
+# benchmarks/ - script đo hiệu năng, chạy từ thư mục fastapi/: python -m benchmarks.<tên>
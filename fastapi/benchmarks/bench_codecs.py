@@ -0,0 +1,99 @@
+# benchmarks/bench_codecs.py
+"""
+So sánh codec message (stdlib JSON / orjson / msgpack) trên result message thực tế:
+equity curve + underwater 5k điểm, ~200 lệnh; cả định dạng "points" và "compact".
+
+    cd fastapi && python -m benchmarks.bench_codecs [--points 5000] [--trades 200] [--repeat 50]
+"""
+
+import argparse
+import time
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+from app.models.backtest_models import BacktestResultMessage, BacktestTrade
+from app.services.message_codec import available_codecs
+from app.services.result_encoding import encode_curves
+
+
+def build_result_dict(n_points: int, n_trades: int, result_format: str, seed: int = 0) -> Dict[str, Any]:
+    """Result message giả lập (GBM) đã .dict() - đúng thứ consumer sẽ encode."""
+    rng = np.random.default_rng(seed)
+    times = (1_600_000_000 + np.arange(n_points) * 86_400).astype(np.int64)
+    equity = 100_000.0 * np.exp(np.cumsum(rng.normal(0.0002, 0.01, n_points)))
+    peak = np.maximum.accumulate(equity)
+    drawdown = (equity - peak) / peak * 100.0
+
+    entries = np.sort(rng.choice(n_points - 1, size=n_trades, replace=False))
+    trades = [
+        BacktestTrade(
+            entryTime=int(times[i]),
+            exitTime=int(times[i + 1]),
+            entryPrice=float(equity[i]),
+            exitPrice=float(equity[i + 1]),
+            quantity=float(rng.integers(1, 1000)),
+            profit=float(equity[i + 1] - equity[i]),
+            side="buy",
+        )
+        for i in entries
+    ]
+
+    message = BacktestResultMessage(
+        job_id=1,
+        status="COMPLETED",
+        netProfit=float(equity[-1] - equity[0]),
+        winRate=50.0,
+        maxDrawdown=float(-drawdown.min()),
+        profitFactor=1.2,
+        totalTrades=n_trades,
+        trades=trades,
+        **encode_curves(times, equity, drawdown, {"result_format": result_format}),
+    )
+    return message.dict()
+
+
+def _best_of(fn: Callable[[], Any], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(n_points: int, n_trades: int, repeat: int) -> List[Dict[str, Any]]:
+    rows: List[Dict[str, Any]] = []
+    for result_format in ("points", "compact"):
+        payload = build_result_dict(n_points, n_trades, result_format)
+        for codec in available_codecs():
+            body = codec.encode(payload)
+            rows.append({
+                "format": result_format,
+                "codec": codec.name,
+                "bytes": len(body),
+                "encode_ms": _best_of(lambda: codec.encode(payload), repeat) * 1000.0,
+                "decode_ms": _best_of(lambda: codec.decode(body), repeat) * 1000.0,
+            })
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=5000)
+    parser.add_argument("--trades", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    rows = run(args.points, args.trades, args.repeat)
+    print(f"{args.points} points, {args.trades} trades (best of {args.repeat})")
+    print(f"{'format':<8} {'codec':<8} {'bytes':>10} {'encode ms':>10} {'decode ms':>10}")
+    for row in rows:
+        print(
+            f"{row['format']:<8} {row['codec']:<8} {row['bytes']:>10,} "
+            f"{row['encode_ms']:>10.3f} {row['decode_ms']:>10.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+# benchmarks/bench_engine.py
+"""
+Benchmark engine backtest trên dữ liệu GBM giả lập (không cần Postgres), đo từng giai đoạn:
+  load        : lấy giá từ PriceSource (giả lập, đã nạp sẵn trong RAM)
+  indicators  : calculate_indicators + chỉ báo theo strategy + cắt warm-up
+  rules       : build_strategy_signals (compile rule / chiến lược mặc định)
+  simulate    : state machine (core "array" hoặc "legacy")
+  serialize   : build_result_message + encode message (codec JSON mặc định)
+  end_to_end  : run_backtest() đầy đủ, cache giá/chỉ báo đã xoá
+rules = 0 -> chiến lược mặc định SMA/RSI; N > 0 -> strategy N rule (xem synthetic.make_rule_set).
+
+    cd fastapi && python -m benchmarks.bench_engine [--bars 1000,10000,100000,1000000]
+        [--rules 0,1,5,10,50] [--repeat 3] [--core array] [--output results.json]
+        [--baseline results_cu.json]
+
+Kết quả ghi ra JSON (mặc định benchmarks/results/engine_<thời gian>_<commit>.json);
+--baseline in tỉ lệ thời gian so với 1 file kết quả cũ để thấy regression giữa các commit.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import app.services.backtest_engine as engine
+from app.models.backtest_models import BacktestJobMessage
+from app.services.message_codec import codec_for
+from benchmarks.synthetic import SyntheticPriceSource, make_gbm_ohlcv, make_rule_set
+
+STAGES = ("load", "indicators", "rules", "simulate", "serialize", "end_to_end")
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+SYMBOL = "BENCH"
+# Đủ cho chu kỳ dài nhất của chiến lược mặc định (SMA50) và make_rule_set
+WARMUP_BARS = 200
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True, cwd=os.path.dirname(__file__),
+        )
+        return out.stdout.strip() or None
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_job(frame: pd.DataFrame, n_rules: int) -> BacktestJobMessage:
+    # Bắt đầu sau WARMUP_BARS bar để phần warm-up có dữ liệu như job thật
+    start = frame["trade_date"].iat[min(WARMUP_BARS, len(frame) - 1)]
+    strategy = {"name": f"bench-{n_rules}", "rules": make_rule_set(n_rules)} if n_rules else None
+    return BacktestJobMessage(
+        job_id=1,
+        symbol=SYMBOL,
+        strategy_id=1,
+        data_from=start.date(),
+        data_to=frame["trade_date"].iat[-1].date(),
+        price_source="HISTORICAL",
+        session_id=None,
+        initial_capital=100_000.0,
+        commission_rate=0.0015,
+        job_config={"stop_loss": 0.05, "take_profit": 0.1},
+        strategy=strategy,
+    )
+
+
+def _reset_caches() -> None:
+    if engine.price_cache is not None:
+        engine.price_cache.invalidate()
+    if engine.indicator_cache is not None:
+        engine.indicator_cache.invalidate()
+
+
+def run_stages(job: BacktestJobMessage, core: str) -> Dict[str, Any]:
+    """1 lượt đo từng giai đoạn (cùng các bước như load_data_as_dataframe + run_backtest_on_frame)."""
+    timings: Dict[str, float] = {}
+    dt_from, dt_to = engine.job_datetime_range(job)
+
+    t0 = time.perf_counter()
+    required = engine.required_indicators_for_job(job)
+    raw = engine.fetch_price_frame_warmup(job.symbol, dt_from, dt_to, engine.indicator_warmup_bars(required))
+    t1 = time.perf_counter()
+    df = engine.calculate_indicators(raw)
+    if required:
+        df = engine._compute_extra_indicators_for_strategy(df, required)
+    df["trade_date"] = pd.to_datetime(df["trade_date"])
+    df = df[df["trade_date"] >= pd.to_datetime(dt_from)].reset_index(drop=True)
+    t2 = time.perf_counter()
+    signals = engine.build_strategy_signals(engine.get_user_rules(job), df, job.job_config)
+    t3 = time.perf_counter()
+    params = engine.simulation_params_from_job(job)
+    output = engine.simulate(df, signals, params, core, job.job_config)
+    t4 = time.perf_counter()
+    body = codec_for(None).encode(engine.build_result_message(job, params, output).dict())
+    t5 = time.perf_counter()
+
+    timings.update(
+        load=t1 - t0, indicators=t2 - t1, rules=t3 - t2, simulate=t4 - t3, serialize=t5 - t4,
+    )
+    _reset_caches()
+    t6 = time.perf_counter()
+    engine.run_backtest(job, core)
+    timings["end_to_end"] = time.perf_counter() - t6
+
+    return {
+        "timings": timings,
+        "rows": len(df),
+        "trades": len(output.trades),
+        "indicator_columns": len(df.columns),
+        "result_bytes": len(body),
+    }
+
+
+def run_case(frame: pd.DataFrame, n_rules: int, core: str, repeat: int) -> Dict[str, Any]:
+    job = make_job(frame, n_rules)
+    runs = []
+    for _ in range(repeat):
+        _reset_caches()
+        runs.append(run_stages(job, core))
+    last = runs[-1]
+    return {
+        "bars": len(frame),
+        "rules": n_rules,
+        "core": core,
+        "rows": last["rows"],
+        "trades": last["trades"],
+        "indicator_columns": last["indicator_columns"],
+        "result_bytes": last["result_bytes"],
+        # median + min (giây) qua các lần lặp
+        "stages": {
+            stage: {
+                "median": statistics.median(r["timings"][stage] for r in runs),
+                "min": min(r["timings"][stage] for r in runs),
+            }
+            for stage in STAGES
+        },
+    }
+
+
+def _case_key(row: Dict[str, Any]) -> tuple:
+    return row["bars"], row["rules"], row["core"]
+
+
+def print_table(rows: List[Dict[str, Any]], baseline: Optional[Dict[tuple, Dict[str, Any]]] = None) -> None:
+    header = f"{'bars':>9} {'rules':>5} " + " ".join(f"{s:>11}" for s in STAGES)
+    print(header + ("   (ms, median; [x] = / baseline)" if baseline else "   (ms, median)"))
+    for row in rows:
+        cells = []
+        base = (baseline or {}).get(_case_key(row))
+        for stage in STAGES:
+            ms = row["stages"][stage]["median"] * 1000.0
+            cell = f"{ms:.1f}"
+            if base is not None:
+                base_ms = base["stages"][stage]["median"] * 1000.0
+                cell += f"[{ms / base_ms:.2f}]" if base_ms > 0 else "[-]"
+            cells.append(f"{cell:>11}")
+        print(f"{row['bars']:>9,} {row['rules']:>5} " + " ".join(cells))
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bars", type=_int_list, default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--rules", type=_int_list, default=[0, 1, 5, 10, 50])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--core", default=engine.ENGINE_CORE_ARRAY)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="file JSON kết quả")
+    parser.add_argument("--baseline", default=None, help="file JSON kết quả cũ để so sánh")
+    parser.add_argument("--verbose", action="store_true", help="in log [FastAPI] của engine")
+    args = parser.parse_args()
+
+    source = SyntheticPriceSource({})
+    previous = engine.set_price_source(source.as_price_source())
+    rows: List[Dict[str, Any]] = []
+    try:
+        for n_bars in args.bars:
+            source.frames[SYMBOL] = make_gbm_ohlcv(n_bars, seed=args.seed)
+            for n_rules in args.rules:
+                print(f"[bench] {n_bars:,} bars x {n_rules} rules ...", flush=True)
+                # Log của engine in theo từng job -> tắt mặc định để không làm nhiễu số đo
+                quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+                with quiet:
+                    rows.append(run_case(source.frames[SYMBOL], n_rules, args.core, args.repeat))
+    finally:
+        engine.set_price_source(previous)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {"repeat": args.repeat, "core": args.core, "seed": args.seed},
+        "results": rows,
+    }
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"engine_{stamp}_{report['meta']['git_commit'] or 'nogit'}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {_case_key(row): row for row in json.load(f)["results"]}
+
+    print_table(rows, baseline)
+    print(f"[bench] saved {output}")
+
+
+if __name__ == "__main__":
+    main()
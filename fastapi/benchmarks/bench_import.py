@@ -0,0 +1,104 @@
+# benchmarks/bench_import.py
+"""
+Đo chi phí import lúc khởi động (python -X importtime) và RSS của 1 process mới:
+  - thời gian import theo package gốc (tổng self time của mọi module trong package)
+  - các module nặng (ML stack) không được load lúc khởi động
+  - tổng thời gian vượt --budget-ms -> exit code 1 (dùng được trong CI / trước khi merge)
+
+    cd fastapi && python -m benchmarks.bench_import [--module app.main] [--top 20]
+        [--budget-ms 3000] [--forbid xgboost,sklearn,pandas_ta]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+FASTAPI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Chỉ nên load khi gọi route /backtest/technical (xem technical_agent)
+DEFAULT_FORBIDDEN = "xgboost,sklearn,pandas_ta,matplotlib"
+
+# Chạy trong process con: import module, in RSS (KB) & danh sách module đã load
+_PROBE = """
+import importlib, resource, sys
+importlib.import_module({module!r})
+print("RSS_KB", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+print("MODULES", ",".join(sorted(sys.modules)))
+"""
+
+
+def run_probe(module: str) -> Tuple[List[Tuple[str, int, int, int]], int, List[str]]:
+    """-> ([(module, độ sâu, self_us, cumulative_us)], rss_kb, module đã load) của 1 lần import nguội."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE.format(module=module)],
+        capture_output=True, text=True, cwd=FASTAPI_DIR,
+    )
+    if proc.returncode != 0:
+        errors = [line for line in proc.stderr.splitlines() if not line.startswith("import time:")]
+        sys.stderr.write("\n".join(errors[-40:]) + "\n")
+        raise SystemExit(f"[bench] import {module} failed (exit {proc.returncode})")
+
+    timings = []
+    for line in proc.stderr.splitlines():
+        # "import time:      self [us] |  cumulative | imported package"
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        # Module con thụt thêm 2 space mỗi cấp (sau 1 space phân cách)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        timings.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+
+    rss_kb, modules = 0, []
+    for line in proc.stdout.splitlines():
+        if line.startswith("RSS_KB "):
+            rss_kb = int(line.split()[1])
+        elif line.startswith("MODULES "):
+            modules = line[len("MODULES "):].split(",")
+    return timings, rss_kb, modules
+
+
+def package_totals(timings: List[Tuple[str, int, int, int]]) -> Dict[str, int]:
+    """Thời gian import (self, không tính module con) gộp theo package gốc: pandas, sqlalchemy, app..."""
+    totals: Dict[str, int] = {}
+    for name, _, self_us, _ in timings:
+        root = name.split(".", 1)[0]
+        totals[root] = totals.get(root, 0) + self_us
+    return totals
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--budget-ms", type=float, default=None, help="tổng thời gian import tối đa")
+    parser.add_argument("--forbid", default=DEFAULT_FORBIDDEN, help="package không được load khi import")
+    args = parser.parse_args()
+
+    timings, rss_kb, modules = run_probe(args.module)
+    totals = package_totals(timings)
+    total_ms = sum(totals.values()) / 1000.0
+
+    print(f"[bench] import {args.module}: {total_ms:.0f}ms, max RSS {rss_kb / 1024:.1f}MB, {len(modules)} modules")
+    print(f"{'package':<30} {'self ms':>14}")
+    for root, us in sorted(totals.items(), key=lambda kv: -kv[1])[: args.top]:
+        print(f"{root:<30} {us / 1000.0:>14.1f}")
+
+    failures = []
+    forbidden = [f.strip() for f in args.forbid.split(",") if f.strip()]
+    loaded = sorted({m.split(".", 1)[0] for m in modules} & set(forbidden))
+    if loaded:
+        failures.append(f"heavy modules loaded at startup: {', '.join(loaded)}")
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        failures.append(f"import time {total_ms:.0f}ms > budget {args.budget_ms:.0f}ms")
+
+    for failure in failures:
+        print(f"[bench] ❌ {failure}")
+    if failures:
+        raise SystemExit(1)
+    print("[bench] ✅ import budget OK")
+
+
+if __name__ == "__main__":
+    main()
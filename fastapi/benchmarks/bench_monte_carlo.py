@@ -0,0 +1,54 @@
+# benchmarks/bench_monte_carlo.py
+"""
+Đo thời gian phân tích Monte Carlo (monte_carlo.run_monte_carlo) theo số lệnh / số ngày,
+mỗi phương pháp riêng, trên lợi nhuận giả lập. Mục tiêu: 10.000 đường << 1s cho 1 job thường.
+
+    cd fastapi && python -m benchmarks.bench_monte_carlo [--trades 100,500,2000]
+        [--days 2500,10000] [--simulations 10000]
+"""
+
+import argparse
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+from app.services.monte_carlo import ALL_METHODS, MonteCarloOptions, run_monte_carlo
+from benchmarks.bench_engine import _int_list
+
+INITIAL_CAPITAL = 100_000.0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trades", type=_int_list, default=[100, 500, 2000])
+    parser.add_argument("--days", type=_int_list, default=[2500, 10000])
+    parser.add_argument("--simulations", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    rows: List[Dict[str, Any]] = []
+    for n_trades in args.trades:
+        for n_days in args.days:
+            trade_rets = rng.normal(0.002, 0.03, n_trades)
+            closes = INITIAL_CAPITAL * np.exp(np.cumsum(rng.normal(0.0003, 0.01, n_days)))
+            row: Dict[str, Any] = {"trades": n_trades, "days": n_days}
+            for method in ALL_METHODS:
+                options = MonteCarloOptions(simulations=args.simulations, methods=(method,), seed=args.seed)
+                started = time.perf_counter()
+                run_monte_carlo(trade_rets, closes, INITIAL_CAPITAL, options)
+                row[method] = time.perf_counter() - started
+            rows.append(row)
+
+    print(f"{args.simulations:,} simulations / method")
+    header = "".join(f"{m:>24}" for m in ALL_METHODS)
+    print(f"{'trades':>8} {'days':>8}{header} {'total s':>9}")
+    for row in rows:
+        cells = "".join(f"{row[m]:>24.3f}" for m in ALL_METHODS)
+        total = sum(row[m] for m in ALL_METHODS)
+        print(f"{row['trades']:>8,} {row['days']:>8,}{cells} {total:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# benchmarks/bench_portfolio.py
+"""
+Portfolio backtest (portfolio_engine) trên dữ liệu GBM giả lập:
+  1. Thời gian dựng price panel (giá + chỉ báo theo cột 2D) theo số mã, lần đầu (cold, load giá)
+     và lần 2 (warm, giá đã trong price cache) - chi phí mỗi mã giảm dần khi số mã tăng.
+  2. Parity: signal entry/exit của panel (trên các bar valid) phải trùng với build_strategy_signals
+     của engine 1 mã cho từng mã, kể cả mã có bar trống ở giữa (mỗi 7 bar mất 1) và mã niêm yết muộn.
+
+    cd fastapi && python -m benchmarks.bench_portfolio [--symbols 5,50,200] [--bars 2500]
+"""
+
+import argparse
+import contextlib
+import io
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import app.services.backtest_engine as engine
+from app.models.backtest_models import PortfolioJobMessage
+from app.services.portfolio_engine import build_panel_signals, load_price_panel
+from benchmarks.bench_engine import _int_list, _reset_caches, make_job
+from benchmarks.synthetic import SyntheticPriceSource, make_gbm_ohlcv, make_rule_set
+
+
+def _cross(indicator: str, fast: Dict[str, Any], slow: Dict[str, Any]) -> List[Dict[str, Any]]:
+    def side(op: str) -> Dict[str, Any]:
+        return {
+            "indicator": indicator, "params": fast, "operator": op,
+            "compare_to": {"indicator": indicator, "params": slow},
+        }
+    return [
+        {"action": "BUY", "condition": side("cross_over")},
+        {"action": "SELL", "condition": side("cross_under")},
+    ]
+
+
+STRATEGIES: Dict[str, Optional[List[Dict[str, Any]]]] = {
+    "default": None,
+    "sma_cross": _cross("SMA", {"period": 5}, {"period": 30}),
+    "ema_cross": _cross("EMA", {"period": 5}, {"period": 20}),
+    "rules_5": make_rule_set(5),
+}
+
+
+def make_gappy_universe(n_bars: int, seed: int) -> Dict[str, pd.DataFrame]:
+    """S0 đầy đủ, S1 mất mỗi bar thứ 7, S2 niêm yết muộn (bắt đầu giữa khoảng backtest)."""
+    s1 = make_gbm_ohlcv(n_bars, seed=seed + 1)
+    s2 = make_gbm_ohlcv(n_bars, seed=seed + 2)
+    return {
+        "S0": make_gbm_ohlcv(n_bars, seed=seed),
+        "S1": s1[np.arange(len(s1)) % 7 != 3].reset_index(drop=True),
+        "S2": s2.iloc[n_bars // 3:].reset_index(drop=True),
+    }
+
+
+def check_parity(job: PortfolioJobMessage) -> Dict[str, Any]:
+    """So signal panel với engine 1 mã cho từng mã -> số bar lệch của mỗi mã."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        panel = load_price_panel(job)
+    entry, exit_, valid = build_panel_signals(job, panel)
+
+    mismatches: Dict[str, int] = {}
+    for j, symbol in enumerate(panel.symbols):
+        single_job = engine.BacktestJobMessage(**job.model_dump(exclude={"symbols"}) | {"symbol": symbol})
+        with contextlib.redirect_stdout(io.StringIO()):
+            df = engine.load_data_as_dataframe(single_job)
+        signals = engine.build_strategy_signals(engine.get_user_rules(single_job), df, single_job.job_config)
+
+        # Bar valid của panel phải đúng là các bar của engine 1 mã
+        rows = np.flatnonzero(valid[:, j])
+        same_bars = np.array_equal(panel.ts[rows], df["ts"].to_numpy(dtype=np.int64))
+        if not same_bars:
+            mismatches[symbol] = -1
+            continue
+        keep = signals.valid
+        mismatches[symbol] = int(
+            np.count_nonzero(entry[rows, j] != (signals.entry & keep))
+            + np.count_nonzero(exit_[rows, j] != (signals.exit & keep))
+        )
+    return mismatches
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--symbols", type=_int_list, default=[5, 50, 200])
+    parser.add_argument("--bars", type=int, default=2500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    previous = engine.price_source
+    try:
+        print(f"{'symbols':>8} {'cold s':>8} {'warm s':>8} {'warm ms/symbol':>15}")
+        for n_symbols in args.symbols:
+            frames = {f"S{i:04d}": make_gbm_ohlcv(args.bars, seed=args.seed + i) for i in range(n_symbols)}
+            engine.set_price_source(SyntheticPriceSource(frames).as_price_source())
+            base = make_job(next(iter(frames.values())), 5)
+            job = PortfolioJobMessage(**base.model_dump(exclude={"symbol"}), symbols=list(frames))
+            _reset_caches()
+            timings = []
+            # cold: giá load từ nguồn; warm: giá đã nằm trong price cache -> chủ yếu là tính chỉ báo
+            for _ in range(2):
+                started = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    load_price_panel(job)
+                timings.append(time.perf_counter() - started)
+            cold, warm = timings
+            print(f"{n_symbols:>8,} {cold:>8.3f} {warm:>8.3f} {1000 * warm / n_symbols:>15.2f}")
+
+        frames = make_gappy_universe(args.bars, args.seed)
+        engine.set_price_source(SyntheticPriceSource(frames).as_price_source())
+        print("\nparity (bar lệch / mã, -1 = tập bar khác engine 1 mã):")
+        for name, rules in STRATEGIES.items():
+            base = make_job(frames["S0"], 0)
+            strategy = {"name": name, "rules": rules} if rules else None
+            job = PortfolioJobMessage(
+                **base.model_dump(exclude={"symbol", "strategy"}), strategy=strategy, symbols=list(frames)
+            )
+            _reset_caches()
+            mismatches = check_parity(job)
+            ok = all(v == 0 for v in mismatches.values())
+            print(f"  {name:<10} {mismatches} {'OK' if ok else 'MISMATCH'}")
+    finally:
+        engine.set_price_source(previous)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# benchmarks/bench_screener.py
+"""
+So sánh screener cả universe (screener.run_screener) với cách cũ: 1 run_backtest / mã,
+trên dữ liệu GBM giả lập (mỗi mã 1 seed, độ dài lịch sử khác nhau). In thời gian, số query
+bulk và kiểm tra metric của từng mã trùng với run_backtest của chính mã đó.
+
+    cd fastapi && python -m benchmarks.bench_screener [--symbols 100,500] [--bars 2500]
+        [--rules 0,5] [--workers 0]
+"""
+
+import argparse
+import contextlib
+import io
+import time
+from typing import Any, Dict, List
+
+import app.services.backtest_engine as engine
+from app.models.backtest_models import ScreenerJobMessage
+from app.services.screener import run_screener
+from benchmarks.bench_engine import _int_list, _reset_caches, make_job
+from benchmarks.synthetic import SyntheticPriceSource, make_gbm_ohlcv
+
+METRICS = ("netProfit", "winRate", "maxDrawdown", "profitFactor", "totalTrades")
+
+
+class _CountingSource(SyntheticPriceSource):
+    """SyntheticPriceSource đếm số lần đọc giá (mỗi lần ~ 1 query trên Postgres)."""
+
+    def __init__(self, frames: Dict[str, Any]) -> None:
+        super().__init__(frames)
+        self.reads = 0
+
+    def fetch_bulk(self, symbols, start, end):
+        self.reads += 1
+        return super().fetch_bulk(symbols, start, end)
+
+    def fetch(self, symbol, start, end, start_exclusive=False):
+        self.reads += 1
+        return super().fetch(symbol, start, end, start_exclusive)
+
+    def fetch_warmup(self, symbol, start, end, bars):
+        self.reads += 1
+        return super().fetch_warmup(symbol, start, end, bars)
+
+
+def make_universe(n_symbols: int, n_bars: int, seed: int) -> Dict[str, Any]:
+    # Mã sau có lịch sử ngắn dần (niêm yết muộn) -> shard có độ dài không đều như dữ liệu thật
+    return {
+        f"S{i:04d}": make_gbm_ohlcv(n_bars, seed=seed + i).iloc[(i % 7) * n_bars // 20:].reset_index(drop=True)
+        for i in range(n_symbols)
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--symbols", type=_int_list, default=[100, 500])
+    parser.add_argument("--bars", type=int, default=2500)
+    parser.add_argument("--rules", type=_int_list, default=[0, 5])
+    parser.add_argument("--workers", type=int, default=0, help="0 = số core")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rows: List[Dict[str, Any]] = []
+    for n_symbols in args.symbols:
+        source = _CountingSource(make_universe(n_symbols, args.bars, args.seed))
+        previous = engine.set_price_source(source.as_price_source())
+        try:
+            for n_rules in args.rules:
+                print(f"[bench] {n_symbols} symbols x {args.bars:,} bars x {n_rules} rules ...", flush=True)
+                base = make_job(make_gbm_ohlcv(args.bars, seed=args.seed), n_rules)
+                job = ScreenerJobMessage(**base.model_dump(exclude={"symbol"}), max_workers=args.workers or None)
+
+                _reset_caches()
+                source.reads = 0
+                started = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    screened = run_screener(job)
+                screener_s = time.perf_counter() - started
+                screener_reads = source.reads
+
+                _reset_caches()
+                source.reads = 0
+                started = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    singles = {
+                        symbol: engine.run_backtest(base.model_copy(update={"symbol": symbol}))
+                        for symbol in sorted(source.frames)
+                    }
+                per_job_s = time.perf_counter() - started
+
+                by_symbol = {row.symbol: row for row in screened.results}
+                match = screened.status == "COMPLETED" and len(by_symbol) == len(singles) and all(
+                    getattr(by_symbol[symbol], m) == getattr(result, m)
+                    for symbol, result in singles.items()
+                    for m in METRICS
+                )
+                rows.append({
+                    "symbols": n_symbols,
+                    "rules": n_rules,
+                    "screener_s": screener_s,
+                    "screener_reads": screener_reads,
+                    "per_job_s": per_job_s,
+                    "per_job_reads": source.reads,
+                    "match": match,
+                })
+        finally:
+            engine.set_price_source(previous)
+
+    print(
+        f"{'symbols':>8} {'rules':>5} {'screener s':>11} {'reads':>6} "
+        f"{'per-job s':>10} {'reads':>6} {'speedup':>8} {'match':>6}"
+    )
+    for row in rows:
+        print(
+            f"{row['symbols']:>8,} {row['rules']:>5} {row['screener_s']:>11.2f} {row['screener_reads']:>6} "
+            f"{row['per_job_s']:>10.2f} {row['per_job_reads']:>6} "
+            f"{row['per_job_s'] / row['screener_s']:>7.1f}x {str(row['match']):>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# benchmarks/bench_streaming.py
+"""
+So sánh backtest in-memory và streaming (streaming_engine) trên dữ liệu GBM giả lập:
+thời gian, bộ nhớ đỉnh (tracemalloc: mọi mảng NumPy / DataFrame đều được theo dõi) và parity kết quả.
+Bộ nhớ đỉnh của streaming phải gần như không đổi khi số bar tăng (chỉ tăng theo số lệnh).
+
+    cd fastapi && python -m benchmarks.bench_streaming [--bars 100000,1000000,3000000]
+        [--rules 0,5] [--chunk-rows 50000] [--max-points 2000]
+"""
+
+import argparse
+import contextlib
+import io
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+import app.services.backtest_engine as engine
+from app.services.streaming_engine import STREAM_CHUNK_ROWS, run_backtest_streaming
+from benchmarks.bench_engine import SYMBOL, _int_list, _reset_caches, make_job
+from benchmarks.synthetic import SyntheticPriceSource, make_gbm_ohlcv
+
+
+def _measure(fn: Callable[[], Any]) -> Tuple[Any, float, float]:
+    """(kết quả, giây, MB cấp phát đỉnh); tracemalloc làm chậm vòng lặp Python -> đo thời gian ở lượt riêng."""
+    quiet = contextlib.redirect_stdout(io.StringIO())
+    _reset_caches()
+    started = time.perf_counter()
+    with quiet:
+        result = fn()
+    seconds = time.perf_counter() - started
+
+    _reset_caches()
+    tracemalloc.start()
+    try:
+        with quiet:
+            fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak / 1024 / 1024
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bars", type=_int_list, default=[100_000, 1_000_000, 3_000_000])
+    parser.add_argument("--rules", type=_int_list, default=[0, 5])
+    parser.add_argument("--chunk-rows", type=int, default=STREAM_CHUNK_ROWS)
+    parser.add_argument("--max-points", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    source = SyntheticPriceSource({})
+    previous = engine.set_price_source(source.as_price_source())
+    rows: List[Dict[str, Any]] = []
+    try:
+        for n_bars in args.bars:
+            source.frames[SYMBOL] = make_gbm_ohlcv(n_bars, seed=args.seed)
+            for n_rules in args.rules:
+                print(f"[bench] {n_bars:,} bars x {n_rules} rules ...", flush=True)
+                job = make_job(source.frames[SYMBOL], n_rules)
+                job.job_config = {**job.job_config, "max_points": args.max_points}
+                memory, mem_s, mem_mb = _measure(lambda: engine.run_backtest(job))
+                stream, stream_s, stream_mb = _measure(
+                    lambda: run_backtest_streaming(job, chunk_rows=args.chunk_rows)
+                )
+                rows.append({
+                    "bars": n_bars,
+                    "rules": n_rules,
+                    "memory_s": mem_s,
+                    "memory_mb": mem_mb,
+                    "stream_s": stream_s,
+                    "stream_mb": stream_mb,
+                    "match": memory.model_dump() == stream.model_dump(),
+                })
+    finally:
+        engine.set_price_source(previous)
+
+    print(f"{'bars':>10} {'rules':>5} {'mem s':>8} {'mem MB':>8} {'stream s':>9} {'stream MB':>10} {'match':>6}")
+    for row in rows:
+        print(
+            f"{row['bars']:>10,} {row['rules']:>5} {row['memory_s']:>8.2f} {row['memory_mb']:>8.1f} "
+            f"{row['stream_s']:>9.2f} {row['stream_mb']:>10.1f} {str(row['match']):>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
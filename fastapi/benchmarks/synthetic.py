@@ -0,0 +1,169 @@
+# benchmarks/synthetic.py
+"""
+Dữ liệu giá giả lập cho benchmark (không cần Postgres):
+  - make_gbm_ohlcv: chuỗi OHLCV theo Geometric Brownian Motion
+  - SyntheticPriceSource: PriceSource trả dữ liệu giả lập, cắm vào engine qua set_price_source()
+  - make_rule_set: strategy.rules với N rule (SMA/EMA/RSI/MACD/BOLLINGER xen kẽ BUY/SELL)
+"""
+
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from app.services.backtest_engine import PriceSource
+
+# pandas Timestamp chỉ tới năm 2262 -> chuỗi dài hơn ~50k phiên dùng bar phút
+DAILY_BAR_LIMIT = 50_000
+START_DATE = "2000-01-03"
+
+
+def make_gbm_ohlcv(
+    n_bars: int,
+    seed: int = 0,
+    s0: float = 100.0,
+    mu: float = 0.08,
+    sigma: float = 0.25,
+    bar_seconds: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    OHLCV GBM (mu, sigma theo năm) với các cột giống query "StockPrice" của engine:
+    ts, trade_date, open, high, low, close, volume.
+    bar_seconds: None -> 1 ngày (<= DAILY_BAR_LIMIT bar) hoặc 1 phút (dài hơn).
+    """
+    if bar_seconds is None:
+        bar_seconds = 86_400 if n_bars <= DAILY_BAR_LIMIT else 60
+    rng = np.random.default_rng(seed)
+    dt = bar_seconds / (252 * 86_400) if bar_seconds >= 86_400 else bar_seconds / (252 * 6.5 * 3600)
+
+    log_ret = rng.normal((mu - 0.5 * sigma ** 2) * dt, sigma * np.sqrt(dt), n_bars)
+    close = s0 * np.exp(np.cumsum(log_ret))
+    prev_close = np.concatenate(([s0], close[:-1]))
+    open_ = prev_close * np.exp(rng.normal(0.0, 0.25 * sigma * np.sqrt(dt), n_bars))
+    wick = np.abs(rng.normal(0.0, 0.5 * sigma * np.sqrt(dt), (2, n_bars)))
+    high = np.maximum(open_, close) * np.exp(wick[0])
+    low = np.minimum(open_, close) * np.exp(-wick[1])
+    volume = np.round(rng.lognormal(12.0, 0.5, n_bars))
+
+    start_ts = int(pd.Timestamp(START_DATE).timestamp())
+    ts = start_ts + np.arange(n_bars, dtype=np.int64) * bar_seconds
+    return pd.DataFrame({
+        "ts": ts,
+        "trade_date": pd.to_datetime(ts, unit="s"),
+        "open": open_,
+        "high": high,
+        "low": low,
+        "close": close,
+        "volume": volume,
+    })
+
+
+class SyntheticPriceSource:
+    """Nguồn giá trong bộ nhớ: symbol -> DataFrame OHLCV (đã sort theo trade_date)."""
+
+    def __init__(self, frames: Dict[str, pd.DataFrame]) -> None:
+        self.frames = frames
+
+    def _slice(self, symbol: str, start: datetime, end: datetime, start_exclusive: bool = False) -> pd.DataFrame:
+        df = self.frames[symbol]
+        dates = df["trade_date"].to_numpy()
+        lo = np.searchsorted(dates, np.datetime64(start), side="right" if start_exclusive else "left")
+        hi = np.searchsorted(dates, np.datetime64(end), side="right")
+        return df.iloc[lo:hi].reset_index(drop=True)
+
+    def fetch(self, symbol: str, start: datetime, end: datetime, start_exclusive: bool = False) -> pd.DataFrame:
+        return self._slice(symbol, start, end, start_exclusive).copy()
+
+    def fetch_bulk(self, symbols: List[str], start: datetime, end: datetime) -> pd.DataFrame:
+        parts = []
+        for symbol in symbols:
+            if symbol in self.frames:
+                part = self._slice(symbol, start, end)
+                parts.append(part.assign(stock_symbol=symbol))
+        if not parts:
+            return pd.DataFrame(columns=["stock_symbol", *self.frames[next(iter(self.frames))].columns])
+        return pd.concat(parts).sort_values(["trade_date", "stock_symbol"]).reset_index(drop=True)
+
+    def fetch_warmup(self, symbol: str, start: datetime, end: datetime, bars: int) -> pd.DataFrame:
+        df = self.frames[symbol]
+        dates = df["trade_date"].to_numpy()
+        lo = np.searchsorted(dates, np.datetime64(start), side="left")
+        hi = np.searchsorted(dates, np.datetime64(end), side="right")
+        return df.iloc[max(0, lo - bars):hi].reset_index(drop=True).copy()
+
+    def stream(self, symbol: str, start: datetime, end: datetime, bars: int, chunk_rows: int) -> Iterator[pd.DataFrame]:
+        # Như fetch_warmup nhưng chỉ copy từng chunk (giống server-side cursor)
+        df = self.frames[symbol]
+        dates = df["trade_date"].to_numpy()
+        lo = np.searchsorted(dates, np.datetime64(start), side="left")
+        hi = np.searchsorted(dates, np.datetime64(end), side="right")
+        for offset in range(max(0, lo - bars), hi, chunk_rows):
+            yield df.iloc[offset:min(offset + chunk_rows, hi)].reset_index(drop=True).copy()
+
+    def warmup_start(self, symbols: List[str], start: datetime, bars: int) -> datetime:
+        earliest = start
+        for symbol in symbols:
+            if symbol not in self.frames or bars <= 0:
+                continue
+            dates = self.frames[symbol]["trade_date"].to_numpy()
+            lo = np.searchsorted(dates, np.datetime64(start), side="left")
+            if lo > 0:
+                earliest = min(earliest, pd.Timestamp(dates[max(0, lo - bars)]).to_pydatetime())
+        return earliest
+
+    def list_symbols(self, exchanges: Any = None, sectors: Any = None, active_only: bool = True) -> List[str]:
+        # Không có metadata sàn / ngành: universe = mọi mã đã nạp
+        return sorted(self.frames)
+
+    def data_version(self, symbol: str) -> str:
+        df = self.frames[symbol]
+        return f"synthetic:{len(df)}:{df['ts'].iat[-1] if len(df) else 0}"
+
+    def as_price_source(self) -> PriceSource:
+        return PriceSource(
+            name="synthetic",
+            fetch=self.fetch,
+            fetch_bulk=self.fetch_bulk,
+            data_version=self.data_version,
+            warmup_start=self.warmup_start,
+            fetch_warmup=self.fetch_warmup,
+            stream=self.stream,
+            list_symbols=self.list_symbols,
+        )
+
+
+# ============================================================
+# RULE SETS
+# ============================================================
+
+def _indicator(name: str, **params: Any) -> Dict[str, Any]:
+    return {"indicator": name, "params": params}
+
+
+# (vế trái, operator, vế phải) - đủ loại indicator để benchmark cả DAG chỉ báo
+_RULE_TEMPLATES = [
+    lambda k: (_indicator("SMA", period=5 + k), "cross_over", _indicator("SMA", period=30 + 5 * k)),
+    lambda k: (_indicator("RSI", period=7 + k), "<", {"value": 30 + k % 10}),
+    lambda k: (_indicator("EMA", period=8 + k), "cross_under", _indicator("EMA", period=21 + 3 * k)),
+    lambda k: (
+        _indicator("MACD", fast=12, slow=26 + k, signal=9, output="macd"),
+        ">",
+        _indicator("MACD", fast=12, slow=26 + k, signal=9, output="signal"),
+    ),
+    lambda k: (_indicator("CLOSE"), "<", _indicator("BOLLINGER", period=20 + k, std_dev=2, band="lower")),
+    lambda k: (_indicator("RSI", period=14 + k), ">", {"value": 60 + k % 10}),
+]
+
+
+def make_rule_set(n_rules: int) -> List[Dict[str, Any]]:
+    """N rule xen kẽ BUY/SELL, tham số khác nhau -> số cột chỉ báo tăng theo N."""
+    rules = []
+    for i in range(n_rules):
+        left, operator, right = _RULE_TEMPLATES[i % len(_RULE_TEMPLATES)](i // len(_RULE_TEMPLATES))
+        rules.append({
+            "ruleOrder": i + 1,
+            "action": "BUY" if i % 2 == 0 else "SELL",
+            "condition": {**left, "operator": operator, "compare_to": right},
+        })
+    return rules